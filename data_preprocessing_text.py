@@ -7,6 +7,9 @@ from scipy.sparse import lil_matrix
 from sklearn.preprocessing import LabelEncoder
 import os
 import datetime
+import multithread_data_preparation
+import multithread_training_preprocessing
+import pipeline_metrics
 
 # %% set up logging
 logging.basicConfig(
@@ -24,17 +27,35 @@ strDataName = 'text.parquet'
 # output file name
 strOutputName = 'sequences.parquet'
 
+# generate the documents in memory instead of reading the processed files
+blnInMemory = False
+intInMemoryDocuments = 30000
+
+# collect timings and counters of the run and save them to a metrics file
+blnMetrics = False
+
+# start the metrics of the run
+pipeline_metrics.Enable(blnMetrics)
+
 # %% data import
-# import data
-dtfText = pd.read_parquet(os.path.join(strDataPath, 'text.parquet'))
-dtfAnnotations = pd.read_parquet(
-    os.path.join(strDataPath, 'annotations.parquet')
-)
+if blnInMemory:
+    # generate and ingest the documents without intermediate files
+    dtfText, dtfAnnotations = multithread_training_preprocessing.\
+        tplIngestStream(
+            multithread_data_preparation.itrGenerateBatches(
+                intInMemoryDocuments
+            )
+        )
+else:
+    # import data, the parts of incremental ingestion runs are joined
+    dtfText, dtfAnnotations = multithread_training_preprocessing.\
+        tplReadBackup(strDataPath)
 
 # %% text data tokenization
 
 # timestamp
 logging.info('Process start')
+pipeline_metrics.Checkpoint('data_import')
 
 # extract texts to a list
 lstTexts = dtfText['text'].tolist()
@@ -53,6 +74,8 @@ lstSequences = objTokenizer.texts_to_sequences(lstTexts)
 
 # timestamp
 logging.info('Tokenization finished')
+pipeline_metrics.Checkpoint('tokenization')
+pipeline_metrics.Count('docs_tokenized', len(lstTexts))
 
 # find maximum sequence length
 intMax = max(len(lstSeq) for lstSeq in lstSequences)
@@ -72,17 +95,21 @@ dtfText['sequence'] = lstPadded
 
 # timestamp
 logging.info('Padding finished')
+pipeline_metrics.Checkpoint('padding')
+pipeline_metrics.Count('rows_padded', len(lstPadded))
 
-# merge the padded sequences to the annotations data frame
+# merge the padded sequences to the annotations data frame on the integer
+# content hash of their texts
 dtfAnnotations = pd.merge(
     dtfAnnotations,
-    dtfText[['hash', 'sequence']],
+    dtfText[multithread_training_preprocessing.lstHashColumns + ['sequence']],
     how='left',
-    on=['hash']
+    on=multithread_training_preprocessing.lstHashColumns
 )
 
 # timestamp
 logging.info('Merging finished')
+pipeline_metrics.Checkpoint('merging')
 
 # %% encode labels
 # extract labels
@@ -102,6 +129,8 @@ dtfAnnotations['label_encoded'] = dtfAnnotations['label_encoded'] + 1
 
 # timestamp
 logging.info('Encoding finished')
+pipeline_metrics.Checkpoint('encoding')
+pipeline_metrics.Count('annotations_encoded', len(dtfAnnotations))
 
 # %% output sequences
 
@@ -118,6 +147,7 @@ arrLabels = np.array(dtfAnnotations['label_encoded'])
 
 # timestamp
 logging.info('Loading to numpy finished')
+pipeline_metrics.Checkpoint('loading_to_numpy')
 
 # prepare output sequences using vectorization
 for intIndex in range(arrStart.shape[0]):
@@ -135,12 +165,14 @@ for intIndex in range(arrStart.shape[0]):
 
 # timestamp
 logging.info('Output sequences preparation finished')
+pipeline_metrics.Checkpoint('output_sequences')
 
 # convert the sparse matrix to a numpy array
 arrOutSeq = sparseOutSeq.toarray()
 
 # timestamp
 logging.info('Conversion to numpy finished')
+pipeline_metrics.Checkpoint('conversion_to_numpy')
 
 # %% save outputs
 
@@ -149,6 +181,7 @@ np.save(os.path.join(strDataPath, 'y.npy'), arrOutSeq)
 
 # timestamp
 logging.info('Saving \'y\' finished')
+pipeline_metrics.Checkpoint('saving_y')
 
 # extract encoded text to numpy array
 arrData = dtfAnnotations['sequence'].to_numpy()
@@ -158,7 +191,12 @@ np.save(os.path.join(strDataPath, 'X.npy'), arrData)
 
 # timestamp
 logging.info('Saving \'X\' finished')
+pipeline_metrics.Checkpoint('saving_x')
 
 # extract label encodings and save in a separate file
 dtfExtract = dtfAnnotations[['label', 'label_encoded']].drop_duplicates()
-dtfExtract.to_csv(os.path.join(strDataPath, 'label_encodings.csv'), index=False)
\ No newline at end of file
+dtfExtract.to_csv(os.path.join(strDataPath, 'label_encodings.csv'), index=False)
+pipeline_metrics.Checkpoint('saving_labels')
+
+# save the metrics of the run
+pipeline_metrics.strWriteMetrics('preprocessing')
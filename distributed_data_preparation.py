@@ -0,0 +1,408 @@
+# %% imports
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import json_shards
+import pipeline_metrics
+import multithread_data_preparation as mdp
+
+# %% set up logging
+logging.basicConfig(
+    level = logging.INFO,
+    format=' %(asctime)s -  %(levelname)s -  %(message)s'
+)
+
+# %% paths and definitions
+
+# shared folder of the work queue, every machine must see the same folder
+strPathQueue = 'c:/repositories/zzz_data_for_lstm/data/outputs/queue/'
+
+# folders of the queue states and the run description
+strPending = 'pending'
+strClaimed = 'claimed'
+strDone = 'done'
+strRunName = 'run.json'
+
+# file names of the tasks, a claimed task gets the id of its worker appended
+strTaskPrefix = 'shard-'
+strTaskExtension = '.json'
+strClaimSeparator = '@'
+
+# number of local worker processes of the stand-in mode, None for all cores
+intLocalWorkers = None
+
+# claims older than this many seconds are returned to the queue
+intClaimTimeout = 3600
+
+# %% functions
+def strTaskName(pintShard: int) -> str:
+    """Return the file name of the task of a shard.
+
+    Inputs:
+        - pintShard - sequential number of the shard
+
+    Outputs:
+        - strName - file name of the task
+    """
+
+    strName = strTaskPrefix + str(pintShard).zfill(5) + strTaskExtension
+
+    return strName
+
+def strWorkerId() -> str:
+    """Return an id of the current worker unique across machines.
+
+    Outputs:
+        - strOut - host name and process id
+    """
+
+    strOut = f'{socket.gethostname()}-{os.getpid()}'
+
+    return strOut
+
+def WriteAtomic(pdctData: dict, pstrPath: str) -> None:
+    """Save a dictionary as JSON under its final name in a single step.
+
+    Inputs:
+        - pdctData - dictionary to save
+        - pstrPath - full path of the file
+    """
+
+    strTemp = pstrPath + '.tmp'
+
+    with open(strTemp, 'w') as objOut:
+        json.dump(pdctData, objOut, indent=4)
+
+    os.replace(strTemp, pstrPath)
+
+def CreateQueue(
+    pintNumberOfFiles: int,
+    pstrQueue: str = strPathQueue,
+    pstrOutput: str = mdp.strPathOutputs,
+    pintShardSize: int = mdp.intShardSize,
+    pblnCompress: bool = mdp.blnCompressShards,
+    pintSeed: int = mdp.intSeed,
+    pblnClean: bool = mdp.blnCleanText,
+    pblnDeduplicate: bool = mdp.blnDeduplicate
+) -> None:
+    """Split a generation run to shards and list them in the work queue.
+
+    The shards are the same as the ones generated by Threading in shards mode
+    with the same shard size and seed. Creating a queue that already exists
+    with the same run description does nothing, so the coordinator can be
+    restarted safely. An enabled vocabulary store is built here once, so the
+    workers do not build it at the same time.
+
+    Inputs:
+        - pintNumberOfFiles - number of invoices to generate
+        - pstrQueue - shared folder of the work queue
+        - pstrOutput - shared output folder of the shards
+        - pintShardSize - maximum number of invoices in a shard
+        - pblnCompress - flag whether the shards are gzip compressed
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+        - pblnDeduplicate - flag whether to replace duplicates in the shards
+    """
+
+    assert pintNumberOfFiles > 0, 'The number of files must be positive'
+    assert pintShardSize > 0, 'The shard size must be positive'
+
+    # build the vocabulary store once, the workers only map it
+    if mdp.blnVocabularyStore:
+        mdp.strPrepareStore(mdp.strPathData)
+
+    dctRun = {
+        'files': pintNumberOfFiles,
+        'shard_size': pintShardSize,
+        'compress': pblnCompress,
+        'seed': pintSeed,
+        'clean': pblnClean,
+        'dedup': pblnDeduplicate,
+        'output': pstrOutput,
+        'data': mdp.strPathData,
+        'templates': mdp.strPathTemplates
+    }
+
+    strRunPath = os.path.join(pstrQueue, strRunName)
+
+    # never mix the shards of different runs in one queue
+    if os.path.isfile(strRunPath):
+        with open(strRunPath) as objFile:
+            dctExisting = json.load(objFile)
+
+        assert dctExisting == dctRun, 'The queue belongs to a different run'
+
+        return
+
+    for strState in [strPending, strClaimed, strDone]:
+        os.makedirs(os.path.join(pstrQueue, strState), exist_ok=True)
+
+    # list all tasks before publishing the run description
+    for intShard, intStart in enumerate(
+        range(0, pintNumberOfFiles, pintShardSize)
+    ):
+        WriteAtomic(
+            {
+                'shard': intShard,
+                'count': min(pintShardSize, pintNumberOfFiles - intStart)
+            },
+            os.path.join(pstrQueue, strPending, strTaskName(intShard))
+        )
+
+    WriteAtomic(dctRun, strRunPath)
+
+def dctReadRun(pstrQueue: str = strPathQueue) -> dict:
+    """Read the description of the run of a work queue.
+
+    Inputs:
+        - pstrQueue - shared folder of the work queue
+
+    Outputs:
+        - dctRun - run description saved by CreateQueue
+    """
+
+    strRunPath = os.path.join(pstrQueue, strRunName)
+    assert os.path.isfile(strRunPath), 'The work queue was not created'
+
+    with open(strRunPath) as objFile:
+        dctRun = json.load(objFile)
+
+    return dctRun
+
+def strClaimTask(pstrQueue: str, pstrWorker: str) -> str:
+    """Claim one pending task of the work queue.
+
+    The task is claimed by renaming it to the claimed folder, the rename is
+    atomic, so exactly one worker succeeds when several try the same task.
+
+    Inputs:
+        - pstrQueue - shared folder of the work queue
+        - pstrWorker - id of the claiming worker
+
+    Outputs:
+        - strClaimPath - full path of the claimed task, None if there is no
+        pending task left
+    """
+
+    strPendingPath = os.path.join(pstrQueue, strPending)
+
+    for strName in sorted(os.listdir(strPendingPath)):
+        if not strName.endswith(strTaskExtension):
+            continue
+
+        strClaimPath = os.path.join(
+            pstrQueue,
+            strClaimed,
+            strName + strClaimSeparator + pstrWorker
+        )
+
+        try:
+            os.rename(os.path.join(strPendingPath, strName), strClaimPath)
+        except (FileNotFoundError, FileExistsError):
+            # another worker was faster, try the next task
+            continue
+
+        # the rename keeps the time of the task, mark the time of the claim
+        os.utime(strClaimPath)
+
+        return strClaimPath
+
+    return None
+
+def RunWorker(pstrQueue: str = strPathQueue) -> int:
+    """Claim and generate shards of the work queue until none is pending.
+
+    Inputs:
+        - pstrQueue - shared folder of the work queue
+
+    Outputs:
+        - intShards - number of shards generated by this worker
+    """
+
+    dctRun = dctReadRun(pstrQueue)
+    strWorker = strWorkerId()
+
+    # every worker collects and saves the metrics of its own shards
+    pipeline_metrics.Enable(mdp.blnMetrics)
+
+    # load vocabularies and templates from the paths of the run
+    mdp.InitializeWorker(dctRun['data'], dctRun['templates'])
+
+    intShards = 0
+    strClaimPath = strClaimTask(pstrQueue, strWorker)
+
+    while strClaimPath is not None:
+        with open(strClaimPath) as objFile:
+            dctTask = json.load(objFile)
+
+        with pipeline_metrics.objSpan('generate_shards'):
+            mdp.GenerateShard(
+                os.path.join(
+                    dctRun['output'],
+                    json_shards.strShardName(
+                        dctTask['shard'],
+                        dctRun['compress']
+                    )
+                ),
+                dctTask['count'],
+                dctTask['shard'],
+                dctRun['seed'],
+                dctRun['clean'],
+                dctRun['dedup']
+            )
+
+        # mark the task done, the shard itself is already complete
+        strName = os.path.basename(strClaimPath).split(strClaimSeparator)[0]
+
+        try:
+            os.replace(
+                strClaimPath,
+                os.path.join(pstrQueue, strDone, strName)
+            )
+        except FileNotFoundError:
+            # the claim timed out and was requeued, the shard is regenerated
+            # identically by the next worker
+            logging.warning(f'{strWorker}: claim of {strName} was requeued')
+
+        intShards += 1
+        pipeline_metrics.Count('shards_claimed')
+        logging.info(f'{strWorker}: shard {dctTask["shard"]} done')
+
+        strClaimPath = strClaimTask(pstrQueue, strWorker)
+
+    pipeline_metrics.strWriteMetrics(f'queue_worker_{strWorker}')
+
+    return intShards
+
+def intRequeueStale(
+    pstrQueue: str = strPathQueue,
+    pintTimeout: int = intClaimTimeout
+) -> int:
+    """Return tasks claimed longer than the timeout back to the queue.
+
+    Use it for tasks of workers that died, the shards are deterministic, so a
+    slow worker finishing a requeued task writes the same shard again.
+
+    Inputs:
+        - pstrQueue - shared folder of the work queue
+        - pintTimeout - age of a claim in seconds after which it is stale
+
+    Outputs:
+        - intRequeued - number of tasks returned to the queue
+    """
+
+    strClaimedPath = os.path.join(pstrQueue, strClaimed)
+    fltNow = time.time()
+    intRequeued = 0
+
+    for strName in os.listdir(strClaimedPath):
+        strClaimPath = os.path.join(strClaimedPath, strName)
+
+        try:
+            if fltNow - os.path.getmtime(strClaimPath) < pintTimeout:
+                continue
+
+            os.rename(
+                strClaimPath,
+                os.path.join(
+                    pstrQueue,
+                    strPending,
+                    strName.split(strClaimSeparator)[0]
+                )
+            )
+        except FileNotFoundError:
+            # finished in the meantime
+            continue
+
+        intRequeued += 1
+
+    return intRequeued
+
+def dctQueueStatus(pstrQueue: str = strPathQueue) -> dict:
+    """Return the number of tasks in every state of the work queue.
+
+    Inputs:
+        - pstrQueue - shared folder of the work queue
+
+    Outputs:
+        - dctOut - number of pending, claimed and done tasks
+    """
+
+    dctOut = {
+        strState: len(os.listdir(os.path.join(pstrQueue, strState)))
+        for strState in [strPending, strClaimed, strDone]
+    }
+
+    return dctOut
+
+def RunLocal(
+    pstrQueue: str = strPathQueue,
+    pintWorkers: int = intLocalWorkers
+) -> None:
+    """Run several independent queue workers on the local machine.
+
+    The workers share nothing but the queue folder, exactly as workers on
+    different machines would.
+
+    Inputs:
+        - pstrQueue - folder of the work queue
+        - pintWorkers - number of worker processes, None for all cores
+    """
+
+    intWorkerCount = pintWorkers or os.cpu_count() or 1
+
+    # build the vocabulary store before the workers start using it
+    if mdp.blnVocabularyStore:
+        mdp.strPrepareStore(dctReadRun(pstrQueue)['data'])
+
+    lstProcesses = [
+        multiprocessing.Process(target=RunWorker, args=(pstrQueue,))
+        for _ in range(intWorkerCount)
+    ]
+
+    for objProcess in lstProcesses:
+        objProcess.start()
+
+    for objProcess in lstProcesses:
+        objProcess.join()
+
+    dctStatus = dctQueueStatus(pstrQueue)
+    assert dctStatus[strPending] == 0 and dctStatus[strClaimed] == 0, \
+        f'Unfinished tasks left in the queue: {dctStatus}'
+
+# %% run a role of the distributed generation
+if __name__ == '__main__':
+    objParser = argparse.ArgumentParser(
+        description='Generate invoices on many machines through a shared '
+        'work queue folder.'
+    )
+    objParser.add_argument(
+        'role',
+        choices=['coordinator', 'worker', 'local', 'requeue', 'status']
+    )
+    objParser.add_argument('--queue', default=strPathQueue)
+    objParser.add_argument('--files', type=int, default=mdp.intFiles)
+    objParser.add_argument('--workers', type=int, default=intLocalWorkers)
+    objParser.add_argument('--timeout', type=int, default=intClaimTimeout)
+    objArguments = objParser.parse_args()
+
+    print(datetime.datetime.now())
+
+    if objArguments.role in ['coordinator', 'local']:
+        CreateQueue(objArguments.files, objArguments.queue)
+
+    if objArguments.role == 'worker':
+        RunWorker(objArguments.queue)
+    elif objArguments.role == 'local':
+        RunLocal(objArguments.queue, objArguments.workers)
+    elif objArguments.role == 'requeue':
+        intRequeued = intRequeueStale(objArguments.queue, objArguments.timeout)
+        print(f'Requeued tasks: {intRequeued}')
+
+    print(dctQueueStatus(objArguments.queue))
+    print(datetime.datetime.now())
@@ -0,0 +1,133 @@
+# %% imports
+import numpy as np
+import hashlib
+import math
+import string
+
+# %% definitions
+
+# default probability that a new text is taken for a duplicate
+fltErrorRate = 0.001
+
+# characters ignored by the fingerprints, texts differing only in them are
+# near duplicates
+dctIgnored = str.maketrans('', '', string.punctuation)
+
+# %% functions
+def bytFingerprint(pstrText: str) -> bytes:
+    """Return a fingerprint of a text that ignores trivial differences.
+
+    Inputs:
+        - pstrText - rendered text of a document
+
+    Outputs:
+        - bytOut - 128-bit digest of the text without punctuation, in lower
+        case and with all whitespace runs collapsed to a single space
+    """
+
+    strNormalized = ' '.join(
+        pstrText.translate(dctIgnored).lower().split()
+    )
+
+    bytOut = hashlib.blake2b(
+        strNormalized.encode('utf-8'),
+        digest_size=16
+    ).digest()
+
+    return bytOut
+
+class BloomFilter:
+    """Probabilistic set of fingerprints with a fixed amount of memory.
+
+    A fingerprint never seen before is reported as seen with a probability
+    close to the error rate as long as at most the capacity of fingerprints
+    is added, the probability grows with more fingerprints. A fingerprint
+    added earlier is always reported as seen.
+    """
+
+    def __init__(self, pintCapacity: int, pfltErrorRate: float = fltErrorRate):
+        """Allocate the bit array sized for the capacity and error rate.
+
+        Inputs:
+            - pintCapacity - expected number of added fingerprints
+            - pfltErrorRate - probability of a false duplicate at capacity
+        """
+
+        assert pintCapacity > 0, 'The capacity must be positive'
+        assert 0 < pfltErrorRate < 1, 'The error rate must be between 0 and 1'
+
+        # optimal number of bits and hash functions
+        self.intBits = max(
+            64,
+            math.ceil(
+                -pintCapacity * math.log(pfltErrorRate) / math.log(2) ** 2
+            )
+        )
+        self.intHashes = max(
+            1,
+            round(self.intBits / pintCapacity * math.log(2))
+        )
+        self.arrBits = np.zeros((self.intBits + 7) // 8, dtype=np.uint8)
+
+        self.intAdded = 0
+        self.intRejected = 0
+
+    def lstPositions(self, pbytFingerprint: bytes) -> list:
+        """Return the bit positions of a fingerprint by double hashing.
+
+        Inputs:
+            - pbytFingerprint - 128-bit fingerprint, see bytFingerprint
+
+        Outputs:
+            - lstOut - list of the bit positions
+        """
+
+        intFirst = int.from_bytes(pbytFingerprint[:8], 'little')
+        intSecond = int.from_bytes(pbytFingerprint[8:16], 'little') | 1
+
+        lstOut = [
+            (intFirst + intIndex * intSecond) % self.intBits
+            for intIndex in range(self.intHashes)
+        ]
+
+        return lstOut
+
+    def blnAdd(self, pbytFingerprint: bytes) -> bool:
+        """Add a fingerprint unless it was probably seen already.
+
+        Inputs:
+            - pbytFingerprint - 128-bit fingerprint, see bytFingerprint
+
+        Outputs:
+            - blnNew - True if the fingerprint was added, False for a
+            duplicate
+        """
+
+        lstPositions = self.lstPositions(pbytFingerprint)
+
+        blnNew = not all(
+            self.arrBits[intPosition >> 3] & (1 << (intPosition & 7))
+            for intPosition in lstPositions
+        )
+
+        if blnNew:
+            for intPosition in lstPositions:
+                self.arrBits[intPosition >> 3] |= 1 << (intPosition & 7)
+
+            self.intAdded += 1
+        else:
+            self.intRejected += 1
+
+        return blnNew
+
+    def fltRejectionRate(self) -> float:
+        """Return the share of rejected fingerprints.
+
+        Outputs:
+            - fltOut - rejected fingerprints out of all checked ones
+        """
+
+        intChecked = self.intAdded + self.intRejected
+        fltOut = self.intRejected / intChecked if intChecked else 0.0
+
+        return fltOut
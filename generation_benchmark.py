@@ -0,0 +1,345 @@
+# %% imports
+import numpy as np
+import pandas as pd
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import multithread_data_preparation as mdp
+
+# %% definitions
+
+# number of timed calls of the component stages and of the whole documents
+intRuns = 5000
+intDocumentRuns = 500
+
+# number of untimed calls before the measurement
+intWarmup = 50
+
+# numbers of invoice items of the whole document benchmarks
+lstItemCounts = [1, 5, 20]
+
+# number of documents of a timed GenerateJSONBatch call
+intBatchDocuments = 50
+
+# reported latency percentiles
+lstPercentiles = [50, 90, 99]
+
+# paths
+strPathBenchmarks = \
+    'c:/repositories/zzz_data_for_lstm/data/outputs/benchmarks/'
+
+# file name
+strBenchmarkPrefix = 'generation_benchmark_'
+
+# %% functions
+def dctTimeCalls(
+    pfnCall,
+    pintRuns: int,
+    pstrUnit: str = 'call',
+    pintWarmup: int = intWarmup
+) -> dict:
+    """Time repeated calls of a function one by one.
+
+    Inputs:
+        - pfnCall - function to time, it gets the index of the call as its
+        only argument
+        - pintRuns - number of timed calls
+        - pstrUnit - what a single call produces, 'call' or 'document'
+        - pintWarmup - number of untimed calls before the measurement
+
+    Outputs:
+        - dctOut - number of calls, calls per second and latency statistics
+        of a single call in microseconds
+    """
+
+    assert pintRuns > 0, 'The number of runs must be positive'
+
+    for intIndex in range(pintWarmup):
+        pfnCall(intIndex)
+
+    arrLatency = np.empty(pintRuns, dtype=np.int64)
+
+    for intIndex in range(pintRuns):
+        intStart = time.perf_counter_ns()
+        pfnCall(intIndex)
+        arrLatency[intIndex] = time.perf_counter_ns() - intStart
+
+    # convert to microseconds
+    arrLatency = arrLatency / 1e3
+    fltTotal = arrLatency.sum() / 1e6
+
+    dctOut = {
+        'unit': pstrUnit,
+        'calls': pintRuns,
+        'total_s': fltTotal,
+        'per_sec': pintRuns / fltTotal,
+        'mean_us': float(arrLatency.mean())
+    }
+
+    for intPercentile in lstPercentiles:
+        dctOut[f'p{intPercentile}_us'] = float(
+            np.percentile(arrLatency, intPercentile)
+        )
+
+    dctOut['max_us'] = float(arrLatency.max())
+
+    return dctOut
+
+def strGitRevision() -> str:
+    """Return the commit of the benchmarked code if available.
+
+    Outputs:
+        - strRevision - hash of the current git commit or None
+    """
+
+    try:
+        strRevision = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except Exception:
+        strRevision = None
+
+    return strRevision
+
+def dctRunBenchmarks(
+    pintRuns: int = intRuns,
+    pintDocumentRuns: int = intDocumentRuns,
+    pintSeed: int = mdp.intSeed
+) -> dict:
+    """Benchmark every generation stage separately and whole documents.
+
+    Inputs:
+        - pintRuns - number of timed calls of each component stage
+        - pintDocumentRuns - number of timed documents for each item count
+        - pintSeed - seed of the benchmark random number generator
+
+    Outputs:
+        - dctOut - dictionary with the environment of the run under 'meta'
+        and the results of every stage under 'results'
+    """
+
+    mdp.InitializeWorker()
+    objRNG = np.random.default_rng(pintSeed)
+
+    dctResults = dict()
+
+    # template selection and item list expansion
+    dctResults['strGetRandomTemplate'] = dctTimeCalls(
+        lambda intIndex: mdp.strGetRandomTemplate(objRNG),
+        pintRuns
+    )
+
+    lstTemplates = mdp.objTemplateRegistry.lstTexts
+    dctResults['strRandomizeTemplateItems'] = dctTimeCalls(
+        lambda intIndex: mdp.strRandomizeTemplateItems(
+            lstTemplates[intIndex % len(lstTemplates)],
+            objRNG
+        ),
+        pintRuns
+    )
+
+    # token search in expanded templates
+    lstTexts = [
+        mdp.strRandomizeTemplateItems(strTemplate, objRNG)
+        for strTemplate in lstTemplates
+    ]
+    dctResults['tplFindEarliestToken'] = dctTimeCalls(
+        lambda intIndex: mdp.tplFindEarliestToken(
+            lstTexts[intIndex % len(lstTexts)],
+            mdp.lstTokens
+        ),
+        pintRuns
+    )
+
+    # vocabulary draws and dates
+    for strName, objSampler in mdp.dctVocabularies.items():
+        dctResults[f'vocabulary_{strName}'] = dctTimeCalls(
+            lambda intIndex, objSampler=objSampler: objSampler.strDraw(objRNG),
+            pintRuns
+        )
+
+    dctResults['strRandomDate'] = dctTimeCalls(
+        lambda intIndex: mdp.strRandomDate(objRNG),
+        pintRuns
+    )
+
+    # serialization and write of generated documents
+    lstJSON = mdp.lstGenerateBatch(len(lstTemplates) * 10, objRNG, False)
+    lstStrJSON = [json.dumps(dctJSON, indent=4) for dctJSON in lstJSON]
+
+    dctResults['json_dumps'] = dctTimeCalls(
+        lambda intIndex: json.dumps(
+            lstJSON[intIndex % len(lstJSON)],
+            indent=4
+        ),
+        pintRuns,
+        'document'
+    )
+
+    strTemp = tempfile.mkdtemp()
+
+    def WriteFile(pintIndex: int) -> None:
+        strPath = os.path.join(strTemp, f'write_{pintIndex}.json')
+
+        with open(strPath, 'w') as objOut:
+            objOut.write(lstStrJSON[pintIndex % len(lstStrJSON)])
+
+    try:
+        dctResults['file_write'] = dctTimeCalls(
+            WriteFile,
+            pintDocumentRuns,
+            'document'
+        )
+
+        # whole documents including the write with a fixed number of items
+        for intItems in lstItemCounts:
+            dctResults[f'GenerateJSON_{intItems}_items'] = dctTimeCalls(
+                lambda intIndex, intItems=intItems: mdp.GenerateJSON(
+                    os.path.join(strTemp, f'doc_{intItems}_{intIndex}.json'),
+                    objRNG,
+                    intItems
+                ),
+                pintDocumentRuns,
+                'document'
+            )
+
+        # batches of documents written directly and by the write-behind
+        # thread, every call ends with all files of its batch written
+        blnWriteBehind = mdp.blnWriteBehind
+
+        try:
+            for blnMode in [False, True]:
+                mdp.blnWriteBehind = blnMode
+                strName = 'write_behind' if blnMode else 'direct'
+
+                dctResults[f'GenerateJSONBatch_{strName}'] = dctTimeCalls(
+                    lambda intIndex, strName=strName: mdp.GenerateJSONBatch(
+                        [
+                            os.path.join(
+                                strTemp,
+                                f'batch_{strName}_{intIndex}_{intDoc}.json'
+                            )
+                            for intDoc in range(intBatchDocuments)
+                        ],
+                        objRNG,
+                        False
+                    ),
+                    max(1, pintDocumentRuns // intBatchDocuments),
+                    pintWarmup=1
+                )
+        finally:
+            mdp.blnWriteBehind = blnWriteBehind
+    finally:
+        shutil.rmtree(strTemp, ignore_errors=True)
+
+    dctOut = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'revision': strGitRevision(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'templates': len(lstTemplates),
+            'seed': pintSeed,
+            'runs': pintRuns,
+            'document_runs': pintDocumentRuns
+        },
+        'results': dctResults
+    }
+
+    return dctOut
+
+def strSaveResults(
+    pdctResults: dict,
+    pstrPath: str = strPathBenchmarks
+) -> str:
+    """Save benchmark results to a JSON file named by the time of the run.
+
+    Inputs:
+        - pdctResults - output of dctRunBenchmarks
+        - pstrPath - folder for the results
+
+    Outputs:
+        - strOutPath - full path of the saved file
+    """
+
+    os.makedirs(pstrPath, exist_ok=True)
+
+    strStamp = datetime.datetime.fromisoformat(
+        pdctResults['meta']['timestamp']
+    ).strftime('%Y%m%d_%H%M%S')
+    strOutPath = os.path.join(
+        pstrPath,
+        strBenchmarkPrefix + strStamp + '.json'
+    )
+
+    with open(strOutPath, 'w') as objOut:
+        json.dump(pdctResults, objOut, indent=4)
+
+    return strOutPath
+
+def dtfResults(pdctResults: dict) -> pd.DataFrame:
+    """Convert benchmark results to a data frame with one row per stage.
+
+    Inputs:
+        - pdctResults - output of dctRunBenchmarks or a loaded results file
+
+    Outputs:
+        - dtfOut - data frame indexed by the stage name
+    """
+
+    dtfOut = pd.DataFrame.from_dict(pdctResults['results'], orient='index')
+
+    return dtfOut
+
+def dtfCompareResults(pstrBaseline: str, pstrCurrent: str) -> pd.DataFrame:
+    """Compare two saved benchmark runs stage by stage.
+
+    Inputs:
+        - pstrBaseline - path of the results of the reference version
+        - pstrCurrent - path of the results of the new version
+
+    Outputs:
+        - dtfOut - calls per second and median latency of both runs and the
+        speedup of the current run, only stages present in both runs
+    """
+
+    with open(pstrBaseline) as objFile:
+        dtfBaseline = dtfResults(json.load(objFile))
+
+    with open(pstrCurrent) as objFile:
+        dtfCurrent = dtfResults(json.load(objFile))
+
+    dtfOut = dtfBaseline[['per_sec', 'p50_us']].join(
+        dtfCurrent[['per_sec', 'p50_us']],
+        lsuffix='_baseline',
+        rsuffix='_current',
+        how='inner'
+    )
+    dtfOut['speedup'] = dtfOut['per_sec_current'] / dtfOut['per_sec_baseline']
+
+    return dtfOut
+
+# %% run the benchmarks
+if __name__ == '__main__':
+    dctBenchmark = dctRunBenchmarks()
+
+    with pd.option_context(
+        'display.width', 200,
+        'display.max_columns', None,
+        'display.precision', 2
+    ):
+        print(dtfResults(dctBenchmark).drop(columns=['total_s']))
+
+    print(f'Results saved to {strSaveResults(dctBenchmark)}')
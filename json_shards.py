@@ -0,0 +1,547 @@
+# %% imports
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+import pipeline_metrics
+
+# optional fast JSON decoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# %% definitions
+
+# JSON decoder of the readers, 'orjson', 'json' for the standard library or
+# 'auto' for orjson when it is installed
+strJSONBackend = 'auto'
+
+# file name parts of the shards
+strShardPrefix = 'part-'
+strShardExtension = '.jsonl'
+strCompressedExtension = '.jsonl.gz'
+
+# compression level of the compressed shards, the gzip headers carry no
+# time so that the same records always give the same bytes
+intCompressLevel = 6
+
+# maximum number of writes waiting for the write-behind thread and number of
+# records of a shard serialized in one block
+intWriteQueueSize = 64
+intWriteBlockSize = 1000
+
+# %% functions
+def strShardName(pintShard: int, pblnCompress: bool = False) -> str:
+    """Return the file name of a shard.
+
+    Inputs:
+        - pintShard - sequential number of the shard
+        - pblnCompress - flag whether the shard is gzip compressed
+
+    Outputs:
+        - strName - file name of the shard
+    """
+
+    assert type(pintShard) == int, 'The shard number must be an integer'
+
+    strName = strShardPrefix + str(pintShard).zfill(5)
+
+    if pblnCompress:
+        strName += strCompressedExtension
+    else:
+        strName += strShardExtension
+
+    return strName
+
+def blnIsShard(pstrPath: str) -> bool:
+    """Check whether the file is a newline-delimited JSON shard.
+
+    Inputs:
+        - pstrPath - file name or full path
+
+    Outputs:
+        - blnOut - True for plain or compressed shard files
+    """
+
+    blnOut = pstrPath.endswith(strShardExtension) or \
+        pstrPath.endswith(strCompressedExtension)
+
+    return blnOut
+
+def strTempPath(pstrPath: str) -> str:
+    """Return a temporary name of a file unique to a single write.
+
+    Workers of the distributed generation may write the same shard at once
+    after a requeued claim, every write gets its own temporary file and the
+    last os.replace wins.
+
+    Inputs:
+        - pstrPath - full path of the final file
+
+    Outputs:
+        - strTemp - full path of the temporary file next to it
+    """
+
+    strTemp = f'{pstrPath}.{uuid.uuid4().hex}.tmp'
+
+    return strTemp
+
+def bytSerializeRecords(plstRecords: list) -> bytes:
+    """Serialize records to compact newline-delimited JSON.
+
+    Inputs:
+        - plstRecords - list of dictionaries
+
+    Outputs:
+        - bytData - UTF-8 encoded lines, one record per line
+    """
+
+    strData = ''.join(
+        json.dumps(dctRecord, separators=(',', ':')) + '\n'
+        for dctRecord in plstRecords
+    )
+
+    return strData.encode('utf-8')
+
+def WriteShard(
+    plstRecords: list,
+    pstrPath: str,
+    pobjWriter = None
+) -> str:
+    """Write records as compact newline-delimited JSON to a single shard.
+
+    The shard is compressed if the path ends with the compressed extension.
+    The data are written to a temporary file first and renamed afterwards,
+    so an existing shard is always complete.
+
+    Inputs:
+        - plstRecords - list of dictionaries to save
+        - pstrPath - full path of the shard
+        - pobjWriter - WriteBehindWriter to serialize the records while the
+        earlier blocks are compressed and written, None to write directly
+
+    Outputs:
+        - strChecksum - SHA-256 hex digest of the shard file, see
+        strFileChecksum
+    """
+
+    assert type(plstRecords) == list, 'Records must be a list'
+    assert blnIsShard(pstrPath), 'Unknown shard extension'
+
+    if pobjWriter is not None:
+        pobjWriter.SubmitShard(plstRecords, pstrPath)
+        pobjWriter.Flush()
+
+        return pobjWriter.strChecksum(pstrPath)
+
+    # serialize all records to a single block of text
+    bytData = bytSerializeRecords(plstRecords)
+
+    if pstrPath.endswith(strCompressedExtension):
+        # the same gzip header as the shards of WriteBehindWriter
+        objBuffer = io.BytesIO()
+
+        with gzip.GzipFile(
+            fileobj=objBuffer,
+            mode='wb',
+            compresslevel=intCompressLevel,
+            mtime=0
+        ) as objOut:
+            objOut.write(bytData)
+
+        bytData = objBuffer.getvalue()
+
+    # write the shard at once and publish it under the final name
+    strTemp = strTempPath(pstrPath)
+
+    with pipeline_metrics.objSpan('write_shards'):
+        with open(strTemp, 'wb') as objOut:
+            objOut.write(bytData)
+
+        os.replace(strTemp, pstrPath)
+
+    pipeline_metrics.Count('shards_written')
+    pipeline_metrics.Count('bytes_written', len(bytData))
+
+    return hashlib.sha256(bytData).hexdigest()
+
+def strFileChecksum(pstrPath: str) -> str:
+    """Return the checksum of a shard as stored on the disk.
+
+    Inputs:
+        - pstrPath - full path of the shard
+
+    Outputs:
+        - strChecksum - SHA-256 hex digest of the file
+    """
+
+    with open(pstrPath, 'rb') as objFile:
+        strChecksum = hashlib.sha256(objFile.read()).hexdigest()
+
+    return strChecksum
+
+def lstReadManifest(pstrPath: str) -> list:
+    """Read all entries of a manifest.
+
+    A manifest is a newline-delimited JSON file of entries appended by
+    AppendManifest, see the generation and the incremental ingestion for
+    their content. A line cut off by a crash is ignored.
+
+    Inputs:
+        - pstrPath - full path of the manifest
+
+    Outputs:
+        - lstEntries - list of dictionaries of the manifest lines, empty if
+        the manifest does not exist
+    """
+
+    lstEntries = []
+
+    if not os.path.isfile(pstrPath):
+        return lstEntries
+
+    with open(pstrPath) as objFile:
+        for strLine in objFile:
+            try:
+                lstEntries.append(json.loads(strLine))
+            except json.JSONDecodeError:
+                logging.warning(f'Ignoring manifest line: {strLine.strip()}')
+
+    return lstEntries
+
+def AppendManifest(pstrPath: str, pdctEntry: dict) -> None:
+    """Append an entry to a manifest and flush it to the disk.
+
+    Inputs:
+        - pstrPath - full path of the manifest
+        - pdctEntry - dictionary to append as a single line
+    """
+
+    strLine = json.dumps(pdctEntry, separators=(',', ':')) + '\n'
+
+    # start on a new line if the last write was cut off by a crash
+    if os.path.isfile(pstrPath) and os.path.getsize(pstrPath) > 0:
+        with open(pstrPath, 'rb') as objFile:
+            objFile.seek(-1, os.SEEK_END)
+
+            if objFile.read(1) != b'\n':
+                strLine = '\n' + strLine
+
+    with open(pstrPath, 'a') as objOut:
+        objOut.write(strLine)
+        objOut.flush()
+        os.fsync(objOut.fileno())
+
+def tplJSONBackend(pstrBackend: str = strJSONBackend) -> tuple:
+    """Return the JSON decoder of a backend.
+
+    Inputs:
+        - pstrBackend - 'orjson', 'json' or 'auto', see strJSONBackend
+
+    Outputs:
+        - tplOut - tuple of the name of the used backend and its function
+        decoding a single document from UTF-8 bytes
+    """
+
+    assert pstrBackend in ['auto', 'orjson', 'json'], 'Unknown JSON backend'
+    assert pstrBackend != 'orjson' or orjson is not None, \
+        'The orjson package is not installed'
+
+    if pstrBackend != 'json' and orjson is not None:
+        return 'orjson', orjson.loads
+
+    return 'json', json.loads
+
+def bytReadFile(pstrPath: str) -> bytes:
+    """Read a whole JSON file or shard in a single call.
+
+    Inputs:
+        - pstrPath - full path of the file
+
+    Outputs:
+        - bytData - content of the file, decompressed for compressed shards
+    """
+
+    assert os.path.isfile(pstrPath), 'Input must be a path to a file.'
+
+    with open(pstrPath, 'rb') as objFile:
+        bytData = objFile.read()
+
+    pipeline_metrics.Count('bytes_read', len(bytData))
+
+    if pstrPath.endswith(strCompressedExtension):
+        bytData = gzip.decompress(bytData)
+
+    return bytData
+
+def lstDecodeRecords(
+    pbytData: bytes,
+    pblnShard: bool,
+    pfnLoads = json.loads
+) -> list:
+    """Decode the documents of a JSON file or shard read to memory.
+
+    Inputs:
+        - pbytData - content of the file, see bytReadFile
+        - pblnShard - flag whether the content is newline-delimited JSON
+        - pfnLoads - function decoding a single document, see tplJSONBackend
+
+    Outputs:
+        - lstRecords - list of the decoded dictionaries
+    """
+
+    if not pblnShard:
+        return [pfnLoads(pbytData)]
+
+    lstRecords = [
+        pfnLoads(bytLine) for bytLine in pbytData.splitlines() if bytLine
+    ]
+
+    return lstRecords
+
+def lstReadShard(pstrPath: str, pstrBackend: str = strJSONBackend) -> list:
+    """Read all records of a newline-delimited JSON shard.
+
+    Inputs:
+        - pstrPath - full path of the shard
+        - pstrBackend - JSON decoder, see tplJSONBackend
+
+    Outputs:
+        - lstRecords - list of dictionaries stored in the shard
+    """
+
+    assert blnIsShard(pstrPath), 'Unknown shard extension'
+
+    lstRecords = lstDecodeRecords(
+        bytReadFile(pstrPath),
+        True,
+        tplJSONBackend(pstrBackend)[1]
+    )
+
+    return lstRecords
+
+class HashingFile:
+    """Binary file wrapper computing the checksum of everything written."""
+
+    def __init__(self, pobjFile):
+        self.objFile = pobjFile
+        self.objHash = hashlib.sha256()
+        self.intBytes = 0
+
+    def write(self, pbytData) -> int:
+        self.objHash.update(pbytData)
+        self.intBytes += len(pbytData)
+
+        return self.objFile.write(pbytData)
+
+    def flush(self) -> None:
+        self.objFile.flush()
+
+class WriteBehindWriter:
+    """Write files from a background I/O thread fed through a bounded queue.
+
+    The producer only serializes the data and submits them, the thread
+    writes, compresses and renames, so rendering overlaps the latency of the
+    file system. A full queue blocks the producer. An error of the thread is
+    raised by the next Submit, Flush or Close, writes submitted after the
+    error are skipped.
+    """
+
+    def __init__(self, pintQueueSize: int = intWriteQueueSize):
+        """Start the I/O thread.
+
+        Inputs:
+            - pintQueueSize - maximum number of writes waiting in the queue
+        """
+
+        assert pintQueueSize > 0, 'The queue size must be positive'
+
+        self.objQueue = queue.Queue(maxsize=pintQueueSize)
+        self.objError = None
+        self.dctChecksums = dict()
+        self.dctShards = dict()
+        self.intPid = os.getpid()
+        self.blnClosed = False
+
+        self.objThread = threading.Thread(target=self.Run, daemon=True)
+        self.objThread.start()
+
+    def Run(self) -> None:
+        """Process submitted writes until the writer is closed."""
+
+        while True:
+            tplJob = self.objQueue.get()
+
+            try:
+                if tplJob is None:
+                    return
+
+                if self.objError is None:
+                    self.Process(*tplJob)
+            except Exception as e:
+                self.objError = e
+                self.Abort()
+            finally:
+                self.objQueue.task_done()
+
+    def Process(self, pstrKind: str, pstrPath: str, pobjData) -> None:
+        """Execute a single write in the I/O thread.
+
+        Inputs:
+            - pstrKind - 'file' to write a whole text file, 'block' to append
+            a block of a shard, 'shard' to finish a shard
+            - pstrPath - full path of the file
+            - pobjData - text of the file, bytes of the block or None
+        """
+
+        if pstrKind == 'file':
+            with open(pstrPath, 'w') as objOut:
+                objOut.write(pobjData)
+
+        elif pstrKind == 'block':
+            # open the temporary file of the shard with its first block
+            if pstrPath not in self.dctShards:
+                objHashing = HashingFile(
+                    open(strTempPath(pstrPath), 'wb')
+                )
+                objOut = objHashing
+
+                if pstrPath.endswith(strCompressedExtension):
+                    objOut = gzip.GzipFile(
+                        fileobj=objHashing,
+                        mode='wb',
+                        compresslevel=intCompressLevel,
+                        mtime=0
+                    )
+
+                self.dctShards[pstrPath] = (objOut, objHashing)
+
+            self.dctShards[pstrPath][0].write(pobjData)
+
+        elif pstrKind == 'shard':
+            objOut, objHashing = self.dctShards.pop(pstrPath)
+
+            # close the compression before the file it writes to
+            if objOut is not objHashing:
+                objOut.close()
+
+            objHashing.objFile.close()
+            os.replace(objHashing.objFile.name, pstrPath)
+
+            self.dctChecksums[pstrPath] = objHashing.objHash.hexdigest()
+            pipeline_metrics.Count('shards_written')
+            pipeline_metrics.Count('bytes_written', objHashing.intBytes)
+
+    def Abort(self) -> None:
+        """Close and remove the unfinished shards after an error."""
+
+        for strPath, (objOut, objHashing) in self.dctShards.items():
+            try:
+                objHashing.objFile.close()
+                os.remove(objHashing.objFile.name)
+            except OSError:
+                pass
+
+        self.dctShards.clear()
+
+    def RaiseError(self) -> None:
+        """Raise the error of the I/O thread in the producer.
+
+        The writes queued before the error was raised are skipped first, so
+        none of them runs after the error is cleared.
+        """
+
+        if self.objError is not None:
+            # the I/O thread skips every job while the error is set
+            self.objQueue.join()
+
+            objError = self.objError
+            self.objError = None
+
+            raise objError
+
+    def Submit(self, pstrPath: str, pstrText: str) -> None:
+        """Queue a whole text file to be written.
+
+        Inputs:
+            - pstrPath - full path of the file
+            - pstrText - contents of the file
+        """
+
+        assert not self.blnClosed, 'The writer is closed'
+
+        self.RaiseError()
+        self.objQueue.put(('file', pstrPath, pstrText))
+
+    def SubmitShard(self, plstRecords: list, pstrPath: str) -> None:
+        """Serialize records block by block and queue them as a shard.
+
+        The shard is published under its final name after the last block,
+        its checksum is available after Flush, see strChecksum.
+
+        Inputs:
+            - plstRecords - list of dictionaries to save
+            - pstrPath - full path of the shard
+        """
+
+        assert not self.blnClosed, 'The writer is closed'
+        assert blnIsShard(pstrPath), 'Unknown shard extension'
+
+        for intStart in range(0, len(plstRecords), intWriteBlockSize):
+            self.RaiseError()
+            self.objQueue.put((
+                'block',
+                pstrPath,
+                bytSerializeRecords(
+                    plstRecords[intStart:intStart + intWriteBlockSize]
+                )
+            ))
+
+        # an empty shard still gets its file
+        if len(plstRecords) == 0:
+            self.objQueue.put(('block', pstrPath, b''))
+
+        self.objQueue.put(('shard', pstrPath, None))
+
+    def Flush(self) -> None:
+        """Wait until all submitted writes are finished."""
+
+        self.objQueue.join()
+        self.RaiseError()
+
+    def strChecksum(self, pstrPath: str) -> str:
+        """Return the checksum of a shard finished by the writer.
+
+        Inputs:
+            - pstrPath - full path of the shard
+
+        Outputs:
+            - strChecksum - SHA-256 hex digest of the shard file
+        """
+
+        return self.dctChecksums.pop(pstrPath)
+
+    def Close(self) -> None:
+        """Finish all submitted writes and stop the I/O thread."""
+
+        if self.blnClosed:
+            return
+
+        self.blnClosed = True
+        self.objQueue.put(None)
+        self.objThread.join()
+        self.RaiseError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ptplException):
+        self.Close()
+
+        return False
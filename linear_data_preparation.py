@@ -5,6 +5,7 @@ import pandas as pd
 import datetime
 import json
 import logging
+import token_scanner
 
 # %% set up logging
 logging.basicConfig(
@@ -133,32 +134,8 @@ def tplFindEarliestToken(pstrText: str, plstTokens: list) -> tuple:
     assert type(pstrText) == str
     assert type(plstTokens) == list
 
-    # initialize position and token values
-    tplPosition = (-1, None)
-
-    for strToken in plstTokens:
-        # locate the token in the string
-        intPosition = pstrText.find(strToken)
-
-        # remember the token if found on an earlier position
-        if intPosition >= 0:
-            # change the return position and token if earlier or first found
-            if intPosition < tplPosition[0]:
-                tplPosition = (intPosition, strToken)
-            elif tplPosition[0] == -1:
-                tplPosition = (intPosition, strToken)
-
-        # add a break optimization in case no token start found in
-        # the remaining part of the string
-        if not '[' in pstrText[:intPosition]:
-            break
-
-        # logging
-        # strLog = 'tplFindEarliestToken : \n'
-        # strLog += 'strToken: ' + strToken + '\n'
-        # strLog += 'intPosition: ' + str(intPosition) + '\n'
-        # strLog += '-'*32 + '\n'
-        # logging.debug(strLog)
+    # search all tokens at once with a single compiled pattern
+    tplPosition = token_scanner.tplFindEarliestToken(pstrText, plstTokens)
 
     return tplPosition
 
@@ -297,15 +274,20 @@ for intCount in range(intFiles):
     intRate = 1
     intAmount = 1
 
-    # get first token
-    intStart, strToken = tplFindEarliestToken(strText, lstTokens)
-    logging.debug(
-        'Initial position and token: \n' + str(intStart) + '\n' + strToken + \
-        '\n' + '-' * 16 +'\n'
-    )
+    # locate all tokens of the template in a single pass
+    strTemplate = strText
+    lstTokenPositions = token_scanner.lstFindTokens(strTemplate, lstTokens)
+
+    # initialize the output parts and the shift caused by the replacements
+    lstText = []
+    intPrevious = 0
+    intShift = 0
 
     # do this for all tokens
-    while intStart >= 0:
+    for intPosition, strToken in lstTokenPositions:
+        # position of the token in the text with the earlier replacements
+        intStart = intPosition + intShift
+
         # based on token generate the appropriate data to replace it
         if strToken in [strTokClient, strTokCompany]:
             # shuffle company data and get first observation
@@ -402,9 +384,12 @@ for intCount in range(intFiles):
             # sum the subtotal and tax
             strReplace = str(intSubtotal + intTax)
 
-        # replace the first instance of the token in the text
+        # replace the token in the text
         if not strToken is None:
-            strText = strText.replace(strToken, strReplace, 1)
+            lstText.append(strTemplate[intPrevious:intPosition])
+            lstText.append(strReplace)
+            intPrevious = intPosition + len(strToken)
+            intShift += len(strReplace) - len(strToken)
 
             logging.debug('strText replace - strToken: ' + strToken)
             logging.debug('strText replace - strReplace: ' + strReplace)
@@ -434,11 +419,14 @@ for intCount in range(intFiles):
             }
 
             # update the JSON dictionary
-            dctJSON['text'] = strText
             dctJSON['annotations'].append(dctAnnotation)
 
-        # get the next token
-        intStart, strToken = tplFindEarliestToken(strText, lstTokens)
+    # join the replaced text
+    lstText.append(strTemplate[intPrevious:])
+    strText = ''.join(lstText)
+
+    if len(dctJSON['annotations']) > 0:
+        dctJSON['text'] = strText
 
     # export the annotated file to json
     strJSON = json.dumps(dctJSON, indent=4)
@@ -4,6 +4,7 @@ import os
 import json
 import string
 import datetime
+import json_shards
 
 # %% definitions
 
@@ -79,7 +80,7 @@ intCounter = 1
 # print a time stamp
 print(datetime.datetime.now())
 
-# import available JSON files and clean them up
+# import available JSON files and shards and clean them up
 for strFile in os.listdir(strPathJSON):
     # process only JSON files
     if strFile.endswith('.json') and os.path.isfile(strPathJSON + strFile):
@@ -107,6 +108,31 @@ for strFile in os.listdir(strPathJSON):
         # increment the counter
         intCounter += 1
 
+    elif json_shards.blnIsShard(strFile) and \
+            os.path.isfile(strPathJSON + strFile):
+        # read all documents of the shard at once
+        lstData = json_shards.lstReadShard(strPathJSON + strFile)
+
+        # consolidate the ingested documents in a single step
+        dtfProcessing = pd.concat(
+            [dtfJSONtoDataFrame(dctData) for dctData in lstData],
+            axis=0,
+            ignore_index=True
+        )
+
+        # append the processed dataset to the main data frame
+        dtfData = pd.concat(
+            [dtfData, dtfProcessing],
+            axis=0,
+            ignore_index=True
+        )
+
+        # get time
+        strTime = str(datetime.datetime.now())
+
+        # print message
+        print(f'\t{strTime} Shard processed: {strFile}')
+
 # %%
 # replace punctuation from the original input text
 dtfData['clean_text'] = dtfData['text'].apply(
@@ -1,12 +1,23 @@
 # %% imports
 import numpy as np
 import pandas as pd
+import atexit
 import datetime
 import json
 import logging
-import random
 import os
+import functools
+import hashlib
+import collections
+import itertools
+import string
+import re
 import concurrent.futures
+import json_shards
+import token_scanner
+import pipeline_metrics
+import vocabulary_store
+import duplicate_filter
 
 # %% set up logging
 logging.basicConfig(
@@ -19,12 +30,36 @@ logging.basicConfig(
 # number of files to generate
 intFiles = 30000
 
-# number of available templates
-intTemplates = 11
+# output mode, 'files' for one JSON file per invoice, 'shards' for
+# newline-delimited JSON shards with many invoices each
+strOutputMode = 'files'
+
+# number of invoices in a single shard and shard compression
+intShardSize = 10000
+blnCompressShards = False
+
+# number of worker processes (None for all cores), number of invoices per
+# task and maximum number of submitted unfinished tasks (None for twice the
+# number of workers)
+intWorkers = None
+intChunkSize = 500
+intMaxInFlight = None
+
+# root seed of the generation run, every shard or chunk gets its own
+# independent random stream derived from it
+intSeed = 20240102
+
+# name of the manifest of finished shards and chunks in the output folder and
+# flag whether to recompute the checksums of finished work on a restart
+strManifestName = 'generation.manifest'
+blnVerifyResume = False
 
 # tax rate
 intTaxRate = 0.2
 
+# collect timings and counters of the run and save them to a metrics file
+blnMetrics = False
+
 # paths
 strPathData = 'c:/repositories/zzz_data_for_lstm/data/inputs/'
 strPathTemplates = 'c:/repositories/zzz_data_for_lstm/templates/'
@@ -34,6 +69,34 @@ strPathOutputs = 'c:/repositories/zzz_data_for_lstm/data/outputs/json/'
 strTemplateName = 'template'
 strTemplateExt = '.txt'
 
+# source file and column of each vocabulary
+dctVocabularySources = {
+    'company': ('company.csv', 'Company'),
+    'extension': ('company.csv', 'Extension'),
+    'city': ('cities.csv', 'Cities'),
+    'street': ('street.csv', 'Street'),
+    'phone': ('phone.csv', 'Phone'),
+    'item': ('items.csv', 'Items'),
+    'name': ('name.csv', 'Name'),
+    'surname': ('name.csv', 'Surname')
+}
+
+# memory-map the vocabularies from the store built from the csv files
+# instead of reading the csv files in every process, see vocabulary_store
+blnVocabularyStore = False
+
+# reject invoices whose texts repeat an earlier invoice of the same shard or
+# chunk, up to the error rate of the Bloom filter, and generate replacements
+# until the requested number of unique invoices is reached, give up after
+# this many rounds in a row without a new invoice
+blnDeduplicate = False
+fltDedupErrorRate = duplicate_filter.fltErrorRate
+intDedupRetries = 1000
+
+# write the generated files from a background I/O thread of every process
+# while the next documents are serialized, see json_shards.WriteBehindWriter
+blnWriteBehind = True
+
 # invoice tokens
 strTokCompany = '[my-company]'
 strTokStreet = '[my-address-street]'
@@ -83,51 +146,277 @@ lstTokens = [
     strTokTotal
 ]
 
-# %% import data
-dtfCity = pd.read_csv(strPathData + 'cities.csv', encoding='latin-1')
-dtfCompany = pd.read_csv(strPathData + 'company.csv', encoding='latin-1')
-dtfItems = pd.read_csv(strPathData + 'items.csv', encoding='latin-1')
-dtfName = pd.read_csv(strPathData + 'name.csv', encoding='latin-1')
-dtfStreet = pd.read_csv(strPathData + 'street.csv', encoding='latin-1')
-dtfPhone = pd.read_csv(
-    strPathData + 'phone.csv',
-    encoding='latin-1',
-    dtype={'Phone': str}
-)
+# punctuation removed from the texts
+setPunctuation = set(string.punctuation)
+dctPunctuation = str.maketrans('', '', string.punctuation)
+
+# generate texts without punctuation and with the offsets already adjusted
+blnCleanText = False
+
+# kinds of values generated in batches for numeric and date tokens
+dctNumericKinds = {
+    strTokDateIn: 'date',
+    strTokDateDue: 'date',
+    strTokZip: 'zip',
+    strTokClientZip: 'zip',
+    strTokInvoiceNo: 'invoice',
+    strTokQ: 'qty',
+    strTokR: 'rate',
+    strTokA: 'amount',
+    strTokS: 'subtotal',
+    strTokTax: 'tax',
+    strTokTotal: 'total'
+}
+
+# %% vocabulary sampling
+class VocabularySampler:
+    """Draw random values from a single vocabulary column.
+
+    Random indexes are generated in batches, so a single draw costs a list
+    lookup instead of a permutation of the whole vocabulary table. The buffer
+    is tied to the generator that filled it and is discarded when a draw
+    uses a different generator. Values in an array are drawn uniformly, a
+    vocabulary_store.MappedVocabulary draws its own indexes, uniformly or by
+    the weights of its values.
+    """
+
+    def __init__(self, parrValues, pintBatchSize: int = 4096):
+        """Store the vocabulary values and prepare an empty draw buffer.
+
+        Inputs:
+            - parrValues - array of string values or a memory-mapped
+            vocabulary to sample from
+            - pintBatchSize - number of indexes generated per generator call
+        """
+
+        assert len(parrValues) > 0, 'Vocabulary must not be empty'
+        assert type(pintBatchSize) == int, 'The batch size must be an integer'
+        assert pintBatchSize > 0, 'The batch size must be positive'
+
+        self.arrValues = parrValues
+        self.intBatchSize = pintBatchSize
+        self.lstBuffer = []
+        self.intPosition = 0
+        self.objRNG = None
+
+    def strDraw(self, pobjRNG: np.random.Generator) -> str:
+        """Return one uniformly drawn value from the vocabulary.
+
+        Inputs:
+            - pobjRNG - random number generator of the current shard
+
+        Outputs:
+            - strValue - randomly selected vocabulary entry
+        """
+
+        # refill the buffer when exhausted or filled by another generator
+        if self.intPosition >= len(self.lstBuffer) or \
+                self.objRNG is not pobjRNG:
+            if isinstance(self.arrValues, np.ndarray):
+                arrIndexes = pobjRNG.integers(
+                    0,
+                    len(self.arrValues),
+                    size=self.intBatchSize
+                )
+                self.lstBuffer = self.arrValues[arrIndexes].tolist()
+            else:
+                arrIndexes = self.arrValues.arrDrawIndexes(
+                    pobjRNG,
+                    self.intBatchSize
+                )
+                self.lstBuffer = self.arrValues.lstTake(arrIndexes)
+
+            self.intPosition = 0
+            self.objRNG = pobjRNG
+
+        strValue = self.lstBuffer[self.intPosition]
+        self.intPosition += 1
+
+        return strValue
+
+def strPrepareStore(pstrPath: str = strPathData) -> str:
+    """Build the vocabulary store if it is missing or its csv files changed.
+
+    Call it once before starting workers, the workers then only map the
+    current store, see vocabulary_store.blnStoreCurrent.
+
+    Inputs:
+        - pstrPath - path to the folder with the vocabulary csv files
+
+    Outputs:
+        - strPathStore - folder of the store
+    """
+
+    strPathStore = os.path.join(pstrPath, vocabulary_store.strStoreFolder)
+
+    if not vocabulary_store.blnStoreCurrent(
+        strPathStore,
+        pstrPath,
+        dctVocabularySources
+    ):
+        vocabulary_store.BuildStore(pstrPath, dctVocabularySources)
+
+    return strPathStore
+
+def dctLoadVocabularies(
+    pstrPath: str,
+    pblnStore: bool = blnVocabularyStore
+) -> dict:
+    """Read all vocabulary files once and wrap every column in a sampler.
+
+    Inputs:
+        - pstrPath - path to the folder with the vocabulary csv files
+        - pblnStore - flag whether to map the vocabularies from the store in
+        the vocabulary folder, the store is built if it does not exist or
+        its csv files changed
+
+    Outputs:
+        - dctOut - dictionary of vocabulary samplers keyed by column name
+    """
+
+    dctFrames = dict()
+    dctOut = dict()
+
+    if pblnStore:
+        strPathStore = strPrepareStore(pstrPath)
+
+        for strKey in dctVocabularySources.keys():
+            dctOut[strKey] = VocabularySampler(
+                vocabulary_store.MappedVocabulary(strPathStore, strKey)
+            )
+
+        return dctOut
+
+    for strKey, (strFile, strColumn) in dctVocabularySources.items():
+        # read every file only once, keep all values as strings
+        if strFile not in dctFrames:
+            dctFrames[strFile] = pd.read_csv(
+                os.path.join(pstrPath, strFile),
+                encoding='latin-1',
+                dtype=str
+            )
+
+        # convert the column to a compact string array
+        arrValues = dctFrames[strFile][strColumn].to_numpy(dtype=str)
+        dctOut[strKey] = VocabularySampler(arrValues)
+
+    return dctOut
+
+# %% worker state
+# vocabulary samplers, filled in once per process by InitializeWorker
+dctVocabularies = dict()
+
+# vocabulary values cleaned of punctuation keyed by the original value
+dctCleanValues = dict()
+
+# write-behind writer of the process, started on first use by objGetWriter
+objWriter = None
+
+# generator of GenerateJSON calls without a shard generator, created on
+# first use, so the vocabulary buffers are not refilled on every call
+objUnseededRNG = None
 
 # %% functions
-def strGetRandomTemplate(pintSampleSize: int) -> str:
+def objGetWriter():
+    """Return the write-behind writer of the current process.
+
+    The writer is started on first use and again in a forked process, which
+    does not inherit the I/O thread. Callers must Flush or Close it before
+    they report their files written. The atexit handler closes it only at
+    a normal exit of the main process, pool and multiprocessing workers
+    leave through os._exit without running it.
+
+    Outputs:
+        - objWriter - json_shards.WriteBehindWriter of the process
+    """
+
+    global objWriter
+
+    if objWriter is None or objWriter.intPid != os.getpid():
+        objWriter = json_shards.WriteBehindWriter()
+        atexit.register(objWriter.Close)
+
+    return objWriter
+
+def objShardGenerator(pintSeed: int, pintShard: int) -> np.random.Generator:
+    """Return the random number generator of a single shard.
+
+    The streams of different shards are statistically independent and the
+    stream of a shard depends only on the root seed and the shard number.
+
+    Inputs:
+        - pintSeed - root seed of the generation run
+        - pintShard - sequential number of the shard
+
+    Outputs:
+        - objRNG - random number generator of the shard
+    """
+
+    assert type(pintShard) == int, 'The shard number must be an integer'
+    assert pintShard >= 0, 'The shard number must not be negative'
+
+    objSequence = np.random.SeedSequence(pintSeed, spawn_key=(pintShard,))
+    objRNG = np.random.Generator(np.random.PCG64(objSequence))
+
+    return objRNG
+
+def InitializeWorker(
+    pstrPathData: str = strPathData,
+    pstrPathTemplates: str = strPathTemplates,
+    pobjTemplates = None
+) -> None:
+    """Load vocabularies and templates once for the current process.
+
+    Inputs:
+        - pstrPathData - path to the folder with the vocabulary csv files
+        - pstrPathTemplates - path to the folder with the templates
+        - pobjTemplates - template registry already loaded by the parent
+        process, None to load the templates from pstrPathTemplates
+    """
+
+    global objTemplateRegistry, objUnseededRNG
+
+    # a forked worker must not repeat the random stream of its parent
+    objUnseededRNG = None
+
+    # load all vocabularies
+    dctVocabularies.clear()
+    dctVocabularies.update(
+        dctLoadVocabularies(pstrPathData, blnVocabularyStore)
+    )
+
+    # clean the vocabulary values of punctuation in advance, the values of
+    # the memory-mapped vocabularies are cleaned when drawn
+    dctCleanValues.clear()
+
+    for objSampler in dctVocabularies.values():
+        if isinstance(objSampler.arrValues, np.ndarray):
+            for strValue in objSampler.arrValues.tolist():
+                dctCleanValues[strValue] = strValue.translate(dctPunctuation)
+
+    # use the parsed templates of the parent process or load them
+    if pobjTemplates is None:
+        pobjTemplates = TemplateRegistry(pstrPathTemplates)
+        pobjTemplates.blnRefresh()
+
+    objTemplateRegistry = pobjTemplates
+
+def strGetRandomTemplate(pobjRNG: np.random.Generator) -> str:
     """Return text saved in one of the possible templates.
     
     Inputs:
-        - pintSampleSize - number of available templates to choose from
+        - pobjRNG - random number generator of the current shard
 
     Outputs:
         - strSingleLine - one line string containing contents of a random
         template
     """
-    
-    assert type(pintSampleSize) == int, 'The sample size must be an integer'
-    assert pintSampleSize > 0, 'There must be more than 1 template available'
-
-    # set seed
-    random.seed(
-        datetime.datetime.now().second * datetime.datetime.now().minute
-    )
 
     # generate a number to specify the template
-    intTemplate = random.randint(1, pintSampleSize)
-
-    # define the full name of the file to import
-    strFile = strPathTemplates + strTemplateName + str(intTemplate)
-    strFile += strTemplateExt
+    intTemplate = objTemplateRegistry.intDrawIndex(pobjRNG)
 
-    # open and read in the file
-    objTemplate = open(strFile, 'r')
-    lstContents = objTemplate.readlines()
-
-    # join the contents to a single line string
-    strSingleLine = ''.join(lstContents)
+    # get the template already read in by the registry
+    strSingleLine = objTemplateRegistry.lstTexts[intTemplate]
 
     return strSingleLine
 
@@ -147,32 +436,8 @@ def tplFindEarliestToken(pstrText: str, plstTokens: list) -> tuple:
     assert type(pstrText) == str
     assert type(plstTokens) == list
 
-    # initialize position and token values
-    tplPosition = (-1, None)
-
-    for strToken in plstTokens:
-        # locate the token in the string
-        intPosition = pstrText.find(strToken)
-
-        # remember the token if found on an earlier position
-        if intPosition >= 0:
-            # change the return position and token if earlier or first found
-            if intPosition < tplPosition[0]:
-                tplPosition = (intPosition, strToken)
-            elif tplPosition[0] == -1:
-                tplPosition = (intPosition, strToken)
-
-        # add a break optimization in case no token start found in
-        # the remaining part of the string
-        if not '[' in pstrText[:intPosition]:
-            break
-
-        # logging
-        # strLog = 'tplFindEarliestToken : \n'
-        # strLog += 'strToken: ' + strToken + '\n'
-        # strLog += 'intPosition: ' + str(intPosition) + '\n'
-        # strLog += '-'*32 + '\n'
-        # logging.debug(strLog)
+    # search all tokens at once with a single compiled pattern
+    tplPosition = token_scanner.tplFindEarliestToken(pstrText, plstTokens)
 
     return tplPosition
 
@@ -198,11 +463,11 @@ def strCreateJSONLabel(pstrValue: str) -> str:
 
     return strOut
 
-def strRandomDate() -> str:
+def strRandomDate(pobjRNG: np.random.Generator) -> str:
     """Generate random date and return it in dd/mm/yyyy format as string.
     
     Inputs:
-        - None
+        - pobjRNG - random number generator of the current shard
 
     Outputs:
         - strDate - a valid random date between 01/01/2020 and 31/12/2030
@@ -210,22 +475,22 @@ def strRandomDate() -> str:
     """
 
     # generate random year
-    intYear = random.randint(2020, 2030)
+    intYear = int(pobjRNG.integers(2020, 2031))
 
     # generate random month
-    intMonth = random.randint(1, 12)
+    intMonth = int(pobjRNG.integers(1, 13))
 
     # generate random day based on the year and month
     if intMonth in [1, 3, 5, 7, 8, 10, 12]:
-        intDay = random.randint(1, 31)
+        intDay = int(pobjRNG.integers(1, 32))
     elif intMonth in [4, 6, 9, 11]:
-        intDay = random.randint(1, 30)
+        intDay = int(pobjRNG.integers(1, 31))
     else:
         # generate february date for leap year
         if (intYear % 4 == 0 and intYear % 100 != 0) or (intYear % 400 == 0):
-            intDay = random.randint(1, 29)
+            intDay = int(pobjRNG.integers(1, 30))
         else:
-            intDay = random.randint(1, 28)
+            intDay = int(pobjRNG.integers(1, 29))
     
     # create the date
     dteRandomDate = datetime.date(intYear, intMonth, intDay)
@@ -235,12 +500,70 @@ def strRandomDate() -> str:
 
     return strDate
 
-def strRandomizeTemplateItems(pstrTemplate: str) -> str:
+def arrRandomDates(
+    pintCount: int,
+    pobjRNG: np.random.Generator
+) -> np.ndarray:
+    """Generate random dates in dd/mm/yyyy format as an array of strings.
+
+    Inputs:
+        - pintCount - number of dates to generate
+        - pobjRNG - random number generator of the current shard
+
+    Outputs:
+        - arrDates - array of valid random dates between 01/01/2020 and
+        31/12/2030 drawn the same way as in strRandomDate
+    """
+
+    assert type(pintCount) == int, 'The count must be an integer'
+
+    if pintCount == 0:
+        return np.array([], dtype=str)
+
+    # generate random years and months
+    arrYear = pobjRNG.integers(2020, 2031, size=pintCount)
+    arrMonth = pobjRNG.integers(1, 13, size=pintCount)
+
+    # get the number of days of each month, extend february in leap years
+    arrMonthDays = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    arrLeap = (arrYear % 4 == 0) & (arrYear % 100 != 0) | (arrYear % 400 == 0)
+    arrDays = arrMonthDays[arrMonth - 1] + ((arrMonth == 2) & arrLeap)
+
+    # generate random day based on the year and month
+    arrDay = pobjRNG.integers(1, arrDays + 1)
+
+    # create the dates in dd/mm/yyyy format
+    arrDates = np.char.add(np.char.zfill(arrDay.astype(str), 2), '/')
+    arrDates = np.char.add(arrDates, np.char.zfill(arrMonth.astype(str), 2))
+    arrDates = np.char.add(np.char.add(arrDates, '/'), arrYear.astype(str))
+
+    return arrDates
+
+def intRandomItemCount(pobjRNG: np.random.Generator) -> int:
+    """Return a random number of invoice items.
+
+    Inputs:
+        - pobjRNG - random number generator of the current shard
+
+    Outputs:
+        - intRepeat - number of repetitions of the template item list
+    """
+
+    # get a random number of repetitions
+    intRepeat = int(pobjRNG.integers(1, 21))
+
+    return intRepeat
+
+def strRandomizeTemplateItems(
+    pstrTemplate: str,
+    pobjRNG: np.random.Generator
+) -> str:
     """Extend text of the template by random number of items.
     
     Inputs:
         - pstrTemplate - template string to modify, it must contain start and
         end tokens that define the part of the template that will be repeated
+        - pobjRNG - random number generator of the current shard
 
     Outputs:
         - template extended by a random number of items    
@@ -263,184 +586,980 @@ def strRandomizeTemplateItems(pstrTemplate: str) -> str:
     strPostList = pstrTemplate[intEnd:]
 
     # get a random number of repetitions
-    random.seed(11)
-    intRepeat = random.randint(1, 20)
+    intRepeat = intRandomItemCount(pobjRNG)
 
     # prepare the modified template
     strTemplateOut = strPreList + (strList * intRepeat) + strPostList
 
     return strTemplateOut
 
-def GenerateJSON(pstrOutPath: str) -> None:
-    # get a random template to annotate
-    strText = strGetRandomTemplate(intTemplates)
+def lstParseSegments(pstrText: str) -> list:
+    """Split text to literal parts each followed by a token slot.
 
-    # create random list of invoice items
-    strText = strRandomizeTemplateItems(strText)
+    Inputs:
+        - pstrText - text containing tokens from lstTokens
 
-    # initialize annotation dictionary
-    dctJSON = {
-        'text': '',
-        'annotations': []
+    Outputs:
+        - lstSegments - list of (literal, token) tuples, the token of the last
+        tuple is None and holds the text after the last token
+    """
+
+    assert type(pstrText) == str
+
+    lstSegments = []
+    intPrevious = 0
+
+    # locate all tokens in a single pass
+    for intStart, strToken in token_scanner.lstFindTokens(pstrText, lstTokens):
+        # store the literal in front of the token together with the token
+        lstSegments.append((pstrText[intPrevious:intStart], strToken))
+        intPrevious = intStart + len(strToken)
+
+    # keep the remaining text as the last literal
+    lstSegments.append((pstrText[intPrevious:], None))
+
+    return lstSegments
+
+def dctCompileTemplate(pstrTemplate: str) -> dict:
+    """Parse a template to literal segments and token slots.
+
+    Inputs:
+        - pstrTemplate - template string, it must contain start and end tokens
+        that define the part of the template that will be repeated
+
+    Outputs:
+        - dctTemplate - dictionary with segments before the item list ('pre'),
+        segments of a single item ('items') and segments after the item list
+        ('post'), the item segments already include the line break added
+        between repetitions, token counts outside the item list ('fixed') and
+        in a single item ('item') and the literals cleaned of punctuation
+        ('clean')
+    """
+
+    # verify the presence of the start and end tokens
+    assert strTokItemsStart in pstrTemplate, 'Missing item list start token'
+    assert strTokItemsEnd in pstrTemplate, 'Missing item list end token'
+
+    # find the substring that represents the item list
+    intStart = pstrTemplate.find(strTokItemsStart) + len(strTokItemsStart)
+    intEnd = pstrTemplate.find(strTokItemsEnd)
+
+    # parse the template sections separately
+    dctTemplate = {
+        'pre': lstParseSegments(pstrTemplate[:intStart]),
+        'items': lstParseSegments(pstrTemplate[intStart:intEnd] + '\n'),
+        'post': lstParseSegments(pstrTemplate[intEnd:])
     }
 
-    # initialize position variables
-    intEnd = -1
-    intListStart = -1
-    intListEnd = -1
-
-    # initialize variables for templates that don't require this information
-    intSubtotal = 0
-    intTax = 0
-    intQuantity = 1
-    intRate = 1
-    intAmount = 1
-
-    # get first token
-    intStart, strToken = tplFindEarliestToken(strText, lstTokens)
-    logging.debug(
-        'Initial position and token: \n' + str(intStart) + '\n' + strToken + \
-        '\n' + '-' * 16 +'\n'
+    # count the token slots outside and inside the item list
+    dctTemplate['fixed'] = collections.Counter(
+        strToken for _, strToken in dctTemplate['pre'] + dctTemplate['post']
+    )
+    dctTemplate['item'] = collections.Counter(
+        strToken for _, strToken in dctTemplate['items']
     )
 
-    # do this for all tokens
-    while intStart >= 0:
-        # based on token generate the appropriate data to replace it
-        if strToken in [strTokClient, strTokCompany]:
-            # shuffle company data and get first observation
-            dtfRandomCompany = dtfCompany.apply(np.random.permutation)
-            strReplace = dtfRandomCompany.iloc[0][0]
-            strReplace += ' ' + dtfRandomCompany.iloc[0][1]
-
-        elif strToken in [strTokCity, strTokClientCity]:
-            # shuffle city data and get first observation
-            dtfRandom = dtfCity.apply(np.random.permutation)
-            strReplace = dtfRandom.iloc[0][0]
-
-        elif strToken in [strTokStreet, strTokClientStreet]:
-            # shuffle street data and get first observation
-            dtfRandom = dtfStreet.apply(np.random.permutation)
-            strReplace = dtfRandom.iloc[0][0]
-
-        elif strToken in [strTokZip, strTokClientZip]:
-            # generate zip code
-            intZip = random.randint(100000, 199999)
-            strZip = str(intZip)
-            strReplace = strZip[1:]
-
-        elif strToken == strTokPhone:
-            # shuffle phone data and get first observation
-            dtfRandom = dtfPhone.apply(np.random.permutation)
-            strReplace = dtfRandom.iloc[0][0]
-
-        elif strToken in [strTokDateIn, strTokDateDue]:
-            # generate random date
-            strReplace = strRandomDate()
-
-        elif strToken == strTokEmail:
-            # # shuffle name data and generate email from name and company info
-            # dtfRandom = dtfName.apply(np.random.permutation)
-            # strReplace = dtfRandom.iloc[0][0] + '.' + dtfRandom.iloc[0][1]
-            # strReplace += '@' + dtfRandomCompany.iloc[0][0] 
-            # strReplace += dtfRandomCompany.iloc[0][1] + '.com'
-
-            # use a placeholder due to punctuation removal
-            strReplace = 'email'
-
-        elif strToken == strTokInvoiceNo:
-            # generate a random invoice number
-            intInvoiceNum = random.randint(10000, 99999999)
-            strReplace = str(intInvoiceNum)
-
-        elif strToken == strTokItemsStart:
-            # remember the starting position of the item list
-            intListStart = intStart
+    # clean the literals of punctuation in advance
+    dctTemplate['clean'] = {
+        strLiteral: strLiteral.translate(dctPunctuation)
+        for strLiteral, _ in dctTemplate['pre'] + dctTemplate['items'] +
+        dctTemplate['post']
+    }
+
+    return dctTemplate
+
+def lstTemplateErrors(pstrTemplate: str) -> list:
+    """Validate the tokens of a template.
+
+    Inputs:
+        - pstrTemplate - template string
+
+    Outputs:
+        - lstErrors - list of problems found in the template, empty for a
+        valid template
+    """
+
+    lstErrors = []
+
+    # the item list must be defined exactly once
+    for strToken in [strTokItemsStart, strTokItemsEnd]:
+        if pstrTemplate.count(strToken) != 1:
+            lstErrors.append(f'{strToken} must be used exactly once')
+
+    if len(lstErrors) > 0:
+        return lstErrors
+
+    if pstrTemplate.find(strTokItemsStart) > pstrTemplate.find(strTokItemsEnd):
+        lstErrors.append(f'{strTokItemsStart} must precede {strTokItemsEnd}')
+        return lstErrors
+
+    # all tokens must be known
+    for strToken in set(re.findall(r'\[[a-z]+(?:-[a-z]+)*\]', pstrTemplate)):
+        if strToken not in lstTokens:
+            lstErrors.append(f'Unknown token {strToken}')
+
+    # the totals must be computable in batches
+    if not blnBatchCompatible(dctCompileTemplate(pstrTemplate)):
+        lstErrors.append('Item values or totals in unsupported positions')
+
+    return lstErrors
+
+class TemplateRegistry:
+    """Keep all templates of a folder parsed and validated in memory.
+
+    Templates are discovered by their file name (template*.txt) and a file is
+    read and parsed again only when its modification time or size changes.
+    The registry can be pickled and handed to worker processes.
+    """
+
+    def __init__(self, pstrPath: str):
+        """Prepare an empty registry of the folder.
+
+        Inputs:
+            - pstrPath - path to the folder with the templates
+        """
+
+        self.strPath = pstrPath
+        self.dctStats = dict()
+        self.dctTexts = dict()
+        self.dctTemplates = dict()
+        self.lstNames = []
+        self.lstTexts = []
+        self.lstTemplates = []
+
+    def __len__(self) -> int:
+        return len(self.lstTemplates)
+
+    def blnRefresh(self) -> bool:
+        """Discover the templates and reload the new or changed ones.
+
+        Outputs:
+            - blnChanged - True if any template was added, changed or removed
+        """
+
+        # find all template files in natural order, template2 before template10
+        lstNames = sorted(
+            [
+                strFile for strFile in os.listdir(self.strPath)
+                if strFile.startswith(strTemplateName) and
+                strFile.endswith(strTemplateExt)
+            ],
+            key=lambda strFile: (len(strFile), strFile)
+        )
+
+        blnChanged = lstNames != self.lstNames
+
+        for strName in lstNames:
+            objStat = os.stat(os.path.join(self.strPath, strName))
+            tplStat = (objStat.st_mtime_ns, objStat.st_size)
+
+            # skip unchanged files
+            if self.dctStats.get(strName) == tplStat:
+                continue
+
+            with open(os.path.join(self.strPath, strName), 'r') as objFile:
+                strTemplate = objFile.read()
+
+            lstErrors = lstTemplateErrors(strTemplate)
+            assert len(lstErrors) == 0, \
+                f'Invalid template {strName}: ' + '; '.join(lstErrors)
+
+            self.dctStats[strName] = tplStat
+            self.dctTexts[strName] = strTemplate
+            self.dctTemplates[strName] = dctCompileTemplate(strTemplate)
+            blnChanged = True
+
+        # forget removed files
+        for strName in set(self.dctStats) - set(lstNames):
+            del self.dctStats[strName]
+            del self.dctTexts[strName]
+            del self.dctTemplates[strName]
+
+        self.lstNames = lstNames
+        self.lstTexts = [self.dctTexts[strName] for strName in lstNames]
+        self.lstTemplates = [
+            self.dctTemplates[strName] for strName in lstNames
+        ]
+
+        assert len(self.lstTemplates) > 0, 'There must be a template available'
+
+        return blnChanged
+
+    def intDrawIndex(self, pobjRNG: np.random.Generator) -> int:
+        """Return the index of a uniformly drawn template.
+
+        Inputs:
+            - pobjRNG - random number generator of the current shard
+
+        Outputs:
+            - intIndex - index of the template in lstNames
+        """
+
+        intIndex = int(pobjRNG.integers(0, len(self.lstTemplates)))
+
+        return intIndex
+
+    def dctDraw(self, pobjRNG: np.random.Generator) -> dict:
+        """Return a uniformly drawn compiled template.
+
+        Inputs:
+            - pobjRNG - random number generator of the current shard
 
-            # replace the token with empty string
-            strReplace = ''
+        Outputs:
+            - dctTemplate - compiled template, see dctCompileTemplate
+        """
+
+        return self.lstTemplates[self.intDrawIndex(pobjRNG)]
+
+def strTokenValue(
+    pstrToken: str,
+    pdctState: dict,
+    pobjRNG: np.random.Generator
+) -> str:
+    """Generate the replacement value of a single token.
+
+    Inputs:
+        - pstrToken - token to replace
+        - pdctState - dictionary with the quantity, rate, subtotal and tax of
+        the current invoice, it is updated by the numeric tokens
+        - pobjRNG - random number generator of the current shard
+
+    Outputs:
+        - strReplace - generated value of the token
+    """
+
+    # based on token generate the appropriate data to replace it
+    if pstrToken in [strTokClient, strTokCompany]:
+        # draw company name and extension independently
+        strReplace = dctVocabularies['company'].strDraw(pobjRNG)
+        strReplace += ' ' + dctVocabularies['extension'].strDraw(pobjRNG)
+
+    elif pstrToken in [strTokCity, strTokClientCity]:
+        # draw a random city
+        strReplace = dctVocabularies['city'].strDraw(pobjRNG)
+
+    elif pstrToken in [strTokStreet, strTokClientStreet]:
+        # draw a random street
+        strReplace = dctVocabularies['street'].strDraw(pobjRNG)
+
+    elif pstrToken in [strTokZip, strTokClientZip]:
+        # generate zip code
+        intZip = int(pobjRNG.integers(100000, 200000))
+        strZip = str(intZip)
+        strReplace = strZip[1:]
+
+    elif pstrToken == strTokPhone:
+        # draw a random phone number
+        strReplace = dctVocabularies['phone'].strDraw(pobjRNG)
+
+    elif pstrToken in [strTokDateIn, strTokDateDue]:
+        # generate random date
+        strReplace = strRandomDate(pobjRNG)
+
+    elif pstrToken == strTokEmail:
+        # use a placeholder due to punctuation removal
+        strReplace = 'email'
+
+    elif pstrToken == strTokInvoiceNo:
+        # generate a random invoice number
+        intInvoiceNum = int(pobjRNG.integers(10000, 100000000))
+        strReplace = str(intInvoiceNum)
+
+    elif pstrToken == strTokItem:
+        # draw a random item name
+        strReplace = dctVocabularies['item'].strDraw(pobjRNG)
+
+    elif pstrToken == strTokQ:
+        # generate random quantity and store it for amount calculation
+        pdctState['quantity'] = int(pobjRNG.integers(1, 21))
+        strReplace = str(pdctState['quantity'])
+
+    elif pstrToken == strTokR:
+        # generate random unit price and store it for amount calculation
+        pdctState['rate'] = int(pobjRNG.integers(100, 2001))
+        strReplace = str(pdctState['rate'])
+
+    elif pstrToken == strTokA:
+        # calculate the total amount and increment subtotal
+        intAmount = pdctState['quantity'] * pdctState['rate']
+        pdctState['subtotal'] += intAmount
+
+        # create a value for token replacement
+        strReplace = str(intAmount)
+
+    elif pstrToken == strTokS:
+        # use calculated subtotal as a replacement
+        strReplace = str(pdctState['subtotal'])
+
+    elif pstrToken == strTokTax:
+        # use pre-defined tax value for tax calculation
+        pdctState['tax'] = round(intTaxRate * pdctState['subtotal'], 2)
+        strReplace = str(pdctState['tax'])
+
+    elif pstrToken == strTokTotal:
+        # sum the subtotal and tax
+        strReplace = str(pdctState['subtotal'] + pdctState['tax'])
+
+    return strReplace
+
+def dctRenderTemplate(
+    pdctTemplate: dict,
+    pintRepeat: int,
+    pfnValue
+) -> dict:
+    """Render a compiled template and its annotations in a single pass.
+
+    Inputs:
+        - pdctTemplate - compiled template, see dctCompileTemplate
+        - pintRepeat - number of repetitions of the item list
+        - pfnValue - function returning the replacement value of a token
+
+    Outputs:
+        - dctJSON - dictionary with the rendered 'text' and a list of
+        'annotations' with label, start and end position of each token
+    """
+
+    # initialize the output parts and annotations
+    lstText = []
+    lstAnnotations = []
+
+    # track the length of the rendered text instead of searching it
+    intLength = 0
+    intListStart = -1
+
+    lstSegments = pdctTemplate['pre'] + pdctTemplate['items'] * pintRepeat
+    lstSegments += pdctTemplate['post']
+
+    for strLiteral, strToken in lstSegments:
+        lstText.append(strLiteral)
+        intLength += len(strLiteral)
+
+        if strToken is None:
+            continue
+
+        if strToken == strTokItemsStart:
+            # remember the starting position of the item list
+            intListStart = intLength
 
         elif strToken == strTokItemsEnd:
-            # remember the ending position of the item list
-            intListEnd = intStart
-
-            # replace the token with empty string
-            strReplace = ''
-
-        elif strToken == strTokItem:
-            # shuffle phone data and get first observation
-            dtfRandom = dtfItems.apply(np.random.permutation)
-            strReplace = dtfRandom.iloc[0][0]
-
-        elif strToken == strTokQ:
-            # generate random quantity and store it for amount calculation
-            intQuantity = random.randint(1, 20)
-            strReplace = str(intQuantity)
-
-        elif strToken == strTokR:
-            # generate random unit price and store it for amount calculation
-            intRate = random.randint(100, 2000)
-            strReplace = str(intRate)
-
-        elif strToken == strTokA:
-            # calculate the total amount
-            intAmount = intQuantity * intRate
-
-            # increment subtotal
-            intSubtotal += intAmount
-
-            # create a value for token replacement
-            strReplace = str(intAmount)
-
-        elif strToken == strTokS:
-            # use calculated subtotal as a replacement
-            strReplace = str(intSubtotal)
-
-        elif strToken == strTokTax:
-            # use pre-defined tax value for tax calculation
-            intTax = round(intTaxRate * intSubtotal, 2)
-            strReplace = str(intTax)
-
-        elif strToken == strTokTotal:
-            # sum the subtotal and tax
-            strReplace = str(intSubtotal + intTax)
-
-        # replace the first instance of the token in the text
-        if not strToken is None:
-            strText = strText.replace(strToken, strReplace, 1)
-
-            logging.debug('strText replace - strToken: ' + strToken)
-            logging.debug('strText replace - strReplace: ' + strReplace)
-
-        # update the document and annotation unless it's a list start token
-        if not strToken is None and strToken != strTokItemsStart:
-            # create special annotation for item list and standard for the rest
-            if strToken == strTokItemsEnd:
-                # use list start and end indexes
-                intStart = intListStart
-                intEnd = intListEnd
-
-                # use custom label
-                strLabel = 'item_list'
-            else:
-                # calculate the end position of the token
-                intEnd = intStart + len(strReplace)
+            # annotate the whole item list
+            lstAnnotations.append({
+                'label': 'item_list',
+                'start': intListStart,
+                'end': intLength
+            })
+
+        else:
+            # generate the value and annotate its position
+            strReplace = pfnValue(strToken)
+
+            lstAnnotations.append({
+                'label': dctLabels[strToken],
+                'start': intLength,
+                'end': intLength + len(strReplace)
+            })
+
+            lstText.append(strReplace)
+            intLength += len(strReplace)
+
+    dctJSON = {
+        'text': ''.join(lstText),
+        'annotations': lstAnnotations
+    }
+
+    return dctJSON
+
+def strCleanValue(pstrValue: str) -> str:
+    """Return the value without punctuation, use pre-cleaned vocabulary.
+
+    Inputs:
+        - pstrValue - generated value of a token
+
+    Outputs:
+        - strClean - value cleaned of all punctuation
+    """
+
+    strClean = dctCleanValues.get(pstrValue)
+
+    # clean values that are not in the vocabularies, e.g. dates and numbers
+    if strClean is None:
+        strClean = pstrValue.translate(dctPunctuation)
+
+    return strClean
+
+def dctRenderCleanTemplate(
+    pdctTemplate: dict,
+    pintRepeat: int,
+    pfnValue
+) -> dict:
+    """Render a compiled template without punctuation in a single pass.
+
+    The offsets are the same as dctCleanText in the training preprocessing
+    produces from the output of dctRenderTemplate, i.e. each original offset
+    is reduced by the number of punctuation characters up to and including
+    the character at the offset.
+
+    Inputs:
+        - pdctTemplate - compiled template, see dctCompileTemplate
+        - pintRepeat - number of repetitions of the item list
+        - pfnValue - function returning the replacement value of a token
+
+    Outputs:
+        - dctJSON - dictionary with the cleaned 'text' and a list of
+        'annotations' with label, start and end position of each token
+    """
+
+    # initialize the output parts and annotations
+    lstText = []
+    lstAnnotations = []
+
+    # track the length of the cleaned text instead of searching it
+    intLength = 0
+    dctList = None
+
+    # offsets that depend on the first original character rendered after them
+    lstPending = []
+
+    dctClean = pdctTemplate['clean']
+
+    lstSegments = pdctTemplate['pre'] + pdctTemplate['items'] * pintRepeat
+    lstSegments += pdctTemplate['post']
+
+    for strLiteral, strToken in lstSegments:
+        if strLiteral:
+            # shift the pending offsets if they point to punctuation
+            if lstPending:
+                if strLiteral[0] in setPunctuation:
+                    for dctAnnotation, strKey in lstPending:
+                        dctAnnotation[strKey] -= 1
+                lstPending = []
+
+            strClean = dctClean[strLiteral]
+            lstText.append(strClean)
+            intLength += len(strClean)
+
+        if strToken is None:
+            continue
+
+        if strToken == strTokItemsStart:
+            # remember the starting position of the item list
+            dctList = {'label': 'item_list', 'start': intLength, 'end': -1}
+            lstPending.append((dctList, 'start'))
 
-                # create label
-                strLabel = strCreateJSONLabel(strToken)
+        elif strToken == strTokItemsEnd:
+            # annotate the whole item list
+            dctList['end'] = intLength
+            lstPending.append((dctList, 'end'))
+            lstAnnotations.append(dctList)
 
-            # create annotation
+        else:
+            # generate the value and annotate its position
+            strReplace = pfnValue(strToken)
             dctAnnotation = {
-                'label': strLabel,
-                'start': intStart,
-                'end': intEnd
+                'label': dctLabels[strToken],
+                'start': intLength,
+                'end': -1
             }
+            lstPending.append((dctAnnotation, 'start'))
+
+            if strReplace:
+                if strReplace[0] in setPunctuation:
+                    for dctPending, strKey in lstPending:
+                        dctPending[strKey] -= 1
+                lstPending = []
+
+                strClean = strCleanValue(strReplace)
+                lstText.append(strClean)
+                intLength += len(strClean)
+
+            dctAnnotation['end'] = intLength
+            lstPending.append((dctAnnotation, 'end'))
+            lstAnnotations.append(dctAnnotation)
+
+    dctJSON = {
+        'text': ''.join(lstText),
+        'annotations': lstAnnotations
+    }
+
+    return dctJSON
+
+def blnBatchCompatible(pdctTemplate: dict) -> bool:
+    """Check whether the invoice totals of a template can be precomputed.
+
+    Inputs:
+        - pdctTemplate - compiled template, see dctCompileTemplate
+
+    Outputs:
+        - blnOut - True if quantity, rate and amount appear at most once and
+        only in the item list with amount last, and subtotal, tax and total
+        appear only after the item list with tax before total
+    """
+
+    lstItemTokens = [strToken for _, strToken in pdctTemplate['items']]
+    lstPreTokens = [strToken for _, strToken in pdctTemplate['pre']]
+    lstPostTokens = [strToken for _, strToken in pdctTemplate['post']]
+
+    for strToken in [strTokQ, strTokR, strTokA]:
+        # line values must be generated only within the item list
+        if pdctTemplate['fixed'][strToken] > 0:
+            return False
+        if pdctTemplate['item'][strToken] > 1:
+            return False
+
+        # quantity and rate must be known before the amount is calculated
+        if strToken != strTokA and strToken in lstItemTokens and \
+                strTokA in lstItemTokens:
+            if lstItemTokens.index(strToken) > lstItemTokens.index(strTokA):
+                return False
+
+    for strToken in [strTokS, strTokTax, strTokTotal]:
+        # totals must be calculated from all items
+        if strToken in lstPreTokens or strToken in lstItemTokens:
+            return False
+
+    # tax must be known before the total is calculated
+    if strTokTax in lstPostTokens and strTokTotal in lstPostTokens:
+        if lstPostTokens.index(strTokTotal) < max(
+            intIndex for intIndex, strToken in enumerate(lstPostTokens)
+            if strToken == strTokTax
+        ):
+            return False
+
+    return True
+
+def arrCountTokens(
+    plstTemplates: list,
+    parrRepeats: np.ndarray,
+    plstTokens: list
+) -> np.ndarray:
+    """Count occurrences of the tokens in each invoice of a batch.
+
+    Inputs:
+        - plstTemplates - compiled template of each invoice
+        - parrRepeats - number of items of each invoice
+        - plstTokens - tokens to count
+
+    Outputs:
+        - arrCount - number of the token slots in each invoice
+    """
+
+    arrFixed = np.array([
+        sum(dctTemplate['fixed'][strToken] for strToken in plstTokens)
+        for dctTemplate in plstTemplates
+    ], dtype=np.int64)
+
+    arrItem = np.array([
+        sum(dctTemplate['item'][strToken] for strToken in plstTokens)
+        for dctTemplate in plstTemplates
+    ], dtype=np.int64)
+
+    arrCount = arrFixed + arrItem * parrRepeats
+
+    return arrCount
+
+def lstSplitValues(plstValues: list, parrCount: np.ndarray) -> list:
+    """Split a flat list of values to a list per invoice.
+
+    Inputs:
+        - plstValues - values of all invoices concatenated
+        - parrCount - number of values of each invoice
+
+    Outputs:
+        - lstOut - list with a list of values for each invoice
+    """
+
+    arrEnd = np.cumsum(parrCount).tolist()
+    arrStart = [0] + arrEnd[:-1]
+
+    lstOut = [
+        plstValues[intStart:intEnd]
+        for intStart, intEnd in zip(arrStart, arrEnd)
+    ]
+
+    return lstOut
+
+def lstRandomNumericBatch(
+    plstTemplates: list,
+    parrRepeats: np.ndarray,
+    pobjRNG: np.random.Generator
+) -> list:
+    """Generate dates and numeric fields of a batch of invoices at once.
+
+    Inputs:
+        - plstTemplates - compiled template of each invoice, all templates
+        must be accepted by blnBatchCompatible
+        - parrRepeats - number of items of each invoice
+        - pobjRNG - random number generator of the current shard
+
+    Outputs:
+        - lstValues - list with a dictionary for each invoice that maps the
+        value kinds from dctNumericKinds to iterators over formatted values
+        in the order of their occurrence in the invoice
+    """
+
+    assert len(plstTemplates) == len(parrRepeats), 'One repeat per template'
+    assert all(blnBatchCompatible(dctTemplate) for dctTemplate in \
+        plstTemplates), 'Template totals can\'t be precomputed'
+
+    arrRepeats = np.asarray(parrRepeats, dtype=np.int64)
+    intLines = int(arrRepeats.sum())
+
+    # generate dates, zip codes and invoice numbers for all slots at once
+    arrCountDate = arrCountTokens(
+        plstTemplates, arrRepeats, [strTokDateIn, strTokDateDue]
+    )
+    lstDates = arrRandomDates(int(arrCountDate.sum()), pobjRNG).tolist()
+
+    arrCountZip = arrCountTokens(
+        plstTemplates, arrRepeats, [strTokZip, strTokClientZip]
+    )
+    arrZip = pobjRNG.integers(100000, 200000, size=int(arrCountZip.sum()))
+    lstZip = [strZip[1:] for strZip in arrZip.astype(str).tolist()]
+
+    arrCountInvoice = arrCountTokens(
+        plstTemplates, arrRepeats, [strTokInvoiceNo]
+    )
+    arrInvoice = pobjRNG.integers(
+        10000,
+        100000000,
+        size=int(arrCountInvoice.sum())
+    )
+    lstInvoice = arrInvoice.astype(str).tolist()
+
+    # generate quantity and rate only for the lines that show them, the other
+    # lines use the default value of 1
+    arrHasQuantity = np.repeat(
+        arrCountTokens(plstTemplates, np.ones_like(arrRepeats), [strTokQ]),
+        arrRepeats
+    ).astype(bool)
+    arrQuantity = np.ones(intLines, dtype=np.int64)
+    arrQuantity[arrHasQuantity] = pobjRNG.integers(
+        1, 21, size=int(arrHasQuantity.sum())
+    )
+
+    arrHasRate = np.repeat(
+        arrCountTokens(plstTemplates, np.ones_like(arrRepeats), [strTokR]),
+        arrRepeats
+    ).astype(bool)
+    arrRate = np.ones(intLines, dtype=np.int64)
+    arrRate[arrHasRate] = pobjRNG.integers(
+        100, 2001, size=int(arrHasRate.sum())
+    )
+
+    # calculate line amounts and sum them per invoice
+    arrAmount = arrQuantity * arrRate
+    arrSubtotal = np.zeros(len(arrRepeats), dtype=np.int64)
+
+    if intLines > 0:
+        arrStart = np.cumsum(arrRepeats) - arrRepeats
+        arrSubtotal[arrRepeats > 0] = np.add.reduceat(
+            arrAmount, arrStart[arrRepeats > 0]
+        )
+
+    # only amounts shown in the invoice are added to the subtotal
+    arrSubtotal *= arrCountTokens(plstTemplates, arrRepeats, [strTokA]) > 0
+
+    # calculate tax only for invoices that show it
+    arrHasTax = arrCountTokens(plstTemplates, arrRepeats, [strTokTax]) > 0
+    arrTax = np.round(intTaxRate * arrSubtotal, 2)
+
+    lstSubtotal = arrSubtotal.tolist()
+    lstTax = [
+        fltTax if blnTax else 0
+        for fltTax, blnTax in zip(arrTax.tolist(), arrHasTax.tolist())
+    ]
+
+    # split the flat values to the invoices
+    lstDates = lstSplitValues(lstDates, arrCountDate)
+    lstZip = lstSplitValues(lstZip, arrCountZip)
+    lstInvoice = lstSplitValues(lstInvoice, arrCountInvoice)
+    lstQuantity = lstSplitValues(arrQuantity.astype(str).tolist(), arrRepeats)
+    lstRate = lstSplitValues(arrRate.astype(str).tolist(), arrRepeats)
+    lstAmount = lstSplitValues(arrAmount.astype(str).tolist(), arrRepeats)
+
+    lstValues = []
+
+    for intIndex in range(len(arrRepeats)):
+        lstValues.append({
+            'date': iter(lstDates[intIndex]),
+            'zip': iter(lstZip[intIndex]),
+            'invoice': iter(lstInvoice[intIndex]),
+            'qty': iter(lstQuantity[intIndex]),
+            'rate': iter(lstRate[intIndex]),
+            'amount': iter(lstAmount[intIndex]),
+            'subtotal': itertools.repeat(str(lstSubtotal[intIndex])),
+            'tax': itertools.repeat(str(lstTax[intIndex])),
+            'total': itertools.repeat(
+                str(lstSubtotal[intIndex] + lstTax[intIndex])
+            )
+        })
+
+    return lstValues
+
+def strPrecomputedValue(
+    pstrToken: str,
+    pdctValues: dict,
+    pobjRNG: np.random.Generator
+) -> str:
+    """Return the precomputed value of a token or draw it from vocabulary.
+
+    Inputs:
+        - pstrToken - token to replace
+        - pdctValues - values of the invoice, see lstRandomNumericBatch
+        - pobjRNG - random number generator of the current shard
 
-            # update the JSON dictionary
-            dctJSON['text'] = strText
-            dctJSON['annotations'].append(dctAnnotation)
+    Outputs:
+        - strReplace - value of the token
+    """
+
+    if pstrToken in dctNumericKinds:
+        strReplace = next(pdctValues[dctNumericKinds[pstrToken]])
+    else:
+        strReplace = strTokenValue(pstrToken, None, pobjRNG)
+
+    return strReplace
+
+def lstRenderBatch(
+    pintCount: int,
+    pobjRNG: np.random.Generator,
+    pblnClean: bool = blnCleanText
+) -> list:
+    """Render a batch of annotated invoices with precomputed numbers.
+
+    Inputs:
+        - pintCount - number of invoices to generate
+        - pobjRNG - random number generator of the current shard
+        - pblnClean - flag whether to generate texts without punctuation, see
+        dctRenderCleanTemplate
+
+    Outputs:
+        - lstJSON - list of dictionaries with 'text' and 'annotations' of the
+        generated invoices
+    """
+
+    assert type(pintCount) == int, 'The count must be an integer'
+
+    # load vocabularies and templates when used outside of a worker pool
+    if len(dctVocabularies) == 0:
+        InitializeWorker()
+
+    # get random templates and numbers of items
+    lstTemplates = [
+        objTemplateRegistry.dctDraw(pobjRNG) for _ in range(pintCount)
+    ]
+    arrRepeats = np.array(
+        [intRandomItemCount(pobjRNG) for _ in range(pintCount)],
+        dtype=np.int64
+    )
+
+    # generate numeric fields of all invoices at once
+    with pipeline_metrics.objSpan('generate_numbers'):
+        lstValues = lstRandomNumericBatch(lstTemplates, arrRepeats, pobjRNG)
+
+    # fill in the templates with the precomputed values
+    fnRender = dctRenderCleanTemplate if pblnClean else dctRenderTemplate
+
+    with pipeline_metrics.objSpan('render_templates'):
+        lstJSON = [
+            fnRender(
+                dctTemplate,
+                intRepeat,
+                functools.partial(
+                    strPrecomputedValue,
+                    pdctValues=dctValues,
+                    pobjRNG=pobjRNG
+                )
+            ) for dctTemplate, intRepeat, dctValues in zip(
+                lstTemplates, arrRepeats.tolist(), lstValues
+            )
+        ]
+
+    pipeline_metrics.Count('docs_generated', pintCount)
+    pipeline_metrics.Count('items_generated', int(arrRepeats.sum()))
+
+    return lstJSON
+
+def lstGenerateBatch(
+    pintCount: int,
+    pobjRNG: np.random.Generator,
+    pblnClean: bool = blnCleanText,
+    pobjFilter: duplicate_filter.BloomFilter = None
+) -> list:
+    """Generate a batch of annotated invoices, optionally without duplicates.
+
+    Inputs:
+        - pintCount - number of invoices to generate
+        - pobjRNG - random number generator of the current shard
+        - pblnClean - flag whether to generate texts without punctuation, see
+        dctRenderCleanTemplate
+        - pobjFilter - Bloom filter of the texts generated so far, invoices
+        found in it are replaced by new ones, None to keep all invoices
+
+    Outputs:
+        - lstJSON - list of dictionaries with 'text' and 'annotations' of the
+        generated invoices
+    """
+
+    if pobjFilter is None:
+        return lstRenderBatch(pintCount, pobjRNG, pblnClean)
+
+    lstJSON = []
+    intRetries = 0
+
+    # keep generating the missing invoices from the same random stream
+    while len(lstJSON) < pintCount:
+        lstUnique = [
+            dctJSON for dctJSON in lstRenderBatch(
+                pintCount - len(lstJSON),
+                pobjRNG,
+                pblnClean
+            ) if pobjFilter.blnAdd(
+                duplicate_filter.bytFingerprint(dctJSON['text'])
+            )
+        ]
+
+        intRetries = 0 if len(lstUnique) > 0 else intRetries + 1
+        assert intRetries < intDedupRetries, \
+            'No new unique invoices, the templates and vocabularies are ' \
+            'exhausted'
+
+        pipeline_metrics.Count(
+            'docs_rejected',
+            pintCount - len(lstJSON) - len(lstUnique)
+        )
+        lstJSON += lstUnique
+
+    return lstJSON
+
+def objShardFilter(pintCount: int, pblnDeduplicate: bool):
+    """Return a new Bloom filter for a shard or chunk if enabled.
 
-        # get the next token
-        intStart, strToken = tplFindEarliestToken(strText, lstTokens)
+    Inputs:
+        - pintCount - number of invoices of the shard or chunk
+        - pblnDeduplicate - flag whether to suppress duplicates
+
+    Outputs:
+        - objFilter - duplicate_filter.BloomFilter or None
+    """
+
+    if not pblnDeduplicate:
+        return None
+
+    return duplicate_filter.BloomFilter(pintCount, fltDedupErrorRate)
+
+def GenerateJSONBatch(
+    plstOutPaths: list,
+    pobjRNG: np.random.Generator,
+    pblnClean: bool = blnCleanText,
+    pobjFilter: duplicate_filter.BloomFilter = None
+) -> str:
+    """Generate and save one annotated invoice for each output path.
+
+    Inputs:
+        - plstOutPaths - list of paths of the JSON files to create
+        - pobjRNG - random number generator of the current shard
+        - pblnClean - flag whether to generate texts without punctuation
+        - pobjFilter - Bloom filter rejecting duplicates, see lstGenerateBatch
+
+    Outputs:
+        - strChecksum - checksum of the contents of all files, see
+        strFilesChecksum
+    """
+
+    lstJSON = lstGenerateBatch(
+        len(plstOutPaths),
+        pobjRNG,
+        pblnClean,
+        pobjFilter
+    )
+    objHash = hashlib.sha256()
+
+    with pipeline_metrics.objSpan('write_files'):
+        for strOutPath, dctJSON in zip(plstOutPaths, lstJSON):
+            # export the annotated file to json
+            strJSON = json.dumps(dctJSON, indent=4)
+
+            # save the invoice in a json file, in the background if enabled
+            if blnWriteBehind:
+                objGetWriter().Submit(strOutPath, strJSON)
+            else:
+                with open(strOutPath, 'w') as objOut:
+                    objOut.write(strJSON)
+
+            objHash.update(strJSON.encode('utf-8'))
+
+            # the serialized JSON is ASCII, one character is one byte
+            pipeline_metrics.Count('bytes_written', len(strJSON))
+
+        # all files of the batch are complete when it is reported done
+        if blnWriteBehind:
+            objGetWriter().Flush()
+
+    pipeline_metrics.Count('files_written', len(plstOutPaths))
+
+    return objHash.hexdigest()
+
+def strFilesChecksum(plstPaths: list) -> str:
+    """Return the checksum of the contents of JSON files read back as text.
+
+    Inputs:
+        - plstPaths - list of paths of the files in order
+
+    Outputs:
+        - strChecksum - SHA-256 hex digest of the concatenated texts, the
+        same as returned by GenerateJSONBatch for unchanged files
+    """
+
+    objHash = hashlib.sha256()
+
+    for strPath in plstPaths:
+        with open(strPath) as objFile:
+            objHash.update(objFile.read().encode('utf-8'))
+
+    return objHash.hexdigest()
+
+def GenerateJSON(
+    pstrOutPath: str,
+    pobjRNG: np.random.Generator = None,
+    pintItems: int = None
+) -> None:
+    global objUnseededRNG
+
+    # load vocabularies and templates when used outside of a worker pool
+    if len(dctVocabularies) == 0:
+        InitializeWorker()
+
+    # use the unseeded generator of the process if no shard generator is
+    # given
+    if pobjRNG is None:
+        if objUnseededRNG is None:
+            objUnseededRNG = np.random.default_rng()
+
+        pobjRNG = objUnseededRNG
+
+    # get a random template to annotate
+    dctTemplate = objTemplateRegistry.dctDraw(pobjRNG)
+
+    # get random number of invoice items unless given
+    if pintItems is None:
+        intRepeat = intRandomItemCount(pobjRNG)
+    else:
+        intRepeat = pintItems
+
+    # initialize values for templates that don't require this information
+    dctState = {
+        'quantity': 1,
+        'rate': 1,
+        'subtotal': 0,
+        'tax': 0
+    }
+
+    # fill in the template and annotate it
+    dctJSON = dctRenderTemplate(
+        dctTemplate,
+        intRepeat,
+        functools.partial(strTokenValue, pdctState=dctState, pobjRNG=pobjRNG)
+    )
 
     # export the annotated file to json
     strJSON = json.dumps(dctJSON, indent=4)
@@ -449,23 +1568,552 @@ def GenerateJSON(pstrOutPath: str) -> None:
     with open(pstrOutPath, 'w') as objOut:
         objOut.write(strJSON)
 
-def Threading(pintNumberOfFiles: int) -> None:
-    with concurrent.futures.ProcessPoolExecutor() as objExecutor:
-        lstFutures = []
+    pipeline_metrics.Count('docs_generated')
+    pipeline_metrics.Count('files_written')
+    pipeline_metrics.Count('bytes_written', len(strJSON))
+
+def GenerateShard(
+    pstrOutPath: str,
+    pintCount: int,
+    pintShard: int,
+    pintSeed: int = intSeed,
+    pblnClean: bool = blnCleanText,
+    pblnDeduplicate: bool = blnDeduplicate
+) -> dict:
+    """Generate annotated invoices and save them to a single shard.
+
+    Inputs:
+        - pstrOutPath - full path of the shard, see json_shards.strShardName
+        - pintCount - number of invoices in the shard
+        - pintShard - sequential number of the shard
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+        - pblnDeduplicate - flag whether to replace duplicates in the shard
+
+    Outputs:
+        - dctEntry - manifest entry with the shard number, the number of
+        generated invoices, the checksum of the shard file and the number of
+        rejected duplicates
+    """
+
+    objFilter = objShardFilter(pintCount, pblnDeduplicate)
+
+    lstJSON = lstGenerateBatch(
+        pintCount,
+        objShardGenerator(pintSeed, pintShard),
+        pblnClean,
+        objFilter
+    )
+    strChecksum = json_shards.WriteShard(
+        lstJSON,
+        pstrOutPath,
+        objGetWriter() if blnWriteBehind else None
+    )
+
+    dctEntry = {
+        'shard': pintShard,
+        'count': pintCount,
+        'sha256': strChecksum,
+        'rejected': objFilter.intRejected if objFilter else 0
+    }
+
+    return dctEntry
+
+def itrGenerateBatches(
+    pintCount: int,
+    pintBatchSize: int = intShardSize,
+    pintSeed: int = intSeed,
+    pblnClean: bool = blnCleanText,
+    pblnDeduplicate: bool = blnDeduplicate
+):
+    """Yield batches of annotated invoices generated in memory.
 
-        # submit tasks for file generation
-        for intCount in range(pintNumberOfFiles):
-            strOut = os.path.join(strPathOutputs, f'a{100000 + intCount}.json')
-            lstFutures.append(objExecutor.submit(GenerateJSON, strOut))
+    Batch number i contains the same invoices as the shard number i generated
+    by Threading with the same shard size and seed. With deduplication a
+    single filter covers the whole run, so duplicates across batches are
+    rejected as well and the batches differ from the shards.
 
-        concurrent.futures.wait(lstFutures)
+    Inputs:
+        - pintCount - total number of invoices to generate
+        - pintBatchSize - maximum number of invoices in a batch
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+        - pblnDeduplicate - flag whether to replace duplicates
+
+    Outputs:
+        - lstJSON - list of dictionaries with 'text' and 'annotations' of the
+        invoices in the batch, yielded for each batch
+    """
+
+    assert pintBatchSize > 0, 'The batch size must be positive'
+
+    # load vocabularies and templates in the current process or pick up
+    # changed templates
+    if len(dctVocabularies) == 0:
+        InitializeWorker()
+    else:
+        objTemplateRegistry.blnRefresh()
+
+    # the generation runs in a single process, share the filter of the run
+    objFilter = objShardFilter(pintCount, pblnDeduplicate)
+
+    for intShard, intStart in enumerate(range(0, pintCount, pintBatchSize)):
+        yield lstGenerateBatch(
+            min(pintBatchSize, pintCount - intStart),
+            objShardGenerator(pintSeed, intShard),
+            pblnClean,
+            objFilter
+        )
+
+    if objFilter is not None:
+        logging.info(
+            f'Duplicates rejected: {objFilter.intRejected} '
+            f'({objFilter.fltRejectionRate():.2%})'
+        )
+
+def itrGenerateRecords(
+    pintCount: int,
+    pintBatchSize: int = intShardSize,
+    pintSeed: int = intSeed,
+    pblnClean: bool = blnCleanText
+):
+    """Yield annotated invoices generated in memory one by one.
+
+    Inputs:
+        - pintCount - total number of invoices to generate
+        - pintBatchSize - number of invoices generated at once
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+
+    Outputs:
+        - dctJSON - dictionary with 'text' and 'annotations' of an invoice,
+        yielded for each invoice
+    """
+
+    for lstBatch in itrGenerateBatches(
+        pintCount, pintBatchSize, pintSeed, pblnClean
+    ):
+        yield from lstBatch
+
+def strDocumentPath(pintDocument: int) -> str:
+    """Return the output path of a single invoice JSON file.
+
+    Inputs:
+        - pintDocument - sequential number of the invoice
+
+    Outputs:
+        - strOut - full path of the JSON file
+    """
+
+    strOut = os.path.join(strPathOutputs, f'a{100000 + pintDocument}.json')
+
+    return strOut
+
+def GenerateFileChunk(
+    pintStart: int,
+    pintCount: int,
+    pintShard: int,
+    pintSeed: int = intSeed,
+    pblnClean: bool = blnCleanText,
+    pblnDeduplicate: bool = blnDeduplicate
+) -> dict:
+    """Generate a chunk of invoices, each saved to its own JSON file.
+
+    Inputs:
+        - pintStart - sequential number of the first invoice of the chunk
+        - pintCount - number of invoices in the chunk
+        - pintShard - sequential number of the chunk
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+        - pblnDeduplicate - flag whether to replace duplicates in the chunk
+
+    Outputs:
+        - dctEntry - manifest entry with the chunk number, the number of
+        generated invoices, the checksum of their files and the number of
+        rejected duplicates
+    """
+
+    lstOutPaths = [
+        strDocumentPath(intDocument)
+        for intDocument in range(pintStart, pintStart + pintCount)
+    ]
+    objFilter = objShardFilter(pintCount, pblnDeduplicate)
+
+    strChecksum = GenerateJSONBatch(
+        lstOutPaths,
+        objShardGenerator(pintSeed, pintShard),
+        pblnClean,
+        objFilter
+    )
+
+    dctEntry = {
+        'shard': pintShard,
+        'count': pintCount,
+        'sha256': strChecksum,
+        'rejected': objFilter.intRejected if objFilter else 0
+    }
+
+    return dctEntry
+
+def lstRunTasks(
+    plstTasks: list,
+    pintWorkers: int = intWorkers,
+    pintMaxInFlight: int = intMaxInFlight,
+    pfnDone = None
+) -> list:
+    """Run generation tasks in worker processes with bounded submission.
+
+    Every worker process loads vocabularies once and receives the templates
+    parsed by the parent process, at most pintMaxInFlight tasks are submitted
+    at the same time.
+
+    Inputs:
+        - plstTasks - list of (function, arguments) tuples
+        - pintWorkers - number of worker processes, None for all cores
+        - pintMaxInFlight - maximum number of submitted unfinished tasks,
+        None for twice the number of workers
+        - pfnDone - function called in the parent process with the return
+        value of every task as soon as it finishes, None for no call
+
+    Outputs:
+        - lstResults - return values of the tasks in order of completion
+    """
+
+    intWorkerCount = pintWorkers or os.cpu_count() or 1
+    intInFlight = pintMaxInFlight or 2 * intWorkerCount
+
+    # collect the metrics of the workers with their results
+    blnCollect = pipeline_metrics.blnEnabled
+
+    # parse the templates once and share them with all workers
+    objTemplateRegistry.blnRefresh()
+
+    # build a missing or outdated vocabulary store once before the workers
+    # map it
+    if blnVocabularyStore:
+        strPrepareStore(strPathData)
+
+    lstResults = []
+
+    def Collect(pobjFuture) -> None:
+        # raise the error of the task or get its result and metrics
+        objResult = pobjFuture.result()
+
+        if blnCollect:
+            objResult = pipeline_metrics.objCollect(objResult)
+
+        if pfnDone is not None:
+            pfnDone(objResult)
+
+        lstResults.append(objResult)
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=intWorkerCount,
+        initializer=InitializeWorker,
+        initargs=(strPathData, strPathTemplates, objTemplateRegistry)
+    ) as objExecutor:
+        setRunning = set()
+
+        for fnTask, tplArguments in plstTasks:
+            # wait for a free slot before submitting another task
+            if len(setRunning) >= intInFlight:
+                setDone, setRunning = concurrent.futures.wait(
+                    setRunning,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                # collect results and raise errors of the finished tasks
+                for objFuture in setDone:
+                    Collect(objFuture)
+
+            # collect the metrics of the task together with its result
+            if blnCollect:
+                setRunning.add(
+                    objExecutor.submit(
+                        pipeline_metrics.tplRunTask,
+                        fnTask,
+                        tplArguments
+                    )
+                )
+            else:
+                setRunning.add(objExecutor.submit(fnTask, *tplArguments))
+
+        # wait for the remaining tasks and raise their errors
+        for objFuture in concurrent.futures.as_completed(setRunning):
+            Collect(objFuture)
+
+    return lstResults
+
+def lstTaskOutputs(
+    pstrMode: str,
+    pintStart: int,
+    pintCount: int,
+    pintShard: int,
+    pblnCompress: bool
+) -> list:
+    """Return the output files of a single shard or chunk.
+
+    Inputs:
+        - pstrMode - 'files' or 'shards', see Threading
+        - pintStart - sequential number of the first invoice of the task
+        - pintCount - number of invoices of the task
+        - pintShard - sequential number of the shard or chunk
+        - pblnCompress - flag whether the shards are gzip compressed
+
+    Outputs:
+        - lstPaths - list of full paths of the files written by the task
+    """
+
+    if pstrMode == 'shards':
+        lstPaths = [
+            os.path.join(
+                strPathOutputs,
+                json_shards.strShardName(pintShard, pblnCompress)
+            )
+        ]
+    else:
+        lstPaths = [
+            strDocumentPath(intDocument)
+            for intDocument in range(pintStart, pintStart + pintCount)
+        ]
+
+    return lstPaths
+
+def blnTaskFinished(
+    pstrMode: str,
+    plstPaths: list,
+    pdctEntry: dict,
+    pblnVerify: bool = blnVerifyResume
+) -> bool:
+    """Check whether a shard or chunk recorded as done is still complete.
+
+    Inputs:
+        - pstrMode - 'files' or 'shards', see Threading
+        - plstPaths - list of the output files of the task, see
+        lstTaskOutputs
+        - pdctEntry - 'done' entry of the task from the manifest, None if the
+        task is not recorded
+        - pblnVerify - flag whether to compare the checksums of the files,
+        otherwise only their presence is checked
+
+    Outputs:
+        - blnOut - True if the task does not need to be generated again
+    """
+
+    if pdctEntry is None:
+        return False
+
+    if not all(os.path.isfile(strPath) for strPath in plstPaths):
+        return False
+
+    if not pblnVerify:
+        return True
+
+    if pstrMode == 'shards':
+        strChecksum = json_shards.strFileChecksum(plstPaths[0])
+    else:
+        strChecksum = strFilesChecksum(plstPaths)
+
+    return strChecksum == pdctEntry['sha256']
+
+def Threading(
+    pintNumberOfFiles: int,
+    pstrMode: str = strOutputMode,
+    pintShardSize: int = intShardSize,
+    pblnCompress: bool = blnCompressShards,
+    pintWorkers: int = intWorkers,
+    pintChunkSize: int = intChunkSize,
+    pintMaxInFlight: int = intMaxInFlight,
+    pintSeed: int = intSeed,
+    pblnClean: bool = blnCleanText,
+    pblnExtend: bool = False,
+    pblnVerify: bool = blnVerifyResume,
+    pblnDeduplicate: bool = blnDeduplicate
+) -> None:
+    """Generate annotated invoices in parallel processes.
+
+    Every worker process loads vocabularies and templates once and then
+    generates whole chunks of invoices, at most pintMaxInFlight chunks are
+    submitted at the same time. Every shard or chunk draws from its own
+    random stream derived from pintSeed, so the output does not depend on
+    the number of workers or the order of the tasks.
+
+    Every finished shard or chunk is recorded in the manifest of the output
+    folder together with its checksum. Running the same generation again
+    only produces the shards or chunks that are missing. In the extend mode
+    pintNumberOfFiles more invoices are appended after the existing ones,
+    their shards or chunks continue the numbering of the existing ones.
+
+    Inputs:
+        - pintNumberOfFiles - number of invoices to generate, or to add in
+        the extend mode
+        - pstrMode - 'files' for a JSON file per invoice, 'shards' for
+        newline-delimited JSON shards
+        - pintShardSize - maximum number of invoices in a shard, in shards
+        mode every shard is a single chunk
+        - pblnCompress - flag whether the shards are gzip compressed
+        - pintWorkers - number of worker processes, None for all cores
+        - pintChunkSize - number of invoices per task in files mode
+        - pintMaxInFlight - maximum number of submitted unfinished tasks,
+        None for twice the number of workers
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+        - pblnExtend - flag whether to add invoices to an existing dataset
+        - pblnVerify - flag whether to verify the checksums of the finished
+        shards or chunks before skipping them
+        - pblnDeduplicate - flag whether to replace invoices repeating an
+        earlier invoice of the same shard or chunk, see lstGenerateBatch
+    """
+
+    assert pstrMode in ['files', 'shards'], 'Unknown output mode'
+    assert pintShardSize > 0, 'The shard size must be positive'
+    assert pintChunkSize > 0, 'The chunk size must be positive'
+    assert pintNumberOfFiles > 0, 'The number of files must be positive'
+
+    # every shard is a task in shards mode, every chunk in files mode
+    intTaskSize = pintShardSize if pstrMode == 'shards' else pintChunkSize
+
+    dctRun = {
+        'mode': pstrMode,
+        'task_size': intTaskSize,
+        'compress': pblnCompress and pstrMode == 'shards',
+        'seed': pintSeed,
+        'clean': pblnClean
+    }
+
+    # deduplicated runs produce different invoices
+    if pblnDeduplicate:
+        dctRun['dedup'] = fltDedupErrorRate
+
+    # read the state of an earlier run in the output folder
+    strManifest = os.path.join(strPathOutputs, strManifestName)
+    lstEntries = json_shards.lstReadManifest(strManifest)
+
+    if len(lstEntries) == 0:
+        lstEntries = [{'run': dctRun}]
+        json_shards.AppendManifest(strManifest, lstEntries[0])
+
+    assert lstEntries[0].get('run') == dctRun, \
+        'The output folder contains a run with different settings'
+
+    lstPlans = [
+        dctEntry['plan'] for dctEntry in lstEntries if 'plan' in dctEntry
+    ]
+    dctDone = {
+        dctEntry['done']['shard']: dctEntry['done']
+        for dctEntry in lstEntries if 'done' in dctEntry
+    }
+    intPlanned = sum(dctPlan['count'] for dctPlan in lstPlans)
+
+    # request the invoices on the first run or when extending the dataset
+    if len(lstPlans) == 0 or pblnExtend:
+        dctPlan = {
+            'start': intPlanned,
+            'count': pintNumberOfFiles,
+            'shard': sum(
+                -(-dctPlan['count'] // intTaskSize) for dctPlan in lstPlans
+            )
+        }
+        json_shards.AppendManifest(strManifest, {'plan': dctPlan})
+        lstPlans.append(dctPlan)
+    else:
+        assert intPlanned == pintNumberOfFiles, \
+            f'The output folder contains a run of {intPlanned} invoices, ' \
+            'use the extend mode to add more'
+
+    # prepare the missing tasks as (function, arguments) pairs
+    lstTasks = []
+    intSkipped = 0
+
+    for dctPlan in lstPlans:
+        intEnd = dctPlan['start'] + dctPlan['count']
+
+        for intShard, intStart in enumerate(
+            range(dctPlan['start'], intEnd, intTaskSize),
+            start=dctPlan['shard']
+        ):
+            intCount = min(intTaskSize, intEnd - intStart)
+            lstPaths = lstTaskOutputs(
+                pstrMode, intStart, intCount, intShard, pblnCompress
+            )
+
+            # skip the shards and chunks finished by an earlier run
+            if blnTaskFinished(
+                pstrMode, lstPaths, dctDone.get(intShard), pblnVerify
+            ):
+                intSkipped += 1
+                continue
+
+            if pstrMode == 'shards':
+                lstTasks.append((
+                    GenerateShard,
+                    (
+                        lstPaths[0],
+                        intCount,
+                        intShard,
+                        pintSeed,
+                        pblnClean,
+                        pblnDeduplicate
+                    )
+                ))
+            else:
+                lstTasks.append((
+                    GenerateFileChunk,
+                    (
+                        intStart,
+                        intCount,
+                        intShard,
+                        pintSeed,
+                        pblnClean,
+                        pblnDeduplicate
+                    )
+                ))
+
+    logging.info(
+        f'Tasks to generate: {len(lstTasks)}, '
+        f'finished earlier: {intSkipped}'
+    )
+
+    # record every finished task as soon as it is done
+    with pipeline_metrics.objSpan('generation'):
+        lstEntries = lstRunTasks(
+            lstTasks,
+            pintWorkers,
+            pintMaxInFlight,
+            lambda dctEntry: json_shards.AppendManifest(
+                strManifest,
+                {'done': dctEntry}
+            )
+        )
+
+    # report the share of rendered invoices rejected as duplicates
+    if pblnDeduplicate and len(lstEntries) > 0:
+        intRejected = sum(dctEntry['rejected'] for dctEntry in lstEntries)
+        intRendered = intRejected + sum(
+            dctEntry['count'] for dctEntry in lstEntries
+        )
+
+        logging.info(
+            f'Duplicates rejected: {intRejected} '
+            f'({intRejected / intRendered:.2%} of rendered invoices)'
+        )
+
+# %% template registry
+objTemplateRegistry = TemplateRegistry(strPathTemplates)
+
+# %% token labels
+dctLabels = {strToken: strCreateJSONLabel(strToken) for strToken in lstTokens}
 
 # %% generate annotations
 if __name__ == '__main__':
+    pipeline_metrics.Enable(blnMetrics)
+
     print(datetime.datetime.now())
     Threading(intFiles)
     print(datetime.datetime.now())
 
+    pipeline_metrics.strWriteMetrics('generation')
+
     # ThreadPoolExecutor result:
     # 2024-01-02 07:54:48.922126
     # 2024-01-02 08:04:03.673206
@@ -1,10 +1,17 @@
 # %% imports
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
-import json
+import array
+import hashlib
 import string
 import concurrent.futures
 import datetime
+import time
+import json_shards
+import pipeline_metrics
 
 # %% definitions
 
@@ -15,40 +22,472 @@ strPathBackup = 'c:/repositories/zzz_data_for_lstm/data/outputs/backup/'
 # file name
 strExtension = '.json'
 
+# the inputs were generated without punctuation, skip the cleaning
+blnGeneratedClean = False
+
+# collect timings and counters of the run and save them to a metrics file
+blnMetrics = False
+
+# punctuation characters as a lookup table of the ASCII code points and as a
+# translation table removing them
+arrPunctuation = np.zeros(128, dtype=bool)
+arrPunctuation[[ord(strChar) for strChar in string.punctuation]] = True
+dctPunctuation = str.maketrans('', '', string.punctuation)
+
+# ingestion mode, 'threads' for batches of files processed in threads,
+# 'processes' for batches of files processed in worker processes
+strIngestMode = 'threads'
+
+# number of threads or worker processes (None for the executor default),
+# number of JSON files per batch, every shard is a batch of its own, and
+# maximum number of submitted unfinished batches (None for twice the cores)
+intIngestWorkers = None
+intIngestBatchSize = 200
+intIngestMaxInFlight = None
+
+# ingest only new or changed inputs and append them as parts of the datasets
+blnIncremental = False
+
+# detect changed inputs by 'mtime' for their size and modification time or
+# by 'hash' to compare the checksum of files with a new modification time
+strIngestChange = 'mtime'
+
+# manifest of the ingested inputs and dataset folders in the backup folder
+strIngestManifestName = 'ingestion.manifest'
+strTextDataset = 'text'
+strAnnotationsDataset = 'annotations'
+
+# file name parts of the dataset parts
+strPartPrefix = 'part-'
+strPartExtension = '.parquet'
+
+# columns of the 128-bit content hash of the texts, the first and the last
+# eight bytes of the digest as unsigned integers
+lstHashColumns = ['hash_high', 'hash_low']
+intHashSize = 16
+
+# parquet schemas of the text and annotations outputs
+objTextSchema = pa.schema(
+    [('text', pa.string())] +
+    [(strColumn, pa.uint64()) for strColumn in lstHashColumns]
+)
+objAnnotationsSchema = pa.schema(
+    [
+        ('label', pa.string()),
+        ('start', pa.int32()),
+        ('end', pa.int32())
+    ] +
+    [(strColumn, pa.uint64()) for strColumn in lstHashColumns]
+)
+
+# number of rows of the row groups and compression of the parquet outputs
+intRowGroupSize = 100000
+strParquetCompression = 'snappy'
+
+# JSON decoders and batch sizes compared by dtfParseBenchmark
+lstParseBackends = ['json', 'orjson']
+lstParseBatchSizes = [1, 50, 200, 1000]
+
 # functions
-def dtfJSONtoDataFrame(pobjJSONData: dict) -> pd.DataFrame:
-    """Process ingested JSON data to appropriate form for pandas data frame.
+def bytTextHash(pstrText: str) -> bytes:
+    """Return the stable content hash of a text.
 
     Inputs:
-        - pobjJSONData - data read in from a JSON file
+        - pstrText - text of a document
 
     Outputs:
-        - dtfOut - processed data frame that contains text column with the
-        source data, annotations column with all tokens, start column with
-        integer value of the starting position of the token, and end column
-        with integer value of the ending position of the token
+        - bytOut - 128-bit BLAKE2b digest of the UTF-8 encoded text, the same
+        in every process and run
     """
 
-    assert type(pobjJSONData) == dict, 'Must be a dictionary from JSON input'
+    bytOut = hashlib.blake2b(
+        pstrText.encode('utf-8', 'surrogatepass'),
+        digest_size=intHashSize
+    ).digest()
 
-    # process annotations first, normalize the text labels
-    dtfAnnotations = pd.json_normalize(
-        pobjJSONData,
-        'annotations',
-        meta='text',
-        sep='_'
-    )
+    return bytOut
+
+def arrHashColumns(pbytHashes: bytes) -> np.ndarray:
+    """Convert concatenated text hashes to pairs of unsigned integers.
+
+    Inputs:
+        - pbytHashes - digests of bytTextHash joined together
 
-    # process the text data
-    dtfText = pd.DataFrame(pobjJSONData)
+    Outputs:
+        - arrOut - uint64 array with a row per hash and the columns of
+        lstHashColumns
+    """
 
-    # drop annotations from the full table
-    dtfText.drop('annotations', axis=1, inplace=True)
+    arrOut = np.frombuffer(pbytHashes, dtype='>u8').astype(np.uint64)
 
-    # merge the two datasets to the final one
-    dtfOut = pd.merge(dtfText, dtfAnnotations, on='text')
+    return arrOut.reshape(-1, len(lstHashColumns))
 
-    return dtfOut
+class AnnotationAccumulator:
+    """Columns of annotated documents collected during the ingestion.
+
+    Every document text is stored once with its content hash, its annotations
+    are appended to growable typed arrays of document indexes, label codes
+    and positions.
+    The data frames are built only once after all inputs were added.
+    """
+
+    def __init__(self):
+        """Start with no documents."""
+
+        self.lstTexts = []
+        self.bytHashes = bytearray()
+        self.lstLabels = []
+        self.dctLabelCodes = dict()
+
+        self.arrDocs = array.array('i')
+        self.arrLabelCodes = array.array('i')
+        self.arrStart = array.array('i')
+        self.arrEnd = array.array('i')
+
+    def __len__(self) -> int:
+        return len(self.lstTexts)
+
+    def intLabelCode(self, pstrLabel: str) -> int:
+        """Return the code of a label, a new label gets the next code.
+
+        Inputs:
+            - pstrLabel - label of an annotation
+
+        Outputs:
+            - intCode - index of the label in lstLabels
+        """
+
+        intCode = self.dctLabelCodes.get(pstrLabel)
+
+        if intCode is None:
+            intCode = len(self.lstLabels)
+            self.dctLabelCodes[pstrLabel] = intCode
+            self.lstLabels.append(pstrLabel)
+
+        return intCode
+
+    def AddRecord(self, pdctData: dict) -> None:
+        """Append a single annotated document.
+
+        Inputs:
+            - pdctData - dictionary with 'text' and 'annotations'
+        """
+
+        intDoc = len(self.lstTexts)
+        self.lstTexts.append(pdctData['text'])
+        self.bytHashes += bytTextHash(pdctData['text'])
+
+        for dctAnnotation in pdctData['annotations']:
+            self.arrDocs.append(intDoc)
+            self.arrLabelCodes.append(
+                self.intLabelCode(dctAnnotation['label'])
+            )
+            self.arrStart.append(dctAnnotation['start'])
+            self.arrEnd.append(dctAnnotation['end'])
+
+    def AddRecords(self, plstRecords: list) -> None:
+        """Append a list of annotated documents.
+
+        Inputs:
+            - plstRecords - list of dictionaries with 'text' and 'annotations'
+        """
+
+        for dctData in plstRecords:
+            self.AddRecord(dctData)
+
+    def dctColumns(self) -> dict:
+        """Return the collected columns in a compact form for other processes.
+
+        Outputs:
+            - dctOut - dictionary with the list of document texts under 'text',
+            their joined hashes under 'hash', the labels under 'labels' and for
+            every annotation the index of its document under 'doc', the code of
+            its label under 'label_code' and the positions under 'start' and
+            'end'
+        """
+
+        dctOut = {
+            'text': self.lstTexts,
+            'hash': self.bytHashes,
+            'labels': self.lstLabels,
+            'doc': self.arrDocs,
+            'label_code': self.arrLabelCodes,
+            'start': self.arrStart,
+            'end': self.arrEnd
+        }
+
+        return dctOut
+
+    def AddColumns(self, pdctColumns: dict) -> None:
+        """Append the columns collected by another accumulator.
+
+        Inputs:
+            - pdctColumns - output of dctColumns
+        """
+
+        # shift the document indexes behind the documents collected so far
+        arrDocs = np.frombuffer(pdctColumns['doc'], dtype=np.int32) + \
+            len(self.lstTexts)
+
+        # translate the label codes of the other accumulator to this one
+        arrCodeMap = np.array(
+            [
+                self.intLabelCode(strLabel)
+                for strLabel in pdctColumns['labels']
+            ],
+            dtype=np.int32
+        )
+        arrLabelCodes = arrCodeMap[
+            np.frombuffer(pdctColumns['label_code'], dtype=np.int32)
+        ]
+
+        self.lstTexts += pdctColumns['text']
+        self.bytHashes += pdctColumns['hash']
+        self.arrDocs.frombytes(arrDocs.astype(np.int32).tobytes())
+        self.arrLabelCodes.frombytes(arrLabelCodes.tobytes())
+        self.arrStart.frombytes(pdctColumns['start'].tobytes())
+        self.arrEnd.frombytes(pdctColumns['end'].tobytes())
+
+    def dtfBuild(self) -> pd.DataFrame:
+        """Build a data frame with a row per annotation.
+
+        Outputs:
+            - dtfOut - pandas data frame with the text of the document, label,
+            start and end of every annotation, the text column refers to the
+            single stored text of each document
+        """
+
+        arrDocs = np.array(self.arrDocs, dtype=np.int32)
+
+        dtfOut = pd.DataFrame({
+            'text': np.array(self.lstTexts, dtype=object)[arrDocs],
+            'label': np.array(self.lstLabels, dtype=object)[
+                np.array(self.arrLabelCodes, dtype=np.int32)
+            ],
+            'start': np.array(self.arrStart, dtype=np.int32),
+            'end': np.array(self.arrEnd, dtype=np.int32)
+        })
+
+        pipeline_metrics.Count('annotations_built', len(dtfOut))
+
+        return dtfOut
+
+    def tplBuildFrames(self) -> tuple:
+        """Build the text and annotations data frames without joining on text.
+
+        Outputs:
+            - tplOut - tuple of a data frame with unique texts and their hash
+            columns and a data frame with the label, start, end and text hash
+            columns of every annotation, see lstHashColumns
+        """
+
+        # give the hash of every document to its annotations by index
+        arrHashes = arrHashColumns(bytes(self.bytHashes))
+        arrDocs = np.array(self.arrDocs, dtype=np.int32)
+
+        dtfText = pd.DataFrame({'text': self.lstTexts})
+        dtfText[lstHashColumns] = arrHashes
+        dtfText = dtfText.drop_duplicates(lstHashColumns, ignore_index=True)
+
+        dtfAnnotations = pd.DataFrame({
+            'label': np.array(self.lstLabels, dtype=object)[
+                np.array(self.arrLabelCodes, dtype=np.int32)
+            ],
+            'start': np.array(self.arrStart, dtype=np.int32),
+            'end': np.array(self.arrEnd, dtype=np.int32)
+        })
+        dtfAnnotations[lstHashColumns] = arrHashes[arrDocs]
+
+        pipeline_metrics.Count('annotations_built', len(dtfAnnotations))
+
+        return dtfText, dtfAnnotations
+
+class ParquetStreamWriter:
+    """Parquet writer of the text and annotations data of the ingestion.
+
+    The columns of every finished batch are written out as soon as they
+    arrive, buffered only up to a row group, so the memory does not grow
+    with the size of the dataset. Texts already written are recognized by
+    their content hash and skipped. Both files are written with the fixed
+    schemas objTextSchema and objAnnotationsSchema, under temporary names,
+    and published by Close.
+    """
+
+    def __init__(
+        self,
+        pstrTextPath: str,
+        pstrAnnotationsPath: str,
+        pintRowGroupSize: int = intRowGroupSize,
+        pstrCompression: str = strParquetCompression
+    ):
+        """Prepare the writers of both files.
+
+        Inputs:
+            - pstrTextPath - full path of the text parquet file
+            - pstrAnnotationsPath - full path of the annotations parquet file
+            - pintRowGroupSize - number of rows of a row group
+            - pstrCompression - parquet compression codec, e.g. 'snappy'
+        """
+
+        assert pintRowGroupSize > 0, 'The row group size must be positive'
+
+        self.intRowGroupSize = pintRowGroupSize
+        self.strCompression = pstrCompression
+
+        self.lstPaths = [pstrTextPath, pstrAnnotationsPath]
+        self.dctSchemas = {
+            pstrTextPath: objTextSchema,
+            pstrAnnotationsPath: objAnnotationsSchema
+        }
+
+        # parquet writer, buffered tables and number of buffered rows of
+        # every file
+        self.dctWriters = {strPath: None for strPath in self.lstPaths}
+        self.dctBuffers = {strPath: [] for strPath in self.lstPaths}
+        self.dctRows = {strPath: 0 for strPath in self.lstPaths}
+
+        # hashes of the written texts
+        self.setSeen = set()
+
+        self.intDocs = 0
+        self.intTexts = 0
+
+    def __len__(self) -> int:
+        return self.intDocs
+
+    def AddColumns(self, pdctColumns: dict) -> None:
+        """Write the columns of a batch, see AnnotationAccumulator.AddColumns.
+
+        Inputs:
+            - pdctColumns - output of AnnotationAccumulator.dctColumns
+        """
+
+        objBatch = AnnotationAccumulator()
+        objBatch.AddColumns(pdctColumns)
+
+        dtfText, dtfAnnotations = objBatch.tplBuildFrames()
+
+        # keep only the texts not written by the earlier batches
+        lstKeys = list(zip(
+            dtfText[lstHashColumns[0]].tolist(),
+            dtfText[lstHashColumns[1]].tolist()
+        ))
+        arrNew = np.array(
+            [tplKey not in self.setSeen for tplKey in lstKeys],
+            dtype=bool
+        )
+        self.setSeen.update(lstKeys)
+
+        self.intDocs += len(objBatch)
+        self.intTexts += int(arrNew.sum())
+
+        self.Append(self.lstPaths[0], dtfText[arrNew])
+        self.Append(self.lstPaths[1], dtfAnnotations)
+
+    def Append(self, pstrPath: str, pdtfData: pd.DataFrame) -> None:
+        """Buffer rows of a file and write every full row group.
+
+        Inputs:
+            - pstrPath - full path of the file
+            - pdtfData - rows to append
+        """
+
+        if len(pdtfData) == 0:
+            return
+
+        objTable = pa.Table.from_pandas(
+            pdtfData,
+            schema=self.dctSchemas[pstrPath],
+            preserve_index=False
+        )
+
+        if self.dctWriters[pstrPath] is None:
+            self.dctWriters[pstrPath] = pq.ParquetWriter(
+                pstrPath + '.tmp',
+                objTable.schema,
+                compression=self.strCompression
+            )
+
+        self.dctBuffers[pstrPath].append(objTable)
+        self.dctRows[pstrPath] += objTable.num_rows
+
+        if self.dctRows[pstrPath] >= self.intRowGroupSize:
+            self.WriteBuffer(pstrPath)
+
+    def WriteBuffer(self, pstrPath: str, pblnFinal: bool = False) -> None:
+        """Write the buffered rows of a file as full row groups.
+
+        Inputs:
+            - pstrPath - full path of the file
+            - pblnFinal - flag whether to write the last incomplete row group
+        """
+
+        intRows = self.dctRows[pstrPath]
+
+        if not pblnFinal:
+            intRows -= intRows % self.intRowGroupSize
+
+        if intRows == 0:
+            return
+
+        objTable = pa.concat_tables(self.dctBuffers[pstrPath])
+
+        with pipeline_metrics.objSpan('write_parquet'):
+            self.dctWriters[pstrPath].write_table(
+                objTable.slice(0, intRows),
+                row_group_size=self.intRowGroupSize
+            )
+
+        pipeline_metrics.Count('rows_written', intRows)
+
+        # keep the rows of the incomplete row group
+        objRest = objTable.slice(intRows)
+
+        self.dctBuffers[pstrPath] = [objRest] if objRest.num_rows else []
+        self.dctRows[pstrPath] = objRest.num_rows
+
+    def Close(self) -> None:
+        """Write the remaining rows and publish both files."""
+
+        for strPath in self.lstPaths:
+            self.WriteBuffer(strPath, True)
+
+            if self.dctWriters[strPath] is None:
+                # no rows at all, save an empty file with the columns
+                pq.write_table(
+                    self.dctSchemas[strPath].empty_table(),
+                    strPath + '.tmp',
+                    compression=self.strCompression
+                )
+            else:
+                self.dctWriters[strPath].close()
+                self.dctWriters[strPath] = None
+
+            os.replace(strPath + '.tmp', strPath)
+
+    def Abort(self) -> None:
+        """Close and remove the unfinished files after an error."""
+
+        for strPath in self.lstPaths:
+            try:
+                if self.dctWriters[strPath] is not None:
+                    self.dctWriters[strPath].close()
+                    self.dctWriters[strPath] = None
+
+                os.remove(strPath + '.tmp')
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, pobjType, *ptplException):
+        if pobjType is None:
+            self.Close()
+        else:
+            self.Abort()
+
+        return False
 
 def dctCleanText(pdctData: dict) -> dict:
     """Clean up annotated data loaded from JSON stored in a dictionary.
@@ -63,178 +502,1045 @@ def dctCleanText(pdctData: dict) -> dict:
     Outputs:
         - pdctData - dictionary containing the text cleaned of punctuation and
         with the start and end positions of its labels recalculated respective
-        to the number of punctuation characters in the original text
+        to the number of punctuation characters in the original text, the
+        characters up to and including the position are counted
     """
 
     assert type(pdctData) == dict, 'Input must be a dictionary'
 
-    # initialize variables for the process
-    intSum = 0
-    dctCumSum = dict()
-    strCleanText = ''
-
-    # create a dictionary of number of punctuation characters within string at
-    # a specified position while cleaning the original text
-    for intIndex, strChar in enumerate(pdctData['text']):
-        # check if the character is punctuation
-        if strChar in string.punctuation:
-            intSum += 1
-        else:
-            strCleanText = ''.join([strCleanText, strChar])
+    return lstCleanTexts([pdctData])[0]
 
-        # store the incremental sum
-        dctCumSum[intIndex] = intSum
+def lstCleanTexts(plstRecords: list) -> list:
+    """Clean up a batch of annotated documents in a single vectorized pass.
 
-    # replace the original text with the cleaned one
-    pdctData['text'] = strCleanText
+    The texts are joined to a single array of code points, the punctuation
+    characters are found by a lookup table and counted by a cumulative sum,
+    all annotation positions are then shifted in one gather.
 
-    for dctAnnotation in pdctData['annotations']:
-        # for each annotation recalculate its starting and ending possition
-        dctAnnotation['start'] = dctAnnotation['start'] - dctCumSum[
-            dctAnnotation['start']
-        ]
+    Inputs:
+        - plstRecords - list of dictionaries with 'text' and 'annotations',
+        see dctCleanText
 
-        dctAnnotation['end'] = dctAnnotation['end'] - dctCumSum[
-            dctAnnotation['end']
-        ]
+    Outputs:
+        - plstRecords - the same dictionaries with the texts cleaned of
+        punctuation and the start and end positions of their labels
+        recalculated, the same as dctCleanText returns for each of them
+    """
 
-    return pdctData
+    assert type(plstRecords) == list, 'Input must be a list of dictionaries'
+
+    lstTexts = [dctData['text'] for dctData in plstRecords]
+
+    # start of every text in the joined text
+    arrBase = np.zeros(len(lstTexts) + 1, dtype=np.int64)
+    np.cumsum([len(strText) for strText in lstTexts], out=arrBase[1:])
+
+    # code points of the joined text, non-ASCII ones are never punctuation
+    arrCodes = np.frombuffer(
+        ''.join(lstTexts).encode('utf-32-le', 'surrogatepass'),
+        dtype=np.uint32
+    )
+    arrMask = arrPunctuation[np.minimum(arrCodes, len(arrPunctuation) - 1)]
+
+    # number of punctuation characters before every position
+    arrCumSum = np.zeros(len(arrCodes) + 1, dtype=np.int64)
+    np.cumsum(arrMask, out=arrCumSum[1:])
+
+    lstAnnotations = [
+        dctData['annotations'] for dctData in plstRecords
+    ]
+    arrDocs = np.repeat(
+        np.arange(len(lstTexts)),
+        [len(lstDocument) for lstDocument in lstAnnotations]
+    )
+    arrPositions = np.array(
+        [
+            [dctAnnotation['start'], dctAnnotation['end']]
+            for lstDocument in lstAnnotations
+            for dctAnnotation in lstDocument
+        ],
+        dtype=np.int64
+    ).reshape(-1, 2)
+
+    arrDocStart = arrBase[arrDocs][:, None]
+    arrDocLength = (arrBase[arrDocs + 1] - arrBase[arrDocs])[:, None]
+
+    assert np.all((arrPositions >= 0) & (arrPositions < arrDocLength)), \
+        'Annotation positions must lie within their text'
+
+    # subtract the punctuation up to and including the position within the
+    # own document
+    arrPositions -= arrCumSum[arrDocStart + arrPositions + 1] - \
+        arrCumSum[arrDocStart]
+
+    itrPositions = iter(arrPositions.tolist())
+
+    for dctData, lstDocument in zip(plstRecords, lstAnnotations):
+        # replace the original text with the cleaned one
+        dctData['text'] = dctData['text'].translate(dctPunctuation)
+
+        for dctAnnotation in lstDocument:
+            dctAnnotation['start'], dctAnnotation['end'] = next(itrPositions)
+
+    return plstRecords
+
+class DatasetPartWriter:
+    """Writer of every ingested batch as a part of the backup datasets.
+
+    The columns of every batch are saved as a new part of the text and
+    annotations datasets and the ingestion manifest records the inputs of
+    the part, so a changed input later replaces only the part of its batch.
+    The entry of the first part also records the replaced parts, Close
+    records them if no part was written and removes their files.
+    """
+
+    def __init__(
+        self,
+        pstrBackup: str,
+        pdctFiles: dict,
+        plstReplaced: list
+    ):
+        """Prepare the parts of a run.
+
+        Inputs:
+            - pstrBackup - folder of the datasets and of the manifest
+            - pdctFiles - states of the ingested inputs keyed by the file
+            name, see dctInputState
+            - plstReplaced - names of the parts replaced by the run
+        """
+
+        self.strBackup = pstrBackup
+        self.strManifest = os.path.join(pstrBackup, strIngestManifestName)
+        self.dctFiles = pdctFiles
+
+        self.lstReplaced = list(plstReplaced)
+        self.blnRecorded = False
+
+        # name of the parts of the run, unique by the start time and the
+        # number of the part
+        self.strRun = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        self.lstParts = []
+
+        self.intDocs = 0
+
+    def __len__(self) -> int:
+        return self.intDocs
+
+    def AddColumns(self, pdctColumns: dict) -> None:
+        """Save the columns of a batch as a new part and record it.
+
+        Inputs:
+            - pdctColumns - output of dctProcessFiles
+        """
+
+        strPart = strPartPrefix + self.strRun + '-' + \
+            str(len(self.lstParts)).zfill(5) + strPartExtension
+
+        # stream the part first, the manifest entry makes it valid
+        with ParquetStreamWriter(
+            os.path.join(self.strBackup, strTextDataset, strPart),
+            os.path.join(self.strBackup, strAnnotationsDataset, strPart)
+        ) as objWriter:
+            objWriter.AddColumns(pdctColumns)
+
+        json_shards.AppendManifest(
+            self.strManifest,
+            {
+                'part': strPart,
+                'files': {
+                    os.path.basename(strPath): self.dctFiles[
+                        os.path.basename(strPath)
+                    ]
+                    for strPath in pdctColumns['paths']
+                },
+                'replaces': [] if self.blnRecorded else self.lstReplaced
+            }
+        )
+
+        self.blnRecorded = True
+        self.lstParts.append(strPart)
+        self.intDocs += len(objWriter)
+
+    def Close(self) -> None:
+        """Record the replaced parts and remove their files."""
+
+        if not self.blnRecorded and len(self.lstReplaced) > 0:
+            json_shards.AppendManifest(
+                self.strManifest,
+                {'part': None, 'files': {}, 'replaces': self.lstReplaced}
+            )
+
+        self.blnRecorded = True
+
+        for strDataset in [strTextDataset, strAnnotationsDataset]:
+            for strReplaced in self.lstReplaced:
+                os.remove(
+                    os.path.join(self.strBackup, strDataset, strReplaced)
+                )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, pobjType, *ptplException):
+        # parts of a failed run stay valid, the inputs of the missing ones
+        # are ingested by the next run
+        if pobjType is None:
+            self.Close()
+
+        return False
+
+def tplReadBatch(
+    plstPaths: list,
+    pstrBackend: str = json_shards.strJSONBackend
+) -> tuple:
+    """Read and decode a batch of JSON files and shards.
+
+    All files of the batch are read whole first and then decoded in one go,
+    so the decoding throughput is measured apart from the file access.
+
+    Inputs:
+        - plstPaths - list of full paths of JSON files and shards
+        - pstrBackend - JSON decoder, see json_shards.tplJSONBackend
+
+    Outputs:
+        - tplOut - tuple of the list of the decoded documents of every read
+        file and a dictionary with the backend, the number of files, failed
+        files, documents and decoded bytes and the seconds spent reading and
+        decoding
+    """
+
+    strBackend, fnLoads = json_shards.tplJSONBackend(pstrBackend)
+
+    dctStats = {
+        'backend': strBackend,
+        'files': len(plstPaths),
+        'failed': 0,
+        'docs': 0,
+        'bytes': 0,
+        'read_s': 0.0,
+        'parse_s': 0.0
+    }
+
+    # read the whole content of every file
+    fltStart = time.perf_counter()
+    lstData = []
+
+    for strPath in plstPaths:
+        try:
+            lstData.append((strPath, json_shards.bytReadFile(strPath)))
+
+        except Exception as e:
+            dctStats['failed'] += 1
+            pipeline_metrics.Count('files_failed')
+            print(f'Error in JSON processing: {e}')
+
+    dctStats['read_s'] = time.perf_counter() - fltStart
+
+    # decode all documents of the batch
+    fltStart = time.perf_counter()
+    lstFiles = []
+
+    for strPath, bytData in lstData:
+        blnShard = json_shards.blnIsShard(strPath)
+
+        try:
+            lstFiles.append(json_shards.lstDecodeRecords(
+                bytData,
+                blnShard,
+                fnLoads
+            ))
+
+        except Exception as e:
+            dctStats['failed'] += 1
+            pipeline_metrics.Count('files_failed')
+            print(f'Error in JSON processing: {e}')
+
+            continue
+
+        dctStats['bytes'] += len(bytData)
+        pipeline_metrics.Count('shards_parsed' if blnShard else 'files_parsed')
+
+    dctStats['parse_s'] = time.perf_counter() - fltStart
+    dctStats['docs'] = sum(len(lstRecords) for lstRecords in lstFiles)
+
+    pipeline_metrics.AddSpan('read_files', dctStats['read_s'])
+    pipeline_metrics.AddSpan('decode_json', dctStats['parse_s'])
+    pipeline_metrics.Count('bytes_parsed', dctStats['bytes'])
+
+    return lstFiles, dctStats
+
+def dctParseThroughput(plstStats: list, pfltWall: float = None) -> dict:
+    """Summarize the decoding statistics of read batches.
+
+    Inputs:
+        - plstStats - list of statistics of the batches, see tplReadBatch
+        - pfltWall - wall time of the whole ingestion in seconds, None to
+        skip the overall throughput
+
+    Outputs:
+        - dctOut - backend, totals and MB and documents decoded per second of
+        decoding time, summed over all workers, and per second of wall time
+    """
+
+    dctOut = {
+        'backend': ', '.join(
+            sorted(set(dctStats['backend'] for dctStats in plstStats))
+        )
+    }
+
+    for strKey in ['files', 'failed', 'docs', 'bytes', 'read_s', 'parse_s']:
+        dctOut[strKey] = sum(dctStats[strKey] for dctStats in plstStats)
+
+    fltMB = dctOut['bytes'] / 1e6
+    fltParse = dctOut['parse_s'] or float('nan')
+
+    dctOut['parse_mb_s'] = fltMB / fltParse
+    dctOut['parse_docs_s'] = dctOut['docs'] / fltParse
+
+    if pfltWall is not None:
+        dctOut['wall_s'] = pfltWall
+        dctOut['wall_mb_s'] = fltMB / pfltWall
+        dctOut['wall_docs_s'] = dctOut['docs'] / pfltWall
+
+    return dctOut
+
+def strThroughputMessage(pdctThroughput: dict) -> str:
+    """Format the decoding throughput for the progress output.
 
-def dtfProcessJSON(pstrPath: str):
-    """Import and process a JSON file from the path to a required form.
-    
     Inputs:
-        - pstrPath - full path to a JSON file
+        - pdctThroughput - output of dctParseThroughput
 
     Outputs:
-        - dtfProcessing - pandas data frame containing the processed JSON file,
-        the start and end tokens indexes adjusted for stripping the punctuation
+        - strOut - single line message
     """
-    assert os.path.isfile(pstrPath), 'Input must be a path to a file.'
 
-    # initialize an empty data frame
-    dtfProcessing = pd.DataFrame()
+    strOut = (
+        f'Decoded {pdctThroughput["docs"]} documents, '
+        f'{pdctThroughput["bytes"] / 1e6:.1f} MB with '
+        f'{pdctThroughput["backend"]}: '
+        f'{pdctThroughput["parse_mb_s"]:.1f} MB/s, '
+        f'{pdctThroughput["parse_docs_s"]:.0f} docs/s of decoding time'
+    )
+
+    if 'wall_s' in pdctThroughput:
+        strOut += (
+            f', {pdctThroughput["wall_mb_s"]:.1f} MB/s, '
+            f'{pdctThroughput["wall_docs_s"]:.0f} docs/s overall'
+        )
+
+    return strOut
+
+def lstProcessRecords(plstRecords: list) -> list:
+    """Process a list of annotated documents already loaded in memory.
+
+    Inputs:
+        - plstRecords - list of dictionaries with 'text' and 'annotations'
+
+    Outputs:
+        - lstProcessing - list of the documents, the start and end tokens
+        indexes adjusted for stripping the punctuation
+    """
+    assert type(plstRecords) == list, 'Input must be a list of dictionaries'
+
+    pipeline_metrics.Count('docs_parsed', len(plstRecords))
+
+    # clean the documents unless they were generated without punctuation
+    lstProcessing = plstRecords
+
+    if not blnGeneratedClean:
+        with pipeline_metrics.objSpan('clean_text'):
+            lstProcessing = lstCleanTexts(plstRecords)
+
+    return lstProcessing
+
+def dctProcessFiles(
+    plstPaths: list,
+    pblnGeneratedClean: bool,
+    pstrBackend: str = json_shards.strJSONBackend
+) -> dict:
+    """Import a batch of JSON files and shards to compact columns.
+
+    Inputs:
+        - plstPaths - list of full paths of JSON files and shards
+        - pblnGeneratedClean - flag whether the inputs were generated without
+        punctuation
+        - pstrBackend - JSON decoder, see json_shards.tplJSONBackend
+
+    Outputs:
+        - dctOut - columns of the documents, see AnnotationAccumulator.
+        dctColumns, with the statistics of the batch under 'stats', see
+        tplReadBatch, and the paths of the batch under 'paths'
+    """
+
+    global blnGeneratedClean
+
+    # the flag of the parent process, workers may not share its globals
+    blnGeneratedClean = pblnGeneratedClean
+
+    lstFiles, dctStats = tplReadBatch(plstPaths, pstrBackend)
+
+    objAccumulator = AnnotationAccumulator()
+    blnCleaned = False
 
     try:
-        # process only JSON files
-        if pstrPath.endswith('.json'):
-            # open the file and ingest the data
-            with open(pstrPath) as objFile:
-                dctData = json.load(objFile)
+        # clean and collect the whole batch at once, lstCleanTexts checks
+        # all documents before it changes any of them
+        lstRecords = lstProcessRecords(
+            [dctData for lstRecords in lstFiles for dctData in lstRecords]
+        )
+        blnCleaned = True
 
-            # remove punctuation and recalculate the label positions
-            dctClean = dctCleanText(dctData)
-            
-            # consolidate the ingested data
-            dtfProcessing = dtfJSONtoDataFrame(dctClean)
+        with pipeline_metrics.objSpan('build_columns'):
+            objAccumulator.AddRecords(lstRecords)
 
-    except Exception as e:
-        print(f'Error in JSON processing: {e}')
+    except Exception:
+        # process the files one by one to skip only the failing ones
+        objAccumulator = AnnotationAccumulator()
 
-    return dtfProcessing
+        for lstRecords in lstFiles:
+            try:
+                if not blnCleaned and not blnGeneratedClean:
+                    with pipeline_metrics.objSpan('clean_text'):
+                        lstRecords = lstCleanTexts(lstRecords)
 
-def dtfMergeDataFrames(plstDataFrames: list) -> pd.DataFrame:
-    """Join all data frames contained in a list to a single data frame.
+                objFile = AnnotationAccumulator()
+                objFile.AddRecords(lstRecords)
+                objAccumulator.AddColumns(objFile.dctColumns())
+
+            except Exception as e:
+                dctStats['failed'] += 1
+                dctStats['docs'] -= len(lstRecords)
+                pipeline_metrics.Count('files_failed')
+                print(f'Error in JSON processing: {e}')
+
+    dctOut = objAccumulator.dctColumns()
+    dctOut['stats'] = dctStats
+    dctOut['paths'] = plstPaths
+
+    return dctOut
+
+def lstFileBatches(plstPaths: list, pintBatchSize: int) -> list:
+    """Split the input files to batches, every shard is a batch of its own.
 
     Inputs:
-        - plstDataFrames - list of pandas data frames with the same column
-        structure
+        - plstPaths - list of full paths of JSON files and shards
+        - pintBatchSize - maximum number of JSON files in a batch
 
     Outputs:
-        - dtfOut - pandas data frame of concatenated data frames
+        - lstBatches - list of lists of paths
     """
-    assert type(plstDataFrames) == list, 'Input must be a list of data frames'
 
-    # concatenate all data frames from the input list to a single data frame
-    dtfOut = pd.concat(plstDataFrames, ignore_index=True)
+    lstFiles = [strPath for strPath in plstPaths if strPath.endswith('.json')]
 
-    return dtfOut
+    lstBatches = [
+        [strPath] for strPath in plstPaths if json_shards.blnIsShard(strPath)
+    ]
+    lstBatches += [
+        lstFiles[intStart:intStart + pintBatchSize]
+        for intStart in range(0, len(lstFiles), pintBatchSize)
+    ]
+
+    return lstBatches
+
+def lstInputFiles(pstrPath: str) -> list:
+    """List the JSON files and shards of the input folder.
 
-def dtfThreading(pstrPath: str) -> pd.DataFrame:
-    """Import JSON files in multithreaded process.
-    
     Inputs:
-        - pstrPath - path to the JSON files folder
+        - pstrPath - path to the JSON files and shards folder
 
     Outputs:
-        - dtfOut - pandas data frame containing all imported JSON files
-        concatenated under each other
+        - lstJSONFiles - list of full paths of the JSON files and shards
     """
-    # get all json files from the given directory
+
+    # get all json files and shards from the given directory
     lstJSONFiles = [
         os.path.join(
             pstrPath,
             strFile
-        ) for strFile in os.listdir(pstrPath) if strFile.endswith('.json')
+        ) for strFile in os.listdir(pstrPath) if strFile.endswith('.json') or
+        json_shards.blnIsShard(strFile)
     ]
+
+    return lstJSONFiles
+
+def objIngestFiles(
+    plstPaths: list,
+    pstrMode: str = strIngestMode,
+    pintWorkers: int = intIngestWorkers,
+    pintBatchSize: int = intIngestBatchSize,
+    pintMaxInFlight: int = intIngestMaxInFlight,
+    pstrBackend: str = json_shards.strJSONBackend,
+    pobjAccumulator = None
+) -> AnnotationAccumulator:
+    """Import JSON files and shards in batches in threads or processes.
+
+    Every batch is read, decoded and converted to columns by a single task,
+    at most pintMaxInFlight batches are submitted or finished but not
+    collected at the same time.
     
-    # initialize the list of outputs
-    lstOutputs = []
+    Inputs:
+        - plstPaths - list of full paths of JSON files and shards
+        - pstrMode - 'threads' to process the batches in threads of this
+        process, 'processes' to process them in worker processes
+        - pintWorkers - number of threads or worker processes, None for the
+        default of the executor
+        - pintBatchSize - maximum number of JSON files in a batch
+        - pintMaxInFlight - maximum number of submitted unfinished batches,
+        None for twice the number of cores
+        - pstrBackend - JSON decoder, see json_shards.tplJSONBackend
+        - pobjAccumulator - AnnotationAccumulator or ParquetStreamWriter
+        receiving the columns of every batch, None for a new accumulator
+
+    Outputs:
+        - objAccumulator - the receiver of the columns of all documents
+    """
+
+    assert pstrMode in ['threads', 'processes'], 'Unknown ingestion mode'
+    assert pintBatchSize > 0, 'The batch size must be positive'
+
+    intInFlight = pintMaxInFlight or 2 * (pintWorkers or os.cpu_count() or 1)
+
+    # metrics of worker processes are collected with the results, threads
+    # update the metrics of this process directly
+    blnCollect = pstrMode == 'processes' and pipeline_metrics.blnEnabled
+
+    if pstrMode == 'processes':
+        objExecutor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=pintWorkers
+        )
+    else:
+        objExecutor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=pintWorkers
+        )
+
+    # initialize the accumulator of the outputs
+    objAccumulator = pobjAccumulator
+
+    if objAccumulator is None:
+        objAccumulator = AnnotationAccumulator()
+
+    lstStats = []
+    fltStart = time.perf_counter()
 
     # initialize file counter
     intCount = 0
 
-    with concurrent.futures.ThreadPoolExecutor() as objExecutor:
-        lstFutures = [
-            objExecutor.submit(
-                dtfProcessJSON,
-                strPath
-            ) for strPath in lstJSONFiles
-        ]
+    def Collect(pobjFuture) -> None:
+        nonlocal intCount
 
-    for objFuture in concurrent.futures.as_completed(lstFutures):
-        try:
-            # get result of data reading
-            dtfResult = objFuture.result()
+        # raise the error of the batch or get its columns and metrics
+        dctColumns = pobjFuture.result()
 
-            # append the result to the final list
-            lstOutputs.append(dtfResult)
+        if blnCollect:
+            dctColumns = pipeline_metrics.objCollect(dctColumns)
 
-        except Exception as e:
-            # print error message
-            print(f'Error processing file: {e}')
+        with pipeline_metrics.objSpan('merge_columns'):
+            objAccumulator.AddColumns(dctColumns)
+
+        lstStats.append(dctColumns['stats'])
+        intCount += dctColumns['stats']['files']
+
+        # get time
+        strTime = str(datetime.datetime.now())
+
+        # print message
+        print(f'\t{strTime}: Files processed: {intCount}')
+
+    with objExecutor:
+        setRunning = set()
+
+        for lstBatch in lstFileBatches(plstPaths, pintBatchSize):
+            # wait for a free slot before submitting another batch
+            if len(setRunning) >= intInFlight:
+                setDone, setRunning = concurrent.futures.wait(
+                    setRunning,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for objFuture in setDone:
+                    Collect(objFuture)
+
+            tplArguments = (lstBatch, blnGeneratedClean, pstrBackend)
+
+            if blnCollect:
+                setRunning.add(
+                    objExecutor.submit(
+                        pipeline_metrics.tplRunTask,
+                        dctProcessFiles,
+                        tplArguments
+                    )
+                )
+            else:
+                setRunning.add(
+                    objExecutor.submit(dctProcessFiles, *tplArguments)
+                )
+
+        for objFuture in concurrent.futures.as_completed(setRunning):
+            Collect(objFuture)
+
+    # report the decoding throughput of the run
+    print(
+        strThroughputMessage(
+            dctParseThroughput(lstStats, time.perf_counter() - fltStart)
+        )
+    )
+
+    return objAccumulator
+
+def objThreading(
+    pstrPath: str,
+    pstrMode: str = strIngestMode,
+    pintWorkers: int = intIngestWorkers,
+    pintBatchSize: int = intIngestBatchSize,
+    pintMaxInFlight: int = intIngestMaxInFlight,
+    pstrBackend: str = json_shards.strJSONBackend,
+    pobjAccumulator = None
+) -> AnnotationAccumulator:
+    """Import all JSON files and shards of a folder, see objIngestFiles.
+
+    Inputs:
+        - pstrPath - path to the JSON files and shards folder
+        - pstrMode - 'threads' or 'processes', see objIngestFiles
+        - pintWorkers - number of threads or worker processes, None for the
+        default of the executor
+        - pintBatchSize - maximum number of JSON files in a batch
+        - pintMaxInFlight - maximum number of submitted unfinished batches,
+        None for twice the number of cores
+        - pstrBackend - JSON decoder, see json_shards.tplJSONBackend
+        - pobjAccumulator - receiver of the columns, see objIngestFiles
+
+    Outputs:
+        - objAccumulator - the receiver of the columns of all documents
+    """
+
+    objAccumulator = objIngestFiles(
+        lstInputFiles(pstrPath),
+        pstrMode,
+        pintWorkers,
+        pintBatchSize,
+        pintMaxInFlight,
+        pstrBackend,
+        pobjAccumulator
+    )
 
-        # increment the counter
-        intCount += 1
+    return objAccumulator
 
-        if intCount % 1000 == 0:
-             # get time
-            strTime = str(datetime.datetime.now())
+def dtfThreading(
+    pstrPath: str,
+    pstrMode: str = strIngestMode,
+    pintWorkers: int = intIngestWorkers,
+    pintBatchSize: int = intIngestBatchSize,
+    pintMaxInFlight: int = intIngestMaxInFlight,
+    pstrBackend: str = json_shards.strJSONBackend
+) -> pd.DataFrame:
+    """Import JSON files and shards to a single data frame.
 
-            # print message
-            print(f'\t{strTime}: Files processed: {intCount}')
+    Inputs:
+        - pstrPath - path to the JSON files and shards folder
+        - pstrMode - 'threads' or 'processes', see objIngestFiles
+        - pintWorkers - number of threads or worker processes, None for the
+        default of the executor
+        - pintBatchSize - maximum number of JSON files in a batch
+        - pintMaxInFlight - maximum number of submitted unfinished batches,
+        None for twice the number of cores
+        - pstrBackend - JSON decoder, see json_shards.tplJSONBackend
+
+    Outputs:
+        - dtfOut - pandas data frame with a row per annotation of all
+        imported documents, see AnnotationAccumulator.dtfBuild
+    """
+
+    objAccumulator = objThreading(
+        pstrPath,
+        pstrMode,
+        pintWorkers,
+        pintBatchSize,
+        pintMaxInFlight,
+        pstrBackend
+    )
+
+    with pipeline_metrics.objSpan('merge_frames'):
+        dtfOut = objAccumulator.dtfBuild()
+
+    return dtfOut
+
+def dtfParseBenchmark(
+    pstrPath: str,
+    plstBackends: list = lstParseBackends,
+    plstBatchSizes: list = lstParseBatchSizes
+) -> pd.DataFrame:
+    """Compare the decoding throughput of backends and batch sizes.
+
+    Inputs:
+        - pstrPath - path to the JSON files and shards folder
+        - plstBackends - JSON decoders to compare, the ones not installed are
+        skipped
+        - plstBatchSizes - numbers of JSON files in a batch to compare
 
-    # merge all data frames together
-    dtfOut = dtfMergeDataFrames(lstOutputs)
+    Outputs:
+        - dtfOut - data frame with the throughput of every combination, see
+        dctParseThroughput
+    """
+
+    lstJSONFiles = lstInputFiles(pstrPath)
+    lstRows = []
+
+    for strBackend in plstBackends:
+        if strBackend == 'orjson' and json_shards.orjson is None:
+            continue
+
+        for intBatchSize in plstBatchSizes:
+            fltStart = time.perf_counter()
+
+            lstStats = [
+                tplReadBatch(lstBatch, strBackend)[1]
+                for lstBatch in lstFileBatches(lstJSONFiles, intBatchSize)
+            ]
+
+            dctRow = dctParseThroughput(
+                lstStats,
+                time.perf_counter() - fltStart
+            )
+            dctRow['batch_size'] = intBatchSize
+            lstRows.append(dctRow)
+
+    dtfOut = pd.DataFrame(lstRows)
 
     return dtfOut
 
+def tplSplitTextAnnotations(pdtfImport: pd.DataFrame) -> tuple:
+    """Split the imported data to a text and an annotations data frame.
+
+    Inputs:
+        - pdtfImport - pandas data frame with text, label, start and end
+        columns, it is modified in place
+
+    Outputs:
+        - tplOut - tuple of a data frame with unique texts and their hash
+        columns and a data frame with the annotations and the hash columns of
+        their text, see lstHashColumns
+    """
+
+    # calculate hash of each text field
+    pdtfImport[lstHashColumns] = arrHashColumns(
+        b''.join(bytTextHash(strText) for strText in pdtfImport['text'])
+    )
+
+    # store the original text in a separate data frame
+    dtfText = pdtfImport[['text'] + lstHashColumns].drop_duplicates(
+        lstHashColumns
+    )
+
+    # drop the text field from the original data frame
+    pdtfImport.drop('text', axis=1, inplace=True)
+
+    # rename the data file for the continuity with other scripts
+    dtfAnnotations = pdtfImport
+
+    return dtfText, dtfAnnotations
+
+def tplIngestStream(pitrBatches) -> tuple:
+    """Ingest batches of annotated documents generated in memory.
+
+    Inputs:
+        - pitrBatches - iterable of lists of dictionaries with 'text' and
+        'annotations', for example multithread_data_preparation.
+        itrGenerateBatches
+
+    Outputs:
+        - tplOut - tuple of the text and annotations data frames, see
+        tplSplitTextAnnotations
+    """
+
+    # initialize the accumulator of the outputs
+    objAccumulator = AnnotationAccumulator()
+
+    # initialize document counter
+    intCount = 0
+
+    for lstBatch in pitrBatches:
+        with pipeline_metrics.objSpan('process_batches'):
+            objAccumulator.AddRecords(lstProcessRecords(lstBatch))
+        intCount += len(lstBatch)
+
+        # get time
+        strTime = str(datetime.datetime.now())
+
+        # print message
+        print(f'\t{strTime}: Documents processed: {intCount}')
+
+    # build the text and annotations data frames
+    with pipeline_metrics.objSpan('merge_frames'):
+        tplOut = objAccumulator.tplBuildFrames()
+
+    return tplOut
+
+def dctInputState(pstrPath: str, pstrChange: str = strIngestChange) -> dict:
+    """Describe an input file for the detection of later changes.
+
+    Inputs:
+        - pstrPath - full path of a JSON file or shard
+        - pstrChange - 'mtime' or 'hash', see strIngestChange
+
+    Outputs:
+        - dctOut - size and modification time in nanoseconds of the file and
+        its checksum in the hash mode
+    """
+
+    assert pstrChange in ['mtime', 'hash'], 'Unknown change detection'
+
+    objStat = os.stat(pstrPath)
+
+    dctOut = {
+        'size': objStat.st_size,
+        'mtime_ns': objStat.st_mtime_ns
+    }
+
+    if pstrChange == 'hash':
+        dctOut['sha256'] = json_shards.strFileChecksum(pstrPath)
+
+    return dctOut
+
+def blnInputUnchanged(
+    pdctRecorded: dict,
+    pstrPath: str,
+    pstrChange: str = strIngestChange
+) -> bool:
+    """Check whether an input file is the same as when it was ingested.
+
+    Inputs:
+        - pdctRecorded - state of the file when it was ingested, see
+        dctInputState
+        - pstrPath - full path of the file
+        - pstrChange - 'mtime' or 'hash', see strIngestChange
+
+    Outputs:
+        - blnOut - True if the size and the modification time match, in the
+        hash mode a file with a new modification time is unchanged if its
+        checksum matches
+    """
+
+    objStat = os.stat(pstrPath)
+
+    if objStat.st_size != pdctRecorded['size']:
+        return False
+
+    if objStat.st_mtime_ns == pdctRecorded['mtime_ns']:
+        return True
+
+    blnOut = pstrChange == 'hash' and 'sha256' in pdctRecorded and \
+        json_shards.strFileChecksum(pstrPath) == pdctRecorded['sha256']
+
+    return blnOut
+
+def dctValidParts(plstEntries: list) -> dict:
+    """Return the part files of the datasets in effect after all entries.
+
+    Inputs:
+        - plstEntries - entries of the ingestion manifest, every entry names
+        its part file, None for an entry only replacing parts, the states of
+        the inputs it contains under 'files' and the earlier parts it
+        replaces under 'replaces'
+
+    Outputs:
+        - dctOut - states of the inputs keyed by the file name keyed by the
+        name of every valid part
+    """
+
+    dctOut = dict()
+
+    for dctEntry in plstEntries:
+        for strPart in dctEntry.get('replaces', []):
+            dctOut.pop(strPart, None)
+
+        if dctEntry['part'] is not None:
+            dctOut[dctEntry['part']] = dctEntry['files']
+
+    return dctOut
+
+def dctIngestIncremental(
+    pstrPath: str = strPathJSON,
+    pstrBackup: str = strPathBackup,
+    pstrChange: str = strIngestChange,
+    pstrMode: str = strIngestMode,
+    pintWorkers: int = intIngestWorkers,
+    pintBatchSize: int = intIngestBatchSize
+) -> dict:
+    """Ingest only new or changed inputs and append them as parquet parts.
+
+    Every ingested batch of a run is saved as a new part of the text and
+    annotations datasets in the backup folder, see DatasetPartWriter, and
+    the manifest records the inputs of every part. A part containing an
+    input that changed or was removed is replaced, its remaining inputs are
+    ingested again with the new ones, so a change costs at most a batch of
+    inputs. Parts not recorded in the manifest, left by an interrupted run,
+    are removed.
+
+    Inputs:
+        - pstrPath - path to the JSON files and shards folder
+        - pstrBackup - folder of the datasets and of the manifest
+        - pstrChange - 'mtime' or 'hash', see strIngestChange
+        - pstrMode - 'threads' or 'processes', see objIngestFiles
+        - pintWorkers - number of threads or worker processes, None for the
+        default of the executor
+        - pintBatchSize - maximum number of JSON files in a batch and part
+
+    Outputs:
+        - dctOut - names of the written parts, the replaced parts and the
+        number of ingested files and documents
+    """
+
+    strManifest = os.path.join(pstrBackup, strIngestManifestName)
+    lstFolders = [
+        os.path.join(pstrBackup, strTextDataset),
+        os.path.join(pstrBackup, strAnnotationsDataset)
+    ]
+
+    dctParts = dctValidParts(json_shards.lstReadManifest(strManifest))
+
+    # remove the parts of interrupted runs
+    for strFolder in lstFolders:
+        os.makedirs(strFolder, exist_ok=True)
+
+        for strFile in os.listdir(strFolder):
+            if strFile not in dctParts:
+                os.remove(os.path.join(strFolder, strFile))
+
+    dctInputs = {
+        os.path.basename(strFile): strFile
+        for strFile in lstInputFiles(pstrPath)
+    }
+
+    # replace the parts with changed or removed inputs
+    lstReplaced = [
+        strPart for strPart, dctFiles in dctParts.items()
+        if any(
+            strName not in dctInputs or
+            not blnInputUnchanged(dctState, dctInputs[strName], pstrChange)
+            for strName, dctState in dctFiles.items()
+        )
+    ]
+
+    setIngested = {
+        strName
+        for strPart, dctFiles in dctParts.items()
+        if strPart not in lstReplaced
+        for strName in dctFiles
+    }
+
+    lstNames = sorted(set(dctInputs) - setIngested)
+
+    dctOut = {
+        'parts': [],
+        'replaced': lstReplaced,
+        'files': len(lstNames),
+        'docs': 0
+    }
+
+    if len(lstNames) == 0 and len(lstReplaced) == 0:
+        return dctOut
+
+    # record the inputs as they are before reading them
+    dctFiles = {
+        strName: dctInputState(dctInputs[strName], pstrChange)
+        for strName in lstNames
+    }
+
+    with DatasetPartWriter(pstrBackup, dctFiles, lstReplaced) as objWriter:
+        objIngestFiles(
+            [dctInputs[strName] for strName in lstNames],
+            pstrMode,
+            pintWorkers,
+            pintBatchSize,
+            pobjAccumulator=objWriter
+        )
+
+    dctOut['parts'] = objWriter.lstParts
+    dctOut['docs'] = len(objWriter)
+
+    return dctOut
+
+def tplReadBackup(pstrBackup: str = strPathBackup) -> tuple:
+    """Read the saved text and annotations data frames.
+
+    Inputs:
+        - pstrBackup - folder of the saved data
+
+    Outputs:
+        - tplOut - tuple of the text and annotations data frames, read from
+        the valid parts of the incremental datasets if the folder has an
+        ingestion manifest, otherwise from the single parquet files
+    """
+
+    strManifest = os.path.join(pstrBackup, strIngestManifestName)
+
+    if os.path.isfile(strManifest):
+        lstParts = sorted(
+            dctValidParts(json_shards.lstReadManifest(strManifest))
+        )
+
+        # no inputs were ingested yet or all parts were replaced
+        if len(lstParts) == 0:
+            return (
+                objTextSchema.empty_table().to_pandas(),
+                objAnnotationsSchema.empty_table().to_pandas()
+            )
+
+        dtfText, dtfAnnotations = [
+            pd.concat(
+                [
+                    pd.read_parquet(
+                        os.path.join(pstrBackup, strDataset, strPart)
+                    )
+                    for strPart in lstParts
+                ],
+                ignore_index=True
+            )
+            for strDataset in [strTextDataset, strAnnotationsDataset]
+        ]
+    else:
+        dtfText = pd.read_parquet(os.path.join(pstrBackup, 'text.parquet'))
+        dtfAnnotations = pd.read_parquet(
+            os.path.join(pstrBackup, 'annotations.parquet')
+        )
+
+    assert set(lstHashColumns) <= set(dtfText.columns) and \
+        dtfText[lstHashColumns].notna().all(axis=None), \
+        'The data were saved with an older hash, ingest the inputs again'
+
+    # the same text may be stored in several parts
+    dtfText = dtfText.drop_duplicates(lstHashColumns, ignore_index=True)
+
+    return dtfText, dtfAnnotations
+
 # %% run the import process
 if __name__ == '__main__':
-    print(datetime.datetime.now())
-    dtfImport = dtfThreading(strPathJSON)
+    pipeline_metrics.Enable(blnMetrics)
+
     print(datetime.datetime.now())
 
-# %%
-# calculate hash of each text field
-dtfImport['hash'] = dtfImport['text'].apply(hash)
+    if blnIncremental:
+        # append only the new inputs to the datasets
+        with pipeline_metrics.objSpan('ingestion'):
+            dctIngest = dctIngestIncremental()
 
-# store the original text in a separate data frame
-dtfText = dtfImport[['text', 'hash']].drop_duplicates()
+        print(datetime.datetime.now())
+        print(dctIngest)
 
-# drop the text field from the original data frame
-dtfImport.drop('text', axis=1, inplace=True)
+        intSaved = dctIngest['docs']
 
-# rename the data file for the continuity with other scripts
-dtfAnnotations = dtfImport
+    else:
+        # save the processed files in parquet format while they arrive
+        with ParquetStreamWriter(
+            os.path.join(strPathBackup, 'text.parquet'),
+            os.path.join(strPathBackup, 'annotations.parquet')
+        ) as objWriter:
+            with pipeline_metrics.objSpan('ingestion'):
+                objThreading(strPathJSON, pobjAccumulator=objWriter)
 
-# save the processed files in parquet format
-dtfAnnotations.to_parquet(
-    os.path.join(strPathBackup, 'annotations.parquet'),
-    compression='snappy'
-)
+        print(datetime.datetime.now())
+
+        intSaved = objWriter.intTexts
 
-dtfText.to_parquet(
-    os.path.join(strPathBackup, 'text.parquet'),
-    compression='snappy'
-)
\ No newline at end of file
+    pipeline_metrics.Count('docs_saved', intSaved)
+    pipeline_metrics.strWriteMetrics('ingestion')
@@ -0,0 +1,274 @@
+# %% imports
+import collections
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+
+# %% definitions
+
+# collect the metrics, all calls return immediately when disabled
+blnEnabled = False
+
+# paths
+strPathMetrics = 'c:/repositories/zzz_data_for_lstm/data/outputs/metrics/'
+
+# file name
+strMetricsPrefix = 'metrics_'
+
+# metrics of the current process, spans are stored as lists of the number of
+# calls, total seconds and the longest call in seconds
+dctCounters = collections.Counter()
+dctSpans = dict()
+
+# counters and spans are updated from several threads during the ingestion
+objLock = threading.Lock()
+
+# start of the run and time of the last checkpoint
+dteStarted = datetime.datetime.now()
+fltCheckpoint = time.perf_counter()
+
+# shared context manager returned for disabled spans
+objNullSpan = contextlib.nullcontext()
+
+# %% functions
+def Enable(pblnEnabled: bool = True) -> None:
+    """Switch the collection of metrics on or off and start a new run.
+
+    Inputs:
+        - pblnEnabled - flag whether to collect the metrics
+    """
+
+    global blnEnabled
+
+    blnEnabled = pblnEnabled
+    Reset()
+
+def Reset() -> None:
+    """Forget all collected metrics and restart the run clock."""
+
+    global dteStarted, fltCheckpoint
+
+    with objLock:
+        dctCounters.clear()
+        dctSpans.clear()
+
+    dteStarted = datetime.datetime.now()
+    fltCheckpoint = time.perf_counter()
+
+def Count(pstrName: str, pintValue: int = 1) -> None:
+    """Increase a named counter.
+
+    Inputs:
+        - pstrName - name of the counter, e.g. 'docs_generated'
+        - pintValue - increment of the counter
+    """
+
+    if not blnEnabled:
+        return
+
+    with objLock:
+        dctCounters[pstrName] += pintValue
+
+def AddSpan(pstrName: str, pfltSeconds: float, pintCalls: int = 1) -> None:
+    """Add measured time to a named span.
+
+    Inputs:
+        - pstrName - name of the span, e.g. 'generate_batch'
+        - pfltSeconds - measured wall time in seconds
+        - pintCalls - number of calls the time belongs to
+    """
+
+    if not blnEnabled:
+        return
+
+    with objLock:
+        lstSpan = dctSpans.setdefault(pstrName, [0, 0.0, 0.0])
+        lstSpan[0] += pintCalls
+        lstSpan[1] += pfltSeconds
+        lstSpan[2] = max(lstSpan[2], pfltSeconds)
+
+class Span:
+    """Context manager measuring the wall time of a block of code."""
+
+    def __init__(self, pstrName: str):
+        self.strName = pstrName
+        self.fltStart = None
+
+    def __enter__(self):
+        self.fltStart = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *ptplException):
+        AddSpan(self.strName, time.perf_counter() - self.fltStart)
+
+        return False
+
+def objSpan(pstrName: str):
+    """Return a context manager timing a block of code under a span name.
+
+    Inputs:
+        - pstrName - name of the span
+
+    Outputs:
+        - objOut - a Span when the metrics are enabled, otherwise a shared
+        context manager doing nothing
+    """
+
+    if not blnEnabled:
+        return objNullSpan
+
+    return Span(pstrName)
+
+def Checkpoint(pstrName: str) -> None:
+    """Record the time since the previous checkpoint as a span.
+
+    Meant for scripts that run their stages one after another, the first
+    checkpoint measures the time since the metrics were enabled.
+
+    Inputs:
+        - pstrName - name of the finished stage
+    """
+
+    global fltCheckpoint
+
+    if not blnEnabled:
+        return
+
+    fltNow = time.perf_counter()
+    AddSpan(pstrName, fltNow - fltCheckpoint)
+    fltCheckpoint = fltNow
+
+def dctSnapshot() -> dict:
+    """Return a copy of the metrics collected in the current process.
+
+    Outputs:
+        - dctOut - dictionary with 'counters' and 'spans', see Merge
+    """
+
+    with objLock:
+        dctOut = {
+            'counters': dict(dctCounters),
+            'spans': {
+                strName: list(lstSpan) for strName, lstSpan in dctSpans.items()
+            }
+        }
+
+    return dctOut
+
+def Merge(pdctSnapshot: dict) -> None:
+    """Add metrics collected in another process to the current process.
+
+    Inputs:
+        - pdctSnapshot - output of dctSnapshot
+    """
+
+    if not blnEnabled:
+        return
+
+    with objLock:
+        dctCounters.update(pdctSnapshot['counters'])
+
+        for strName, lstOther in pdctSnapshot['spans'].items():
+            lstSpan = dctSpans.setdefault(strName, [0, 0.0, 0.0])
+            lstSpan[0] += lstOther[0]
+            lstSpan[1] += lstOther[1]
+            lstSpan[2] = max(lstSpan[2], lstOther[2])
+
+def tplRunTask(pfnTask, ptplArguments: tuple) -> tuple:
+    """Run a task in a worker process and collect its metrics.
+
+    Inputs:
+        - pfnTask - function to run
+        - ptplArguments - arguments of the function
+
+    Outputs:
+        - tplOut - tuple of the return value of the task and the metrics
+        collected while it ran, see objCollect
+    """
+
+    Enable()
+    objResult = pfnTask(*ptplArguments)
+
+    return objResult, dctSnapshot()
+
+def objCollect(ptplResult: tuple):
+    """Merge the metrics of a task run by tplRunTask and return its result.
+
+    Inputs:
+        - ptplResult - output of tplRunTask
+
+    Outputs:
+        - objResult - return value of the task
+    """
+
+    objResult, dctMetrics = ptplResult
+    Merge(dctMetrics)
+
+    return objResult
+
+def dctReport(pstrRun: str) -> dict:
+    """Summarize the collected metrics of a run.
+
+    Inputs:
+        - pstrRun - name of the run, e.g. 'generation'
+
+    Outputs:
+        - dctOut - dictionary with the run name, start, end and wall time, all
+        counters and for every span the number of calls, total, mean and
+        longest time in seconds, spans of worker processes are summed
+    """
+
+    dteFinished = datetime.datetime.now()
+    dctMetrics = dctSnapshot()
+
+    dctOut = {
+        'run': pstrRun,
+        'pid': os.getpid(),
+        'started': dteStarted.isoformat(),
+        'finished': dteFinished.isoformat(),
+        'wall_s': (dteFinished - dteStarted).total_seconds(),
+        'counters': dctMetrics['counters'],
+        'spans': {
+            strName: {
+                'calls': intCalls,
+                'total_s': fltTotal,
+                'mean_s': fltTotal / intCalls if intCalls else 0.0,
+                'max_s': fltMax
+            } for strName, (intCalls, fltTotal, fltMax) in sorted(
+                dctMetrics['spans'].items()
+            )
+        }
+    }
+
+    return dctOut
+
+def strWriteMetrics(pstrRun: str, pstrPath: str = strPathMetrics) -> str:
+    """Save the metrics of a run to a JSON file named by the run and its start.
+
+    Inputs:
+        - pstrRun - name of the run
+        - pstrPath - folder for the metrics files
+
+    Outputs:
+        - strOutPath - full path of the saved file, None when disabled
+    """
+
+    if not blnEnabled:
+        return None
+
+    os.makedirs(pstrPath, exist_ok=True)
+
+    strOutPath = os.path.join(
+        pstrPath,
+        strMetricsPrefix + pstrRun + '_' +
+        dteStarted.strftime('%Y%m%d_%H%M%S') + '.json'
+    )
+
+    with open(strOutPath, 'w') as objOut:
+        json.dump(dctReport(pstrRun), objOut, indent=4)
+
+    return strOutPath
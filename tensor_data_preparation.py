@@ -0,0 +1,248 @@
+# %% imports
+import numpy as np
+import pandas as pd
+import datetime
+import logging
+import os
+import string
+import multithread_data_preparation as mdp
+
+# %% set up logging
+logging.basicConfig(
+    level = logging.INFO,
+    format=' %(asctime)s -  %(levelname)s -  %(message)s'
+)
+
+# %% paths and definitions
+
+# number of documents to generate
+intDocuments = 30000
+
+# length of the sequences, longer documents are truncated
+intMaxLength = 4096
+
+# number of documents generated in one task
+intChunkSize = 500
+
+# generate the texts without punctuation as the ingestion would
+blnCleanText = True
+
+# paths
+strPathOutputs = 'c:/repositories/zzz_data_for_lstm/data/outputs/backup/'
+
+# file names, unlike data_preprocessing_text with a row per annotation the
+# arrays have a row per document, y holds the labels of all its annotations
+strNameX = 'X.npy'
+strNameY = 'y.npy'
+strNameLengths = 'lengths.npy'
+strNameLabels = 'label_encodings.csv'
+
+# fixed character vocabulary, 0 is reserved for padding and 1 for unknown
+# characters, upper case letters share the ids of the lower case letters
+intPadding = 0
+intUnknown = 1
+strCharacters = string.ascii_lowercase + string.digits + \
+    string.punctuation + ' \n\t'
+
+# ids of the characters indexed by their code point, code points above 255
+# are mapped to the unknown id
+arrCharIds = np.full(256, intUnknown, dtype=np.uint8)
+
+for intId, strChar in enumerate(strCharacters, start=2):
+    arrCharIds[ord(strChar)] = intId
+    arrCharIds[ord(strChar.upper())] = intId
+
+# fixed label schema, labels are encoded in alphabetical order starting from
+# 1 as in data_preprocessing_text, 0 marks characters outside of any entity
+lstLabels = sorted(
+    set(
+        strLabel for strToken, strLabel in mdp.dctLabels.items()
+        if strToken not in [mdp.strTokItemsStart, mdp.strTokItemsEnd]
+    ) | {'item_list'}
+)
+dctLabelIds = {
+    strLabel: intId for intId, strLabel in enumerate(lstLabels, start=1)
+}
+
+# %% functions
+def tplEncodeDocument(pdctJSON: dict, pintMaxLength: int) -> tuple:
+    """Convert an annotated document to character and label id sequences.
+
+    Inputs:
+        - pdctJSON - dictionary with 'text' and 'annotations' of a document
+        - pintMaxLength - length of the output sequences
+
+    Outputs:
+        - tplOut - tuple of the character ids, the label id of every
+        character and the length of the document before truncation, the
+        item list label is overwritten by the labels of the item fields
+    """
+
+    strText = pdctJSON['text']
+
+    # look up the ids of all characters at once
+    arrCodes = np.frombuffer(strText.encode('utf-32-le'), dtype=np.uint32)
+    arrX = arrCharIds[np.minimum(arrCodes[:pintMaxLength], 255)]
+
+    # mark the annotated characters, the item list first, the end position
+    # is included as in data_preprocessing_text
+    arrY = np.zeros(len(arrX), dtype=np.uint8)
+
+    for dctAnnotation in sorted(
+        pdctJSON['annotations'],
+        key=lambda dctItem: dctItem['label'] != 'item_list'
+    ):
+        arrY[dctAnnotation['start']:dctAnnotation['end'] + 1] = dctLabelIds[
+            dctAnnotation['label']
+        ]
+
+    return arrX, arrY, len(strText)
+
+def intGenerateTensorChunk(
+    pstrPath: str,
+    pintStart: int,
+    pintCount: int,
+    pintShard: int,
+    pintSeed: int = mdp.intSeed,
+    pblnClean: bool = blnCleanText,
+    pblnDeduplicate: bool = mdp.blnDeduplicate
+) -> int:
+    """Generate a chunk of documents directly to the memory-mapped arrays.
+
+    Inputs:
+        - pstrPath - folder with the preallocated arrays
+        - pintStart - index of the first document of the chunk
+        - pintCount - number of documents in the chunk
+        - pintShard - sequential number of the chunk
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+        - pblnDeduplicate - flag whether to replace duplicates in the chunk
+
+    Outputs:
+        - intTruncated - number of documents longer than the sequences
+    """
+
+    # open the preallocated arrays for writing
+    arrX = np.load(os.path.join(pstrPath, strNameX), mmap_mode='r+')
+    arrY = np.load(os.path.join(pstrPath, strNameY), mmap_mode='r+')
+    arrLengths = np.load(
+        os.path.join(pstrPath, strNameLengths),
+        mmap_mode='r+'
+    )
+
+    # generate the documents of the chunk
+    lstJSON = mdp.lstGenerateBatch(
+        pintCount,
+        mdp.objShardGenerator(pintSeed, pintShard),
+        pblnClean,
+        mdp.objShardFilter(pintCount, pblnDeduplicate)
+    )
+
+    intTruncated = 0
+
+    for intIndex, dctJSON in enumerate(lstJSON, start=pintStart):
+        arrDocX, arrDocY, intLength = tplEncodeDocument(
+            dctJSON,
+            arrX.shape[1]
+        )
+
+        # write the sequences to the row of the document
+        arrX[intIndex, :len(arrDocX)] = arrDocX
+        arrY[intIndex, :len(arrDocY)] = arrDocY
+        arrLengths[intIndex] = intLength
+
+        intTruncated += intLength > arrX.shape[1]
+
+    arrX.flush()
+    arrY.flush()
+    arrLengths.flush()
+
+    return intTruncated
+
+def GenerateTensors(
+    pintDocuments: int,
+    pstrPath: str = strPathOutputs,
+    pintMaxLength: int = intMaxLength,
+    pintChunkSize: int = intChunkSize,
+    pintWorkers: int = mdp.intWorkers,
+    pintSeed: int = mdp.intSeed,
+    pblnClean: bool = blnCleanText,
+    pblnDeduplicate: bool = mdp.blnDeduplicate
+) -> None:
+    """Generate documents straight to the X and y arrays for training.
+
+    X contains the character ids and y the label ids of every character of
+    every document, both padded with zeros to pintMaxLength. The arrays are
+    preallocated as .npy files and every worker writes its rows in place.
+
+    Inputs:
+        - pintDocuments - number of documents to generate
+        - pstrPath - output folder of the arrays
+        - pintMaxLength - length of the sequences
+        - pintChunkSize - number of documents in one task
+        - pintWorkers - number of worker processes, None for all cores
+        - pintSeed - root seed of the generation run
+        - pblnClean - flag whether to generate texts without punctuation
+        - pblnDeduplicate - flag whether to replace duplicates in every chunk
+    """
+
+    assert pintDocuments > 0, 'The number of documents must be positive'
+    assert pintChunkSize > 0, 'The chunk size must be positive'
+    assert len(strCharacters) + 2 <= 256, 'Character ids must fit in uint8'
+
+    # preallocate the output arrays
+    np.lib.format.open_memmap(
+        os.path.join(pstrPath, strNameX),
+        mode='w+',
+        dtype=np.uint8,
+        shape=(pintDocuments, pintMaxLength)
+    ).flush()
+    np.lib.format.open_memmap(
+        os.path.join(pstrPath, strNameY),
+        mode='w+',
+        dtype=np.uint8,
+        shape=(pintDocuments, pintMaxLength)
+    ).flush()
+    np.lib.format.open_memmap(
+        os.path.join(pstrPath, strNameLengths),
+        mode='w+',
+        dtype=np.int32,
+        shape=(pintDocuments,)
+    ).flush()
+
+    # generate the chunks in parallel
+    lstTasks = [
+        (
+            intGenerateTensorChunk,
+            (
+                pstrPath,
+                intStart,
+                min(pintChunkSize, pintDocuments - intStart),
+                intShard,
+                pintSeed,
+                pblnClean,
+                pblnDeduplicate
+            )
+        ) for intShard, intStart in enumerate(
+            range(0, pintDocuments, pintChunkSize)
+        )
+    ]
+    intTruncated = sum(mdp.lstRunTasks(lstTasks, pintWorkers))
+
+    if intTruncated > 0:
+        logging.warning(
+            f'Documents truncated to {pintMaxLength}: {intTruncated}'
+        )
+
+    # save the label encodings
+    dtfLabels = pd.DataFrame({
+        'label': list(dctLabelIds.keys()),
+        'label_encoded': list(dctLabelIds.values())
+    })
+    dtfLabels.to_csv(os.path.join(pstrPath, strNameLabels), index=False)
+
+# %% generate tensors
+if __name__ == '__main__':
+    print(datetime.datetime.now())
+    GenerateTensors(intDocuments)
+    print(datetime.datetime.now())
@@ -0,0 +1,232 @@
+# %% imports
+import copy
+import functools
+import os
+import random
+import string
+import sys
+
+import numpy as np
+import pytest
+
+# the modules are flat scripts in the repository root
+strPathRepository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, strPathRepository)
+
+import multithread_data_preparation as mdp
+import multithread_training_preprocessing as mtp
+import token_scanner
+
+# %% definitions
+
+# number of random documents and invoices compared by every test
+intCases = 300
+
+# characters of the random documents, with punctuation and non-ASCII text
+strAlphabet = string.ascii_letters + string.digits + string.punctuation + \
+    ' \n\téж€😀'
+
+# %% reference implementations
+def dctCleanTextReference(pdctData: dict) -> dict:
+    """Clean a document character by character as before lstCleanTexts.
+
+    Inputs:
+        - pdctData - dictionary with 'text' and 'annotations'
+
+    Outputs:
+        - pdctData - the document without punctuation, every offset reduced by
+        the number of punctuation characters up to and including it
+    """
+
+    intSum = 0
+    dctCumSum = dict()
+    strCleanText = ''
+
+    for intIndex, strChar in enumerate(pdctData['text']):
+        if strChar in string.punctuation:
+            intSum += 1
+        else:
+            strCleanText = ''.join([strCleanText, strChar])
+
+        dctCumSum[intIndex] = intSum
+
+    pdctData['text'] = strCleanText
+
+    for dctAnnotation in pdctData['annotations']:
+        dctAnnotation['start'] = dctAnnotation['start'] - dctCumSum[
+            dctAnnotation['start']
+        ]
+        dctAnnotation['end'] = dctAnnotation['end'] - dctCumSum[
+            dctAnnotation['end']
+        ]
+
+    return pdctData
+
+# %% fixtures
+@pytest.fixture(scope='module')
+def objGenerator():
+    """Load the vocabularies and templates of the repository once."""
+
+    mdp.InitializeWorker(
+        os.path.join(strPathRepository, 'data', 'inputs', ''),
+        os.path.join(strPathRepository, 'templates', '')
+    )
+
+    return mdp
+
+def lstRandomDocuments(pintCount: int, pintSeed: int) -> list:
+    """Return random annotated documents with offsets inside their text."""
+
+    objRandom = random.Random(pintSeed)
+    lstOut = [{'text': '', 'annotations': []}]
+
+    for _ in range(pintCount):
+        intLength = objRandom.randint(1, 200)
+        strText = ''.join(
+            objRandom.choice(strAlphabet) for _ in range(intLength)
+        )
+        lstAnnotations = []
+
+        for _ in range(objRandom.randint(0, 8)):
+            intStart = objRandom.randrange(intLength)
+            lstAnnotations.append({
+                'label': 'x',
+                'start': intStart,
+                'end': objRandom.randrange(intStart, intLength)
+            })
+
+        lstOut.append({'text': strText, 'annotations': lstAnnotations})
+
+    return lstOut
+
+def tplRenderPair(pdctTemplate: dict, pintRepeat: int, pintSeed: int) -> tuple:
+    """Render a template with and without punctuation from the same values."""
+
+    lstOut = []
+
+    for fnRender in [mdp.dctRenderTemplate, mdp.dctRenderCleanTemplate]:
+        objRNG = np.random.default_rng(pintSeed)
+        dctValues = mdp.lstRandomNumericBatch(
+            [pdctTemplate],
+            np.array([pintRepeat]),
+            objRNG
+        )[0]
+
+        lstOut.append(
+            fnRender(
+                pdctTemplate,
+                pintRepeat,
+                functools.partial(
+                    mdp.strPrecomputedValue,
+                    pdctValues=dctValues,
+                    pobjRNG=objRNG
+                )
+            )
+        )
+
+    return tuple(lstOut)
+
+# %% tests
+def test_clean_texts_matches_reference():
+    lstDocuments = lstRandomDocuments(intCases, 1)
+
+    lstExpected = [
+        dctCleanTextReference(copy.deepcopy(dctData))
+        for dctData in lstDocuments
+    ]
+
+    assert mtp.lstCleanTexts(copy.deepcopy(lstDocuments)) == lstExpected
+    assert [
+        mtp.dctCleanText(copy.deepcopy(dctData)) for dctData in lstDocuments
+    ] == lstExpected
+
+def test_clean_render_matches_clean_texts(objGenerator):
+    objRNG = np.random.default_rng(2)
+    lstTemplates = objGenerator.objTemplateRegistry.lstTemplates
+
+    for intCase in range(intCases):
+        dctTemplate = lstTemplates[intCase % len(lstTemplates)]
+
+        if not objGenerator.blnBatchCompatible(dctTemplate):
+            continue
+
+        dctRaw, dctClean = tplRenderPair(
+            dctTemplate,
+            objGenerator.intRandomItemCount(objRNG),
+            intCase
+        )
+
+        assert mtp.lstCleanTexts([dctRaw]) == [dctClean]
+
+def test_numeric_batch_totals(objGenerator):
+    objRNG = np.random.default_rng(3)
+    lstTemplates = [
+        dctTemplate
+        for dctTemplate in objGenerator.objTemplateRegistry.lstTemplates
+        if objGenerator.blnBatchCompatible(dctTemplate)
+    ]
+
+    assert len(lstTemplates) > 0
+
+    lstBatch = [
+        lstTemplates[intCase % len(lstTemplates)]
+        for intCase in range(intCases)
+    ]
+    arrRepeats = np.array(
+        [objGenerator.intRandomItemCount(objRNG) for _ in lstBatch]
+    )
+
+    lstValues = objGenerator.lstRandomNumericBatch(
+        lstBatch,
+        arrRepeats,
+        objRNG
+    )
+
+    for dctTemplate, dctValues in zip(lstBatch, lstValues):
+        lstQuantity = [int(strValue) for strValue in dctValues['qty']]
+        lstRate = [int(strValue) for strValue in dctValues['rate']]
+        lstAmount = [int(strValue) for strValue in dctValues['amount']]
+
+        fltSubtotal = float(next(dctValues['subtotal']))
+        fltTax = float(next(dctValues['tax']))
+        fltTotal = float(next(dctValues['total']))
+
+        assert lstAmount == [
+            intQuantity * intRate
+            for intQuantity, intRate in zip(lstQuantity, lstRate)
+        ]
+
+        if dctTemplate['item'][objGenerator.strTokA] > 0:
+            assert fltSubtotal == sum(lstAmount)
+        else:
+            assert fltSubtotal == 0
+
+        if dctTemplate['fixed'][objGenerator.strTokTax] > 0:
+            assert fltTax == round(objGenerator.intTaxRate * fltSubtotal, 2)
+        else:
+            assert fltTax == 0
+
+        assert fltTotal == pytest.approx(fltSubtotal + fltTax)
+
+def test_find_tokens_matches_linear(objGenerator):
+    objRandom = random.Random(4)
+    lstTexts = list(objGenerator.objTemplateRegistry.lstTexts)
+
+    # random texts built from tokens and their fragments
+    lstPieces = objGenerator.lstTokens + [
+        strToken[:-1] for strToken in objGenerator.lstTokens
+    ] + list('[] x\n')
+
+    for _ in range(intCases):
+        lstTexts.append(
+            ''.join(objRandom.choice(lstPieces) for _ in range(30))
+        )
+
+    for strText in lstTexts:
+        assert token_scanner.lstFindTokens(
+            strText,
+            objGenerator.lstTokens
+        ) == token_scanner.lstFindTokensLinear(
+            strText,
+            objGenerator.lstTokens
+        )
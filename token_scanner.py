@@ -0,0 +1,213 @@
+# %% imports
+import re
+import timeit
+
+# %% definitions
+
+# number of repetitions of the microbenchmark
+intBenchmarkRuns = 2000
+
+# compiled patterns keyed by the tuple of their tokens
+dctPatterns = dict()
+
+# %% functions
+def objCompileTokenPattern(plstTokens: list) -> re.Pattern:
+    """Compile a single alternation pattern matching any of the tokens.
+
+    Inputs:
+        - plstTokens - list of tokens to look for
+
+    Outputs:
+        - objPattern - compiled regular expression, longer tokens are tried
+        first so a token is never shadowed by its own prefix
+    """
+
+    assert type(plstTokens) == list
+    assert len(plstTokens) > 0, 'There must be at least one token'
+
+    tplTokens = tuple(plstTokens)
+
+    # compile each list of tokens only once
+    if tplTokens not in dctPatterns:
+        strPattern = '|'.join(
+            re.escape(strToken)
+            for strToken in sorted(set(plstTokens), key=len, reverse=True)
+        )
+        dctPatterns[tplTokens] = re.compile(strPattern)
+
+    return dctPatterns[tplTokens]
+
+def lstFindTokens(pstrText: str, plstTokens: list) -> list:
+    """Return positions of all token occurrences in a single pass.
+
+    Inputs:
+        - pstrText - text to search for tokens
+        - plstTokens - list of tokens to look for
+
+    Outputs:
+        - lstPositions - list of (position, token) tuples ordered by position,
+        overlapping occurrences are not reported
+    """
+
+    assert type(pstrText) == str
+
+    objPattern = objCompileTokenPattern(plstTokens)
+
+    lstPositions = [
+        (objMatch.start(), objMatch.group())
+        for objMatch in objPattern.finditer(pstrText)
+    ]
+
+    return lstPositions
+
+def tplFindEarliestToken(pstrText: str, plstTokens: list) -> tuple:
+    """Return position of the earliest occurence of any of the tokens, together
+    with the token itself.
+
+    Inputs:
+        - pstrText - text to search for a token
+        - plstTokens - list of tokens to look for
+
+    Outputs:
+        - tplPosition - tuple of the earliest token and its position,
+        if no token is found, (-1, None) is returned
+    """
+
+    assert type(pstrText) == str
+
+    objMatch = objCompileTokenPattern(plstTokens).search(pstrText)
+
+    if objMatch is None:
+        return (-1, None)
+
+    tplPosition = (objMatch.start(), objMatch.group())
+
+    return tplPosition
+
+def tplFindEarliestTokenLinear(pstrText: str, plstTokens: list) -> tuple:
+    """Reference implementation searching the tokens one by one.
+
+    Inputs:
+        - pstrText - text to search for a token
+        - plstTokens - list of tokens to look for
+
+    Outputs:
+        - tplPosition - tuple of the earliest token and its position,
+        if no token is found, (-1, None) is returned
+    """
+
+    # initialize position and token values
+    tplPosition = (-1, None)
+
+    for strToken in plstTokens:
+        # locate the token in the string
+        intPosition = pstrText.find(strToken)
+
+        # remember the token if found on an earlier position
+        if intPosition >= 0:
+            # change the return position and token if earlier or first found
+            if intPosition < tplPosition[0]:
+                tplPosition = (intPosition, strToken)
+            elif tplPosition[0] == -1:
+                tplPosition = (intPosition, strToken)
+
+        # add a break optimization in case no token start found in
+        # the remaining part of the string
+        if not '[' in pstrText[:intPosition]:
+            break
+
+    return tplPosition
+
+def lstFindTokensLinear(pstrText: str, plstTokens: list) -> list:
+    """Reference implementation of lstFindTokens with repeated searches.
+
+    Inputs:
+        - pstrText - text to search for tokens
+        - plstTokens - list of tokens to look for
+
+    Outputs:
+        - lstPositions - list of (position, token) tuples ordered by position
+    """
+
+    lstPositions = []
+    intOffset = 0
+
+    # find the earliest token in the remaining text until there is none
+    intStart, strToken = tplFindEarliestTokenLinear(pstrText, plstTokens)
+
+    while intStart >= 0:
+        lstPositions.append((intOffset + intStart, strToken))
+
+        intOffset += intStart + len(strToken)
+        pstrText = pstrText[intStart + len(strToken):]
+        intStart, strToken = tplFindEarliestTokenLinear(pstrText, plstTokens)
+
+    return lstPositions
+
+def dctBenchmark(
+    pstrText: str,
+    plstTokens: list,
+    pintRuns: int = intBenchmarkRuns
+) -> dict:
+    """Compare the single-pass scanner with the linear token search.
+
+    Inputs:
+        - pstrText - text to scan
+        - plstTokens - list of tokens to look for
+        - pintRuns - number of scans of each implementation
+
+    Outputs:
+        - dctOut - average time of a full scan in microseconds for both
+        implementations and the speedup of the single-pass scanner
+    """
+
+    assert lstFindTokens(pstrText, plstTokens) == \
+        lstFindTokensLinear(pstrText, plstTokens), 'Results must be the same'
+
+    fltLinear = timeit.timeit(
+        lambda: lstFindTokensLinear(pstrText, plstTokens),
+        number=pintRuns
+    )
+    fltScanner = timeit.timeit(
+        lambda: lstFindTokens(pstrText, plstTokens),
+        number=pintRuns
+    )
+
+    dctOut = {
+        'tokens': len(lstFindTokens(pstrText, plstTokens)),
+        'length': len(pstrText),
+        'linear_us': fltLinear / pintRuns * 1e6,
+        'scanner_us': fltScanner / pintRuns * 1e6,
+        'speedup': fltLinear / fltScanner
+    }
+
+    return dctOut
+
+# %% run the microbenchmark
+if __name__ == '__main__':
+    import multithread_data_preparation as mdp
+
+    # scan the expanded templates with a growing number of items
+    mdp.objTemplateRegistry.blnRefresh()
+
+    for intItems in [1, 5, 20]:
+        for strName, strTemplate in zip(
+            mdp.objTemplateRegistry.lstNames,
+            mdp.objTemplateRegistry.lstTexts
+        ):
+            # expand the item list the same way as strRandomizeTemplateItems
+            intStart = strTemplate.find(mdp.strTokItemsStart) + \
+                len(mdp.strTokItemsStart)
+            intEnd = strTemplate.find(mdp.strTokItemsEnd)
+            strText = strTemplate[:intStart] + \
+                (strTemplate[intStart:intEnd] + '\n') * intItems + \
+                strTemplate[intEnd:]
+
+            dctResult = dctBenchmark(strText, mdp.lstTokens)
+            print(
+                f'{strName:16} items: {intItems:3} '
+                f'tokens: {dctResult["tokens"]:4} '
+                f'linear: {dctResult["linear_us"]:9.1f} us '
+                f'scanner: {dctResult["scanner_us"]:7.1f} us '
+                f'speedup: {dctResult["speedup"]:5.1f}x'
+            )
@@ -0,0 +1,387 @@
+# %% imports
+import numpy as np
+import pandas as pd
+import json
+import os
+import json_shards
+
+# %% definitions
+
+# folder of the store inside the vocabulary folder and file recording the
+# csv files the store was built from
+strStoreFolder = 'store'
+strSourcesName = 'sources.json'
+
+# file name parts of a single vocabulary in the store
+strDataSuffix = '.data.npy'
+strOffsetsSuffix = '.offsets.npy'
+strProbabilitySuffix = '.prob.npy'
+strAliasSuffix = '.alias.npy'
+
+# a column with this suffix next to a vocabulary column holds its weights
+strWeightSuffix = 'Weight'
+
+# %% functions
+def tplPackStrings(plstValues: list) -> tuple:
+    """Pack strings to a single UTF-8 buffer and an array of offsets.
+
+    Inputs:
+        - plstValues - list of strings
+
+    Outputs:
+        - tplOut - tuple of the uint8 array of concatenated encoded strings
+        and the int64 array of offsets, the value i occupies the bytes between
+        offsets i and i + 1
+    """
+
+    lstEncoded = [strValue.encode('utf-8') for strValue in plstValues]
+
+    arrOffsets = np.zeros(len(lstEncoded) + 1, dtype=np.int64)
+    np.cumsum([len(bytValue) for bytValue in lstEncoded], out=arrOffsets[1:])
+
+    arrData = np.frombuffer(b''.join(lstEncoded), dtype=np.uint8)
+
+    return arrData, arrOffsets
+
+def tplAliasTable(parrWeights: np.ndarray) -> tuple:
+    """Build an alias table for drawing indexes with given weights in O(1).
+
+    Inputs:
+        - parrWeights - array of non-negative weights, at least one positive
+
+    Outputs:
+        - tplOut - tuple of the acceptance probability and the alias index of
+        every column, column i is drawn uniformly and kept with its acceptance
+        probability, otherwise its alias is used
+    """
+
+    arrWeights = np.asarray(parrWeights, dtype=np.float64)
+
+    assert arrWeights.ndim == 1 and len(arrWeights) > 0, 'Weights are empty'
+    assert np.all(np.isfinite(arrWeights)), 'Weights must be finite'
+    assert np.all(arrWeights >= 0), 'Weights must not be negative'
+    assert arrWeights.sum() > 0, 'At least one weight must be positive'
+
+    intCount = len(arrWeights)
+
+    # scale the weights so that the average column is exactly full
+    arrScaled = arrWeights * (intCount / arrWeights.sum())
+    arrProbability = np.ones(intCount, dtype=np.float64)
+    arrAlias = np.arange(intCount, dtype=np.int64)
+
+    lstSmall = np.flatnonzero(arrScaled < 1).tolist()
+    lstLarge = np.flatnonzero(arrScaled >= 1).tolist()
+    lstScaled = arrScaled.tolist()
+
+    # fill every underfull column with the excess of an overfull one
+    while lstSmall and lstLarge:
+        intSmall = lstSmall.pop()
+        intLarge = lstLarge[-1]
+
+        arrProbability[intSmall] = lstScaled[intSmall]
+        arrAlias[intSmall] = intLarge
+
+        lstScaled[intLarge] += lstScaled[intSmall] - 1
+
+        if lstScaled[intLarge] < 1:
+            lstSmall.append(lstLarge.pop())
+
+    # the remaining columns are full up to rounding errors
+
+    return arrProbability, arrAlias
+
+def SaveArray(parrData: np.ndarray, pstrPath: str) -> None:
+    """Save an array as .npy under its final name in a single step.
+
+    Inputs:
+        - parrData - array to save
+        - pstrPath - full path of the .npy file
+    """
+
+    strTemp = json_shards.strTempPath(pstrPath)
+
+    with open(strTemp, 'wb') as objOut:
+        np.save(objOut, parrData)
+
+    os.replace(strTemp, pstrPath)
+
+def BuildVocabulary(
+    plstValues: list,
+    pstrPath: str,
+    pstrName: str,
+    parrWeights: np.ndarray = None
+) -> None:
+    """Save a single vocabulary to the store.
+
+    Inputs:
+        - plstValues - list of string values
+        - pstrPath - folder of the store
+        - pstrName - name of the vocabulary
+        - parrWeights - weights of the values, None for uniform sampling
+    """
+
+    assert len(plstValues) > 0, 'Vocabulary must not be empty'
+
+    arrData, arrOffsets = tplPackStrings(plstValues)
+
+    SaveArray(arrData, os.path.join(pstrPath, pstrName + strDataSuffix))
+    SaveArray(arrOffsets, os.path.join(pstrPath, pstrName + strOffsetsSuffix))
+
+    lstWeightPaths = [
+        os.path.join(pstrPath, pstrName + strProbabilitySuffix),
+        os.path.join(pstrPath, pstrName + strAliasSuffix)
+    ]
+
+    if parrWeights is None:
+        # remove the weights of an earlier build
+        for strPath in lstWeightPaths:
+            if os.path.isfile(strPath):
+                os.remove(strPath)
+    else:
+        assert len(parrWeights) == len(plstValues), \
+            'Every value must have a weight'
+
+        for arrTable, strPath in zip(
+            tplAliasTable(parrWeights),
+            lstWeightPaths
+        ):
+            SaveArray(arrTable, strPath)
+
+def dctSourceState(pstrPathData: str, pdctSources: dict) -> dict:
+    """Describe the vocabulary sources for the detection of later changes.
+
+    Inputs:
+        - pstrPathData - path to the folder with the vocabulary csv files
+        - pdctSources - dictionary of (file name, column) tuples keyed by the
+        vocabulary name
+
+    Outputs:
+        - dctOut - dictionary with the [file name, column] lists keyed by the
+        vocabulary name under 'sources' and the size and modification time in
+        nanoseconds of every csv file keyed by its name under 'files'
+    """
+
+    dctFiles = dict()
+
+    for strFile, strColumn in pdctSources.values():
+        objStat = os.stat(os.path.join(pstrPathData, strFile))
+
+        dctFiles[strFile] = {
+            'size': objStat.st_size,
+            'mtime_ns': objStat.st_mtime_ns
+        }
+
+    dctOut = {
+        'sources': {
+            strKey: [strFile, strColumn]
+            for strKey, (strFile, strColumn) in pdctSources.items()
+        },
+        'files': dctFiles
+    }
+
+    return dctOut
+
+def BuildStore(
+    pstrPathData: str,
+    pdctSources: dict,
+    pstrPathStore: str = None
+) -> None:
+    """Build the store of all vocabularies from their csv files.
+
+    A column named as the vocabulary column with the weight suffix, e.g.
+    'StreetWeight', holds the weights of the values. The state of the csv
+    files is saved last, see blnStoreCurrent.
+
+    Inputs:
+        - pstrPathData - path to the folder with the vocabulary csv files
+        - pdctSources - dictionary of (file name, column) tuples keyed by the
+        vocabulary name
+        - pstrPathStore - folder of the store, None for the store folder in
+        pstrPathData
+    """
+
+    if pstrPathStore is None:
+        pstrPathStore = os.path.join(pstrPathData, strStoreFolder)
+
+    os.makedirs(pstrPathStore, exist_ok=True)
+
+    # record the sources as they are before reading them
+    dctState = dctSourceState(pstrPathData, pdctSources)
+
+    dctFrames = dict()
+
+    for strKey, (strFile, strColumn) in pdctSources.items():
+        # read every file only once, keep all values as strings
+        if strFile not in dctFrames:
+            dctFrames[strFile] = pd.read_csv(
+                os.path.join(pstrPathData, strFile),
+                encoding='latin-1',
+                dtype=str
+            )
+
+        dtfSource = dctFrames[strFile]
+        arrWeights = None
+
+        if strColumn + strWeightSuffix in dtfSource.columns:
+            arrWeights = dtfSource[strColumn + strWeightSuffix].to_numpy(
+                dtype=np.float64
+            )
+
+        BuildVocabulary(
+            dtfSource[strColumn].to_numpy(dtype=str).tolist(),
+            pstrPathStore,
+            strKey,
+            arrWeights
+        )
+
+    strPath = os.path.join(pstrPathStore, strSourcesName)
+    strTemp = json_shards.strTempPath(strPath)
+
+    with open(strTemp, 'w') as objOut:
+        json.dump(dctState, objOut, indent=4)
+
+    os.replace(strTemp, strPath)
+
+def blnStoreCurrent(
+    pstrPathStore: str,
+    pstrPathData: str,
+    pdctSources: dict
+) -> bool:
+    """Check whether the store was built from the current csv files.
+
+    Inputs:
+        - pstrPathStore - folder of the store
+        - pstrPathData - path to the folder with the vocabulary csv files
+        - pdctSources - dictionary of (file name, column) tuples keyed by the
+        vocabulary name
+
+    Outputs:
+        - blnOut - True if the strings of every vocabulary are stored and
+        the sources, the size and the modification time of the csv files
+        match the build
+    """
+
+    strPath = os.path.join(pstrPathStore, strSourcesName)
+
+    if not os.path.isfile(strPath):
+        return False
+
+    with open(strPath) as objFile:
+        dctRecorded = json.load(objFile)
+
+    blnOut = dctRecorded == dctSourceState(pstrPathData, pdctSources) and \
+        all(
+            os.path.isfile(os.path.join(pstrPathStore, strName + strSuffix))
+            for strName in pdctSources.keys()
+            for strSuffix in [strDataSuffix, strOffsetsSuffix]
+        )
+
+    return blnOut
+
+class MappedVocabulary:
+    """Read-only vocabulary memory-mapped from the store.
+
+    The strings are kept as a single UTF-8 buffer with an offsets array, so
+    all processes share the pages of the same files and only the drawn
+    values are decoded. Vocabularies with weights are sampled through their
+    alias table with the same cost as the uniform ones.
+    """
+
+    def __init__(self, pstrPath: str, pstrName: str):
+        """Map the arrays of a single vocabulary of the store.
+
+        Inputs:
+            - pstrPath - folder of the store
+            - pstrName - name of the vocabulary
+        """
+
+        self.arrData = np.load(
+            os.path.join(pstrPath, pstrName + strDataSuffix),
+            mmap_mode='r'
+        )
+        self.arrOffsets = np.load(
+            os.path.join(pstrPath, pstrName + strOffsetsSuffix),
+            mmap_mode='r'
+        )
+
+        assert len(self.arrOffsets) > 1, 'Vocabulary must not be empty'
+
+        # load the alias table of weighted vocabularies
+        strProbability = os.path.join(
+            pstrPath,
+            pstrName + strProbabilitySuffix
+        )
+
+        if os.path.isfile(strProbability):
+            self.arrProbability = np.load(strProbability, mmap_mode='r')
+            self.arrAlias = np.load(
+                os.path.join(pstrPath, pstrName + strAliasSuffix),
+                mmap_mode='r'
+            )
+        else:
+            self.arrProbability = None
+            self.arrAlias = None
+
+    def __len__(self) -> int:
+        return len(self.arrOffsets) - 1
+
+    def __getitem__(self, pintIndex: int) -> str:
+        return self.lstTake([pintIndex])[0]
+
+    def arrDrawIndexes(
+        self,
+        pobjRNG: np.random.Generator,
+        pintSize: int
+    ) -> np.ndarray:
+        """Draw random indexes of the vocabulary values.
+
+        Inputs:
+            - pobjRNG - random number generator of the current shard
+            - pintSize - number of indexes to draw
+
+        Outputs:
+            - arrIndexes - indexes drawn uniformly, or by the weights of the
+            values if the vocabulary has them
+        """
+
+        arrIndexes = pobjRNG.integers(0, len(self), size=pintSize)
+
+        if self.arrProbability is not None:
+            # keep the column with its probability, otherwise use its alias
+            arrKeep = pobjRNG.random(pintSize) < \
+                self.arrProbability[arrIndexes]
+            arrIndexes = np.where(
+                arrKeep,
+                arrIndexes,
+                self.arrAlias[arrIndexes]
+            )
+
+        return arrIndexes
+
+    def lstTake(self, parrIndexes) -> list:
+        """Decode the values at the given indexes.
+
+        Inputs:
+            - parrIndexes - array or list of indexes
+
+        Outputs:
+            - lstValues - list of the decoded strings
+        """
+
+        arrIndexes = np.asarray(parrIndexes, dtype=np.int64)
+
+        lstValues = [
+            self.arrData[intStart:intEnd].tobytes().decode('utf-8')
+            for intStart, intEnd in zip(
+                self.arrOffsets[arrIndexes].tolist(),
+                self.arrOffsets[arrIndexes + 1].tolist()
+            )
+        ]
+
+        return lstValues
+
+# %% build the store
+if __name__ == '__main__':
+    import multithread_data_preparation as mdp
+
+    BuildStore(mdp.strPathData, mdp.dctVocabularySources)